@@ -1,18 +1,63 @@
-import re
 import os
+import sys
+import zipfile
+import argparse
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
-from textblob import TextBlob
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud, STOPWORDS
+# modules shared with the Twitter pipeline, found from the path of this file
+# instead of the working directory
+TWITTER_SCRIPT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   os.pardir, 'twitter_sent_analysis'))
+if not os.path.isfile(os.path.join(TWITTER_SCRIPT_DIR, 'sentiment_engine.py')):
+    raise ImportError(f"The modules shared with the Twitter pipeline are not in {TWITTER_SCRIPT_DIR}, "
+                      + "rotten_tomatoes_movie_reviews_sent_analysis must stay next to twitter_sent_analysis")
+if TWITTER_SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, TWITTER_SCRIPT_DIR)
+from nltk_resources import english_stopwords
+from lemma_cache import LemmaCache
+from text_normalizer import TextNormalizer
+from sentiment_engine import SentimentEngine
+from sentiment_engine import SCORING_BACKENDS
+from sentiment_engine import polarity_to_review_labels
+from pipeline_metrics import METRICS
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
+
+RT_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'sentiment-analysis-on-movie-reviews.zip')
+REVIEW_LABELS = (0, 1, 2, 3, 4)
+
+# phrase normalizer of a cleaning worker process, created by _init_phrase_cleaner
+_phrase_normalizer = None
+
+
+def new_phrase_normalizer(lemma_cache=None):
+    """ Return the TextNormalizer of the review phrases """
+    # phrases have no urls, mentions or retweet markers and keep digits and single chars
+    return TextNormalizer(english_stopwords(),
+                          lemma_cache,
+                          strip_urls=False,
+                          strip_mentions=False,
+                          strip_retweet_marker=False,
+                          keep_digits=True,
+                          min_token_len=1)
+
 
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
+def _init_phrase_cleaner(lemma_cache_path):
+    global _phrase_normalizer
+    # a warm cache saved by earlier runs is read by every worker
+    _phrase_normalizer = new_phrase_normalizer(LemmaCache(path=lemma_cache_path, track_new=True))
 
-import nltk
-nltk.download('stopwords')
-nltk.download('wordnet')
+
+def _clean_phrases(phrases):
+    """ Return the clean phrases and the lemmas the worker computed for them,
+        which are merged into the cache of the parent """
+    clean_phrases = [_phrase_normalizer.normalize(phrase) for phrase in phrases]
+    return clean_phrases, _phrase_normalizer.lemma_cache.pop_new_lemmas()
 
 
 class MovieReviewObject:
@@ -20,33 +65,42 @@ class MovieReviewObject:
     def __init__(self):
         self.review_data = pd.DataFrame()
 
-    def get_df_from_file(self, data_file, sep='\t'):
-        return pd.read_csv('data/train.tsv',
-                           sep='\t',
-                           header=0)
-
-    def preprocess(self, review_df):
-        ''' lowercase, remove non-alnum chars, remove stop words, and lemmatize '''
-        stopwords_set = set(stopwords.words('english'))
-        wordnet_lemmatizer = WordNetLemmatizer()
+    def get_df_from_file(self, data_file=RT_DATA_FILE, sep='\t', member='train.tsv'):
+        """ Read data_file, or its member file when data_file is the Kaggle zip """
+        return pd.concat(self.iter_df_chunks_from_file(data_file, None, sep, member))
 
-        def normalize(word):
-            return ' '.join([wordnet_lemmatizer.lemmatize(
-                word) for word in word.lower().split() if word not in stopwords_set])
+    def iter_df_chunks_from_file(self, data_file=RT_DATA_FILE, chunksize=20000,
+                                 sep='\t', member='train.tsv'):
+        """ Yield data_file, or its member file when data_file is the Kaggle
+            zip, as dataframes of chunksize rows without extracting the zip.
+            A chunksize of None yields the whole file at once """
+        if data_file.endswith('.zip'):
+            with zipfile.ZipFile(data_file) as data_zip, data_zip.open(member) as tsv_file:
+                yield from self._read_tsv_chunks(tsv_file, chunksize, sep)
+        else:
+            with open(data_file, 'rb') as tsv_file:
+                yield from self._read_tsv_chunks(tsv_file, chunksize, sep)
 
-        phrase_col_name = 'Phrase'
-        review_df['cleanPhrase'] = review_df[phrase_col_name]
-        exclude = ['[^a-zA-Z0-9]']
-        exclude = '|'.join(exclude)
+    @staticmethod
+    def _read_tsv_chunks(tsv_file, chunksize, sep):
+        if chunksize is None:
+            yield pd.read_csv(tsv_file, sep=sep, header=0)
+        else:
+            yield from pd.read_csv(tsv_file, sep=sep, header=0, chunksize=chunksize)
 
-        review_df['cleanPhrase'].replace(
-            to_replace=exclude, value=" ", regex=True, inplace=True)
+    def preprocess(self, review_df, lemma_cache=None):
+        ''' lowercase, remove non-alnum chars, remove stop words, and lemmatize.
+            Duplicated phrases are normalized once '''
+        phrase_normalizer = new_phrase_normalizer(lemma_cache)
 
-        review_df['cleanPhrase'] = review_df['cleanPhrase'].apply(normalize)
+        phrase_col_name = 'Phrase'
+        review_df['cleanPhrase'] = phrase_normalizer.normalize_column(
+            review_df[phrase_col_name])
 
         return review_df
 
     def generate_sentiment(self, text):
+        from textblob import TextBlob
         text_analysis = TextBlob(text)
         negative_bound = -0.3
         positive_bound = 0.3
@@ -64,18 +118,158 @@ class MovieReviewObject:
             return 0   # negative
 
 
-def main():
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Generate sentiment for Rotten Tomatoes movie review phrases and report the accuracy")
+
+    parser.add_argument('-workers',
+                        '--workers',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Number of processes cleaning and scoring phrases, defaults to the number of cores")
+    parser.add_argument('-backend',
+                        '--backend',
+                        type=str,
+                        choices=SCORING_BACKENDS,
+                        action='store',
+                        default="textblob",
+                        help="Sentiment scoring backend, lexicon is a fast vectorized version of textblob")
+    parser.add_argument('-agreement',
+                        '--agreement',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        const=10000,
+                        default=None,
+                        help="Report the label agreement of the backend with TextBlob on this many phrases")
+    parser.add_argument('-sentiment_cache',
+                        '--sentiment_cache',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/sentiment_cache.sqlite",
+                        default=None,
+                        help="SQLite file caching the polarity of every clean text between runs")
+    parser.add_argument('--sentiment_cache_size',
+                        type=int,
+                        action='store',
+                        default=5000000,
+                        help="Max number of texts kept in the sentiment cache, the least recently used are evicted")
+    parser.add_argument('-lemma_cache',
+                        '--lemma_cache',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/lemma_cache.pkl",
+                        default=None,
+                        help="File persisting the token to lemma cache between runs")
+    parser.add_argument('-data',
+                        '--data_file',
+                        type=str,
+                        action='store',
+                        default=RT_DATA_FILE,
+                        help="The Kaggle zip, read without extracting it, or train.tsv")
+    parser.add_argument('-chunk',
+                        '--chunksize',
+                        type=int,
+                        action='store',
+                        default=20000,
+                        help="Number of phrases read and cleaned per chunk")
+    add_metrics_args(parser)
+
+    return parser.parse_args()
+
+
+def clean_unique_phrases(rotrev, argparse_obj, lemma_cache):
+    """ Stream the phrases of the data file in chunks and clean every distinct
+        phrase once across worker processes. Return the labels, the index of
+        every phrase in the unique phrases and the clean unique phrases """
+    n_workers = argparse_obj.workers or os.cpu_count() or 1
+    phrase_codes = {}
+    code_chunks, label_chunks, clean_chunks = [], [], []
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers,
+                                       initializer=_init_phrase_cleaner,
+                                       initargs=(argparse_obj.lemma_cache,))
+    else:
+        phrase_normalizer = new_phrase_normalizer(lemma_cache)
+    try:
+        for chunk_df in rotrev.iter_df_chunks_from_file(argparse_obj.data_file, argparse_obj.chunksize):
+            new_phrases = []
+            codes = np.empty(len(chunk_df), dtype=np.int64)
+            for row_index, phrase in enumerate(chunk_df['Phrase'].fillna('')):
+                code = phrase_codes.get(phrase)
+                if code is None:
+                    code = phrase_codes[phrase] = len(phrase_codes)
+                    new_phrases.append(phrase)
+                codes[row_index] = code
+            code_chunks.append(codes)
+            label_chunks.append(chunk_df['Sentiment'].to_numpy())
+            # the next chunk is read while the workers clean this one
+            clean_chunks.append(executor.submit(_clean_phrases, new_phrases) if executor
+                                else [phrase_normalizer.normalize(phrase) for phrase in new_phrases])
+        clean_phrases = []
+        for clean_chunk in clean_chunks:
+            if executor:
+                clean_chunk, new_lemmas = clean_chunk.result()
+                lemma_cache.update(new_lemmas)
+            clean_phrases.extend(clean_chunk)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return np.concatenate(label_chunks), np.concatenate(code_chunks), clean_phrases
+
+
+def print_evaluation(labels, predictions, elapsed_secs):
+    """ Print the accuracy, the confusion matrix and the throughput """
+    print(f"Accuracy = {np.mean(predictions == labels):.4f} on {len(labels)} phrases")
+    confusion_matrix = pd.crosstab(pd.Categorical(labels, categories=REVIEW_LABELS),
+                                   pd.Categorical(predictions, categories=REVIEW_LABELS),
+                                   rownames=['label'], colnames=['predicted'], dropna=False)
+    print(confusion_matrix)
+    print(f"Evaluated {len(labels) / elapsed_secs:.0f} phrases/s in {elapsed_secs:.2f} s")
+
+
+def evaluate_reviews(argparse_obj, lemma_cache):
+    """ Clean and score the phrases of the data file and compare the
+        predicted sentiment with their labels. Duplicate phrases and
+        duplicate clean phrases are cleaned and scored once """
+    start = perf_counter()
     rotrev = MovieReviewObject()
-    rotrev_df = rotrev.get_df_from_file('data/train.tsv')
-    rotrev_df = rotrev.preprocess(rotrev_df)
+    labels, phrase_codes, clean_phrases = clean_unique_phrases(rotrev, argparse_obj, lemma_cache)
+    print(f"Cleaned {len(clean_phrases)} distinct phrases of {len(labels)} "
+          + f"in {perf_counter() - start:.2f} s")
 
-    rotrev_df['sentiment'] = rotrev_df['cleanPhrase'].apply(
-        rotrev.generate_sentiment)
+    with SentimentEngine(argparse_obj.workers,
+                         backend=argparse_obj.backend,
+                         cache_path=argparse_obj.sentiment_cache,
+                         cache_max_entries=argparse_obj.sentiment_cache_size) as sentiment_engine:
+        if argparse_obj.agreement:
+            sentiment_engine.print_agreement_report(clean_phrases,
+                                                    polarity_to_review_labels,
+                                                    argparse_obj.agreement)
+        # the engine scores every distinct clean phrase once
+        predictions = sentiment_engine.review_labels(clean_phrases)[phrase_codes]
 
-    rotrev_df['Correct'] = (rotrev_df['sentiment'] == rotrev_df['Sentiment'])
-    rotrev_df_value_counts = rotrev_df['Correct'].value_counts()
-    print(
-        f"Accuracy ={rotrev_df_value_counts[True] / (rotrev_df_value_counts[True]+rotrev_df_value_counts[False])}")
+    print_evaluation(labels, predictions, perf_counter() - start)
+    return predictions
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    configure_metrics(argparse_obj)
+    lemma_cache = LemmaCache(path=argparse_obj.lemma_cache)
+    try:
+        evaluate_reviews(argparse_obj, lemma_cache)
+    finally:
+        # with several workers the lemmas they computed were merged into the cache
+        if lemma_cache.hits or lemma_cache.misses:
+            lemma_cache.print_stats()
+        lemma_cache.save()
+        METRICS.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,563 @@
+"""
+Asyncio ingestion runtime that fans one stream of tweets out to several sinks in
+a single process: gzip JSONL archives, the MySQL table and an in-process scoring
+stage. The source is injectable (the live Twitter stream, a local ReplayStreamSource
+stand-in or a replay of archived files), payloads are parsed off the event loop,
+and every sink has its own bounded queues, forwarding task and thread so that a
+slow sink does not hold up the others
+"""
+import glob
+import asyncio
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Tuple
+
+from jsonl_sink import RotatingJsonlSink
+from stream_replay import ReplayStreamSource
+from stream_replay import read_jsonl_payloads
+from synthetic_tweets import SyntheticTweetGenerator
+from tweet_extractor import loads
+from tweet_extractor import tweet_row_from_json
+from twitter_config_loader import print_error
+from pipeline_metrics import METRICS
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
+
+if TYPE_CHECKING:
+    from mysql_tweet_writer import MySQLTweetWriter
+    from parquet_store import ParquetTweetWriter
+    from sentiment_engine import SentimentEngine
+    from text_normalizer import TextNormalizer
+
+SINK_POLICIES = ("block", "drop")
+
+# put on the payload and sink queues to end them
+_STOP = object()
+
+
+def parse_payloads(payloads: List[str]) -> List[Tuple[str, dict]]:
+    ''' Return (payload, tweet) for every payload, with tweet None
+        for stream messages that are not tweets '''
+    records = []
+    for payload in payloads:
+        try:
+            tweet = loads(payload)
+        except ValueError:
+            tweet = None
+        if tweet is not None and 'id' not in tweet:
+            tweet = None
+        records.append((payload, tweet))
+    return records
+
+
+class ThreadedSource:
+    ''' Runs a blocking producer such as tweepy's Stream.filter in a daemon thread.
+    produce(put) is called with a put(payload) that waits while the runtime's
+    payload queue is full, which holds up the stream like the "block" policy
+    of TweetPipeline '''
+
+    def __init__(self, produce: Callable[[Callable[[str], bool]], None]) -> None:
+        self.produce_payloads = produce
+
+    async def produce(self, emit) -> None:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def put(payload) -> bool:
+            asyncio.run_coroutine_threadsafe(emit(payload), loop).result()
+            return True
+
+        def run() -> None:
+            try:
+                self.produce_payloads(put)
+                loop.call_soon_threadsafe(done.set_result, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(done.set_exception, e)
+
+        # a daemon thread does not keep a live stream open on exit
+        threading.Thread(target=run, name="ingest_source", daemon=True).start()
+        await done
+
+
+class _PutPipeline:
+    ''' Stands in for TweetPipeline in the stream listeners of the download scripts '''
+
+    def __init__(self, put: Callable[[str], bool]) -> None:
+        self.put = put
+
+
+def twitter_stream_source(api, stream_source=None, **filters) -> ThreadedSource:
+    ''' Source of the live Twitter stream matching filters, or of stream_source
+        such as a ReplayStreamSource when given '''
+    from download_tweets_data_as_json import download_tweets_by_filters
+
+    return ThreadedSource(lambda put: download_tweets_by_filters(
+        api, _PutPipeline(put), stream_source=stream_source, **filters))
+
+
+def file_replay_source(json_paths: List[str]) -> ThreadedSource:
+    ''' Source of the payloads archived in .jsonl.gz files '''
+    def produce(put) -> None:
+        for payload in read_jsonl_payloads(json_paths):
+            put(payload)
+    return ThreadedSource(produce)
+
+
+class AsyncSink:
+    ''' Base class of the sinks. Batches of (payload, tweet) records wait in a
+    queue of max_batches and handle_batch runs in the sink's own thread. When
+    the queue is full the "drop" policy discards the batch, and the "block"
+    policy keeps it in a backlog of max_backlog batches that the sink's own
+    forwarding task moves to the queue as it frees up, so only this sink waits.
+    The runtime, and so the source and the other sinks, waits only when the
+    backlog is full too, which bounds the memory held for a stalled sink '''
+
+    name = "sink"
+
+    def __init__(self, max_batches: int = 100, policy: str = "block", max_backlog: int = 100) -> None:
+        if policy not in SINK_POLICIES:
+            raise ValueError(f"policy must be one of {SINK_POLICIES}, got {policy}")
+        self.max_batches = max_batches
+        self.policy = policy
+        self.max_backlog = max_backlog
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}_sink")
+        self.queue = None
+        self.backlog = None
+        self.handled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+    def handle_batch(self, records: List[Tuple[str, dict]]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        ''' Called in the sink's thread after the last batch '''
+
+    def start(self) -> List[asyncio.Future]:
+        ''' Create the queues and start the forwarding and handling tasks '''
+        self.queue = asyncio.Queue(maxsize=self.max_batches)
+        self.backlog = asyncio.Queue(maxsize=self.max_backlog)
+        return [asyncio.ensure_future(self.forward()), asyncio.ensure_future(self.run())]
+
+    async def offer(self, records: List[Tuple[str, dict]]) -> None:
+        ''' Called by the runtime with every batch, and with _STOP after the last one '''
+        if self.policy == "block" or records is _STOP:
+            await self.backlog.put(records)
+            return
+        try:
+            self.queue.put_nowait(records)
+        except asyncio.QueueFull:
+            self.dropped += len(records)
+            METRICS.increment(f"sink_{self.name}_dropped_total", len(records))
+            return
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def forward(self) -> None:
+        ''' Move the backlog to the queue, waiting on this sink's queue alone '''
+        while True:
+            records = await self.backlog.get()
+            await self.queue.put(records)
+            if records is _STOP:
+                break
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            records = await self.queue.get()
+            if records is _STOP:
+                break
+            try:
+                with METRICS.stage(f"sink_{self.name}", len(records)):
+                    await loop.run_in_executor(self._executor, self.handle_batch, records)
+                self.handled += len(records)
+            except Exception:
+                print_error()
+                self.failed += len(records)
+        await loop.run_in_executor(self._executor, self.close)
+        self._executor.shutdown()
+
+    def stats(self) -> dict:
+        return {"handled": self.handled,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "max_queue_depth": self.max_queue_depth}
+
+
+class JsonlArchiveSink(AsyncSink):
+    ''' Appends every raw payload to rotating .jsonl.gz segments '''
+
+    name = "jsonl"
+
+    def __init__(self, json_sink: 'RotatingJsonlSink', **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.json_sink = json_sink
+
+    def handle_batch(self, records) -> None:
+        for payload, _ in records:
+            self.json_sink.write(payload)
+
+    def close(self) -> None:
+        self.json_sink.close()
+
+
+class MySQLSink(AsyncSink):
+    ''' Buffers the tweets in a MySQLTweetWriter, which inserts them in batches '''
+
+    name = "mysql"
+
+    def __init__(self, tweet_writer: 'MySQLTweetWriter', **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.tweet_writer = tweet_writer
+
+    def handle_batch(self, records) -> None:
+        for _, tweet in records:
+            tweet_row = tweet_row_from_json(tweet) if tweet is not None else None
+            if tweet_row is not None:
+                self.tweet_writer.add(tweet_row)
+
+    def close(self) -> None:
+        self.tweet_writer.close()
+
+
+class ScoringSink(AsyncSink):
+    ''' Cleans and scores the tweets as they arrive, counts their sentiment
+    and appends them to a ParquetTweetWriter if one is given '''
+
+    name = "score"
+
+    def __init__(self, sentiment_engine: 'SentimentEngine', text_normalizer: 'TextNormalizer',
+                 parquet_writer: 'ParquetTweetWriter' = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.sentiment_engine = sentiment_engine
+        self.text_normalizer = text_normalizer
+        self.parquet_writer = parquet_writer
+        self.sentiment_counts = Counter()
+
+    def handle_batch(self, records) -> None:
+        import pandas as pd
+
+        tweets = [tweet for _, tweet in records if tweet is not None and 'text' in tweet]
+        if not tweets:
+            return
+        tweet_df = pd.DataFrame({'created_at': pd.to_datetime([tweet.get('created_at') for tweet in tweets],
+                                                              format="%a %b %d %H:%M:%S %z %Y",
+                                                              errors='coerce', utc=True).tz_localize(None),
+                                 'tweet': [tweet['text'] for tweet in tweets]})
+        tweet_df['clean_tweets'] = self.text_normalizer.normalize_column(tweet_df['tweet'])
+        tweet_df['sentiment'] = self.sentiment_engine.tweet_labels(tweet_df['clean_tweets'])
+        self.sentiment_counts.update(tweet_df['sentiment'].value_counts().to_dict())
+        if self.parquet_writer is not None:
+            self.parquet_writer.write(tweet_df.drop(columns='tweet'))
+
+    def close(self) -> None:
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        self.sentiment_engine.close()
+        total = sum(self.sentiment_counts.values())
+        if total:
+            print(f"Scored {total} tweets: "
+                  + ", ".join(f"{name} {self.sentiment_counts.get(label, 0) / total * 100:.2f}%"
+                              for label, name in ((1, "positive"), (0, "neutral"), (-1, "negative"))))
+
+
+class AsyncIngestRuntime:
+    ''' Reads payloads from source into a queue of max_queue payloads, parses
+    them in batches of batch_size, or of what arrived within batch_secs, in
+    parse_executor and offers every parsed batch to all sinks, which queue it
+    without waiting for one another '''
+
+    def __init__(self,
+                 source,
+                 sinks: List[AsyncSink],
+                 batch_size: int = 500,
+                 batch_secs: float = 1.0,
+                 max_queue: int = 10000,
+                 parse_executor=None) -> None:
+        self.source = source
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.batch_secs = batch_secs
+        self.max_queue = max_queue
+        self.parse_executor = parse_executor or ThreadPoolExecutor(max_workers=1,
+                                                                   thread_name_prefix="ingest_parse")
+        self.received = 0
+        self.batches = 0
+
+    async def _read_source(self, payload_queue: asyncio.Queue) -> None:
+        try:
+            await self.source.produce(payload_queue.put)
+        finally:
+            await payload_queue.put(_STOP)
+
+    async def _next_batch(self, payload_queue: asyncio.Queue) -> Tuple[List[str], bool]:
+        ''' Return the next batch of payloads and whether the source ended '''
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = loop.time() + self.batch_secs
+        while len(batch) < self.batch_size:
+            try:
+                payload = await asyncio.wait_for(payload_queue.get(),
+                                                 max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                # a quiet stream still reaches the sinks every batch_secs
+                break
+            if payload is _STOP:
+                return batch, True
+            batch.append(payload)
+        return batch, False
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        payload_queue = asyncio.Queue(maxsize=self.max_queue)
+        sink_tasks = []
+        for sink in self.sinks:
+            sink_tasks += sink.start()
+            METRICS.register_gauge(f"sink_{sink.name}_queue_depth", sink.queue.qsize)
+            METRICS.register_gauge(f"sink_{sink.name}_backlog_depth", sink.backlog.qsize)
+        METRICS.register_gauge("ingest_payload_queue_depth", payload_queue.qsize)
+        source_task = asyncio.ensure_future(self._read_source(payload_queue))
+
+        try:
+            source_ended = False
+            while not source_ended:
+                batch, source_ended = await self._next_batch(payload_queue)
+                if not batch:
+                    continue
+                with METRICS.stage("ingest_parse", len(batch)):
+                    records = await loop.run_in_executor(self.parse_executor, parse_payloads, batch)
+                self.received += len(batch)
+                self.batches += 1
+                for sink in self.sinks:
+                    await sink.offer(records)
+        finally:
+            # the sinks handle what they have queued before closing
+            for sink in self.sinks:
+                await sink.offer(_STOP)
+            await asyncio.gather(*sink_tasks)
+            self.parse_executor.shutdown()
+            if not source_task.done():
+                source_task.cancel()
+            elif source_task.exception() is not None:
+                raise source_task.exception()
+
+    def print_stats(self) -> None:
+        print(f"Received {self.received} payloads in {self.batches} batches")
+        for sink in self.sinks:
+            stats = sink.stats()
+            print(f"\t{sink.name} sink ({sink.policy}) handled {stats['handled']}, "
+                  + f"dropped {stats['dropped']}, failed {stats['failed']}, "
+                  + f"max queue depth {stats['max_queue_depth']} batches")
+
+
+def build_source(argparse_obj):
+    if argparse_obj.json_glob:
+        return file_replay_source(sorted(glob.glob(argparse_obj.json_glob)))
+    if argparse_obj.synthetic:
+        tweet_generator = SyntheticTweetGenerator(seed=0)
+        return twitter_stream_source(None, ReplayStreamSource(tweet_generator.payloads(argparse_obj.synthetic),
+                                                              rate=argparse_obj.rate))
+
+    from twitter_config_loader import TwitterConfig
+    from download_tweets_data_as_json import TweepyConfig
+    from download_tweets_data_as_json import validate_file_and_rtn_filter_list
+
+    api = TweepyConfig(TwitterConfig()).tweepy_api()
+    return twitter_stream_source(api,
+                                 track=validate_file_and_rtn_filter_list(argparse_obj.track),
+                                 follow=validate_file_and_rtn_filter_list(argparse_obj.follow),
+                                 locations=validate_file_and_rtn_filter_list(argparse_obj.locations),
+                                 languages=['en'])
+
+
+def build_sinks(argparse_obj) -> List[AsyncSink]:
+    policies = dict(policy.split("=", 1) for policy in argparse_obj.sink_policy)
+    sinks = []
+    if argparse_obj.jsonl:
+        sinks.append(JsonlArchiveSink(RotatingJsonlSink(argparse_obj.jsonl),
+                                      max_batches=argparse_obj.sink_queue,
+                                      policy=policies.get("jsonl", "block"),
+                                      max_backlog=argparse_obj.sink_backlog))
+    if argparse_obj.mysql:
+        from twitter_config_loader import TwitterConfig
+        from mysql_tweet_writer import MySQLTweetWriter
+
+        sinks.append(MySQLSink(MySQLTweetWriter(TwitterConfig(), batch_size=argparse_obj.mysql_batch_size),
+                               max_batches=argparse_obj.sink_queue,
+                               policy=policies.get("mysql", "drop"),
+                               max_backlog=argparse_obj.sink_backlog))
+    if argparse_obj.score:
+        from nltk_resources import english_stopwords
+        from lemma_cache import LemmaCache
+        from text_normalizer import TextNormalizer
+        from sentiment_engine import SentimentEngine
+        from parquet_store import ParquetTweetWriter
+
+        sinks.append(ScoringSink(SentimentEngine(argparse_obj.score_workers, backend=argparse_obj.backend),
+                                 TextNormalizer(english_stopwords(), LemmaCache()),
+                                 ParquetTweetWriter(argparse_obj.parquet_dir) if argparse_obj.parquet_dir else None,
+                                 max_batches=argparse_obj.sink_queue,
+                                 policy=policies.get("score", "drop"),
+                                 max_backlog=argparse_obj.sink_backlog))
+    return sinks
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Stream tweets into several sinks at once with an asyncio runtime")
+
+    parser.add_argument('-t',
+                        '--track',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing keywords i.e. batman,joker")
+    parser.add_argument('-f',
+                        '--follow',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing userids i.e. 25073877")
+    parser.add_argument('-l',
+                        '--locations',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing geo-locations i.e. -122.75,36.8,-121.75,37.8,-74,40,-73,41")
+    parser.add_argument('-j',
+                        '--json_glob',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Replay the payloads of these .jsonl.gz files instead of the live stream")
+    parser.add_argument('--synthetic',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Stream this many synthetic tweets from a local stand-in instead of the live stream")
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        action='store',
+                        default=1000.0,
+                        help="Tweets per second of --synthetic, 0 for as fast as the runtime accepts")
+    parser.add_argument('--jsonl',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="json",
+                        default=None,
+                        help="Archive the raw payloads as .jsonl.gz segments in this directory")
+    parser.add_argument('--mysql',
+                        action='store_true',
+                        help="Insert the tweets into the MySQL table of twitter_configuration.ini")
+    parser.add_argument('--mysql_batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of tweets per batched insert into MySQL")
+    parser.add_argument('--score',
+                        action='store_true',
+                        help="Clean and score the tweets in-process and print their sentiment")
+    parser.add_argument('-backend',
+                        '--backend',
+                        type=str,
+                        choices=("textblob", "lexicon"),
+                        action='store',
+                        default="textblob",
+                        help="Sentiment scoring backend of --score, lexicon is a fast vectorized version of textblob")
+    parser.add_argument('--score_workers',
+                        type=int,
+                        action='store',
+                        default=1,
+                        help="Number of processes scoring sentiment in --score")
+    parser.add_argument('-parquet',
+                        '--parquet_dir',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="parquet/tweets",
+                        default=None,
+                        help="Save the tweets scored by --score as Parquet files partitioned by date")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of payloads parsed and handed to the sinks at once")
+    parser.add_argument('--batch_secs',
+                        type=float,
+                        action='store',
+                        default=1.0,
+                        help="Max seconds a payload waits for its batch to fill")
+    parser.add_argument('-q',
+                        '--queue_size',
+                        type=int,
+                        action='store',
+                        default=10000,
+                        help="Max number of raw payloads waiting to be parsed")
+    parser.add_argument('--sink_queue',
+                        type=int,
+                        action='store',
+                        default=100,
+                        help="Max number of batches waiting in the queue of each sink")
+    parser.add_argument('--sink_backlog',
+                        type=int,
+                        action='store',
+                        default=100,
+                        help="Max number of batches kept for a full sink with the block policy "
+                        + "before the source is held up")
+    parser.add_argument('--sink_policy',
+                        type=str,
+                        nargs='+',
+                        action='store',
+                        default=[],
+                        help="Queue policy per sink i.e. jsonl=block mysql=drop score=drop (the defaults)")
+    parser.add_argument('--parse_processes',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Parse the payloads in this many processes instead of a thread")
+    add_metrics_args(parser)
+
+    argparse_obj = parser.parse_args()
+    if not (argparse_obj.jsonl or argparse_obj.mysql or argparse_obj.score):
+        parser.error("select at least one of --jsonl, --mysql and --score")
+    if not (argparse_obj.json_glob or argparse_obj.synthetic or argparse_obj.track
+            or argparse_obj.follow or argparse_obj.locations):
+        parser.error("select a source: -t, -f, -l, -j or --synthetic")
+    for policy in argparse_obj.sink_policy:
+        name, _, value = policy.partition("=")
+        if name not in ("jsonl", "mysql", "score") or value not in SINK_POLICIES:
+            parser.error(f"invalid --sink_policy {policy}")
+    return argparse_obj
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    configure_metrics(argparse_obj)
+    parse_executor = ProcessPoolExecutor(argparse_obj.parse_processes) \
+        if argparse_obj.parse_processes else None
+    runtime = AsyncIngestRuntime(build_source(argparse_obj),
+                                 build_sinks(argparse_obj),
+                                 batch_size=argparse_obj.batch_size,
+                                 batch_secs=argparse_obj.batch_secs,
+                                 max_queue=argparse_obj.queue_size,
+                                 parse_executor=parse_executor)
+    try:
+        asyncio.run(runtime.run())
+    except KeyboardInterrupt:
+        print("Stopped, the queued tweets were not all saved")
+    finally:
+        runtime.print_stats()
+        METRICS.close()
+
+
+if __name__ == "__main__":
+    main()
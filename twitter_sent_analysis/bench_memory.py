@@ -0,0 +1,116 @@
+"""
+Benchmark of the memory used by the sentiment pipeline per million tweets with
+the default dtypes and with the compact dtypes of -lean. Each mode runs in a
+fresh interpreter on synthetic tweets shaped like the rows fetched from MySQL,
+and its peak RSS and the deep size of the processed dataframe are reported
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+import subprocess
+from datetime import timedelta
+
+import pandas as pd
+
+MEMORY_MODES = ("default", "lean")
+
+
+def peak_rss_mb():
+    ''' Return the peak resident set size of this process in MB '''
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_mode(argparse_obj):
+    ''' Clean and score n_tweets synthetic tweets like gen_tweets_sentiment_from_mysql.py
+        and return the memory statistics of the run '''
+    from synthetic_tweets import SyntheticTweetGenerator
+    from gen_tweets_sentiment_from_mysql import TweetObject
+    from sentiment_engine import SentimentEngine
+    from lemma_cache import LemmaCache
+
+    lean = argparse_obj.child == "lean"
+    baseline_mb = peak_rss_mb()
+    tweet_generator = SyntheticTweetGenerator(seed=argparse_obj.seed)
+    # rows as fetched from MySQL: a datetime and a str per tweet
+    fetched_data = [(tweet_generator.start_time + timedelta(seconds=index / tweet_generator.tweets_per_sec),
+                     tweet_generator.tweet(index)['text'])
+                    for index in range(argparse_obj.n_tweets)]
+    tweet_df = pd.DataFrame(fetched_data, columns=['created_at', 'tweet'])
+    del fetched_data
+
+    processed_tweets = TweetObject.preprocess_tweets(tweet_df, LemmaCache())
+    if lean:
+        processed_tweets = TweetObject.to_compact_dtypes(processed_tweets, argparse_obj.keep_text)
+        del tweet_df
+    with SentimentEngine(1, backend="lexicon") as sentiment_engine:
+        sentiment = sentiment_engine.tweet_labels(processed_tweets['clean_tweets'])
+    processed_tweets['sentiment'] = sentiment.astype('int8') if lean else sentiment
+
+    per_million = 1e6 / argparse_obj.n_tweets
+    peak_mb = peak_rss_mb()
+    return {"mode": argparse_obj.child,
+            "tweets": argparse_obj.n_tweets,
+            "baseline_rss_mb": round(baseline_mb, 1),
+            "peak_rss_mb": round(peak_mb, 1),
+            "peak_rss_mb_per_million": round((peak_mb - baseline_mb) * per_million, 1),
+            "df_mb_per_million": round(
+                processed_tweets.memory_usage(deep=True).sum() / 1024 ** 2 * per_million, 1),
+            "dtypes": {column: str(dtype) for column, dtype in processed_tweets.dtypes.items()}}
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the peak memory of the sentiment pipeline with default and lean dtypes")
+
+    parser.add_argument('-n',
+                        '--n_tweets',
+                        type=int,
+                        action='store',
+                        default=200000,
+                        help="Number of synthetic tweets, results are scaled to a million tweets")
+    parser.add_argument('--seed',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Random seed of the synthetic tweets")
+    parser.add_argument('--keep_text',
+                        action='store_true',
+                        help="Keep the raw tweet text in the lean mode")
+    parser.add_argument('--child',
+                        type=str,
+                        choices=MEMORY_MODES,
+                        action='store',
+                        default=None,
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    if argparse_obj.child:
+        print(json.dumps(run_mode(argparse_obj)))
+        return
+
+    for mode in MEMORY_MODES:
+        # peak RSS only grows, so every mode gets its own interpreter
+        command = [sys.executable, os.path.abspath(__file__), "--child", mode,
+                   "-n", str(argparse_obj.n_tweets), "--seed", str(argparse_obj.seed)]
+        if argparse_obj.keep_text:
+            command.append("--keep_text")
+        result = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{mode} run failed:\n{result.stderr}")
+        mode_stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:8s} peak RSS {mode_stats['peak_rss_mb_per_million']:8.1f} MB per million tweets, "
+              + f"dataframe {mode_stats['df_mb_per_million']:8.1f} MB per million tweets")
+        print(f"         dtypes {mode_stats['dtypes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the startup cost of the pipeline scripts: the time a fresh
+interpreter takes to import each script and the slowest imports it triggers
+"""
+import os
+import sys
+import argparse
+import subprocess
+from statistics import median
+from time import perf_counter
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RT_SCRIPT_DIR = os.path.join(SCRIPT_DIR, os.pardir, 'rotten_tomatoes_movie_reviews_sent_analysis')
+
+# module name and the directory it is imported from
+STARTUP_MODULES = (("gen_tweets_sentiment_from_mysql", SCRIPT_DIR),
+                   ("gen_rt_review_sentiment", RT_SCRIPT_DIR),
+                   ("download_tweets_data_to_mysql", SCRIPT_DIR),
+                   ("download_tweets_data_as_json", SCRIPT_DIR),
+                   ("replay_json_to_mysql", SCRIPT_DIR))
+
+
+def time_import(module, cwd, importtime=False):
+    ''' Return the wall time of importing module in a fresh interpreter
+        and its stderr, which holds the -X importtime report if requested '''
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    command += ["-c", f"import {module}" if module else "pass"]
+    start = perf_counter()
+    result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+    secs = perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return secs, result.stderr
+
+
+def slowest_imports(importtime_report, top_n):
+    ''' Return the top_n (cumulative usecs, package) of the packages
+        a script imports directly from a -X importtime report '''
+    cumulative_usecs = {}
+    for line in importtime_report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        # nesting is indented by two spaces, the script itself is at depth 0
+        depth = (len(package) - len(package.lstrip()) - 1) // 2
+        if depth == 1:
+            cumulative_usecs[package.strip()] = int(cumulative)
+    return sorted(((usecs, package) for package, usecs in cumulative_usecs.items()),
+                  reverse=True)[:top_n]
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the time the pipeline scripts take to start")
+
+    parser.add_argument('-r',
+                        '--repeat',
+                        type=int,
+                        action='store',
+                        default=5,
+                        help="Number of fresh interpreters each import is timed in")
+    parser.add_argument('-top',
+                        '--top',
+                        type=int,
+                        action='store',
+                        default=5,
+                        help="Number of the slowest imports reported per script")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    interpreter_secs = median(time_import(None, SCRIPT_DIR)[0]
+                              for _ in range(argparse_obj.repeat))
+    print(f"empty interpreter: {interpreter_secs * 1000:8.1f} ms")
+
+    for module, cwd in STARTUP_MODULES:
+        try:
+            import_secs = median(time_import(module, cwd)[0]
+                                 for _ in range(argparse_obj.repeat))
+            _, importtime_report = time_import(module, cwd, importtime=True)
+        except RuntimeError as e:
+            print(f"{module}: {str(e).splitlines()[0]}")
+            continue
+        print(f"{module}: {(import_secs - interpreter_secs) * 1000:8.1f} ms")
+        for usecs, package in slowest_imports(importtime_report, argparse_obj.top):
+            print(f"\t{package:30s} {usecs / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
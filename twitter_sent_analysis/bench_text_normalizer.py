@@ -0,0 +1,85 @@
+"""
+Benchmark of TextNormalizer against the regex-replace + apply chain
+previously used by TweetObject.preprocess_tweets
+"""
+import argparse
+from time import perf_counter
+
+import pandas as pd
+from nltk_resources import english_stopwords
+from nltk_resources import wordnet_lemmatizer
+from lemma_cache import LemmaCache
+from text_normalizer import TextNormalizer
+
+
+def legacy_preprocess_tweets(tweets):
+    ''' The cleaning chain of preprocess_tweets before TextNormalizer '''
+    stopwords_set = english_stopwords()
+    lemmatizer = wordnet_lemmatizer()
+
+    exclude_items = ['[^a-zA-Z]', 'rt', 'http', 'RT', 'co']
+    exclude = '|'.join(exclude_items)
+    clean_tweets = tweets.replace(to_replace=exclude, value=" ", regex=True)
+
+    def normalize(tweet):
+        return ' '.join([lemmatizer.lemmatize(
+            word) for word in tweet.lower().split()
+            if not word in stopwords_set and len(word) > 1])
+
+    return clean_tweets.apply(normalize)
+
+
+def time_it(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return result, perf_counter() - start
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput of TextNormalizer with the legacy tweet cleaning")
+
+    parser.add_argument('-csv',
+                        '--csv_file',
+                        type=str,
+                        action='store',
+                        default="csv/corona_tweets.csv",
+                        help="csv file with a tweet column")
+    parser.add_argument('-r',
+                        '--repeat',
+                        type=int,
+                        action='store',
+                        default=20,
+                        help="Number of times the tweets are repeated to build the benchmark column")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    tweets = pd.read_csv(argparse_obj.csv_file)['tweet'].fillna('')
+    tweets = pd.concat([tweets] * argparse_obj.repeat, ignore_index=True)
+    stopwords_set = english_stopwords()
+
+    legacy_clean, legacy_secs = time_it(legacy_preprocess_tweets, tweets)
+    lemma_cache = LemmaCache()
+    tweet_normalizer = TextNormalizer(stopwords_set, lemma_cache)
+    clean, secs = time_it(tweet_normalizer.normalize_column, tweets)
+    # without duplicated tweets, only the single regex pass and the lemma cache help
+    unique_tweets = pd.Series(tweets.unique())
+    _, legacy_unique_secs = time_it(legacy_preprocess_tweets, unique_tweets)
+    _, unique_secs = time_it(TextNormalizer(stopwords_set).normalize_column, unique_tweets)
+
+    print(f"{len(tweets)} tweets ({len(unique_tweets)} unique)")
+    print(f"legacy chain:    {len(tweets) / legacy_secs:10.0f} tweets/s")
+    print(f"TextNormalizer:  {len(tweets) / secs:10.0f} tweets/s "
+          + f"({legacy_secs / secs:.1f}x)")
+    print(f"unique tweets only, legacy chain:   {len(unique_tweets) / legacy_unique_secs:10.0f} tweets/s")
+    print(f"unique tweets only, TextNormalizer: {len(unique_tweets) / unique_secs:10.0f} tweets/s "
+          + f"({legacy_unique_secs / unique_secs:.1f}x)")
+    print(f"clean text differs for {(clean != legacy_clean).mean() * 100:.1f}% of the tweets")
+    lemma_cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
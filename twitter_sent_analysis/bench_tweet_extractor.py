@@ -0,0 +1,107 @@
+"""
+Benchmark of the tweet row extraction of tweet_extractor.py against the
+json.loads + dateutil path previously used by the MySQL listener, on synthetic
+tweet payloads
+"""
+import json
+import argparse
+from time import perf_counter
+
+from dateutil import parser as date_parser
+
+import tweet_extractor
+from tweet_extractor import extract_tweet_row
+from tweet_extractor import parse_created_at
+from synthetic_tweets import SyntheticTweetGenerator
+
+
+def legacy_extract_tweet_row(data):
+    ''' The extraction of download_tweets_data_to_mysql.py before tweet_extractor '''
+    json_data = json.loads(data)
+    try:
+        tweet_id = json_data['id']
+        tweet = json_data['text']
+        created_at = date_parser.parse(json_data['created_at'])
+        reply_count = json_data['reply_count']
+        retweet_count = json_data['retweet_count']
+        user_name = json_data['user']['screen_name']
+        user_friends_count = json_data['user']['friends_count']
+        user_followers_count = json_data['user']['followers_count']
+        tweet_place = json_data['place']['country'] if \
+            json_data['place'] != None else 'NULL'
+    except Exception:
+        return None
+
+    try:
+        favorite_count = json_data['favorite_count']
+    except Exception:
+        favorite_count = 0
+    try:
+        user_location = json_data['user']['location']
+    except Exception:
+        user_location = "NULL"
+
+    return (tweet_id, tweet, created_at, tweet_place, favorite_count,
+            retweet_count, reply_count, user_name, user_location,
+            user_followers_count, user_friends_count)
+
+
+def time_it(func, items):
+    start = perf_counter()
+    result = [func(item) for item in items]
+    return result, perf_counter() - start
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput of the tweet row extraction with the legacy json + dateutil path")
+
+    parser.add_argument('-n',
+                        '--n_tweets',
+                        type=int,
+                        action='store',
+                        default=100000,
+                        help="Number of synthetic tweets")
+    parser.add_argument('--seed',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Random seed of the synthetic tweets")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    tweet_generator = SyntheticTweetGenerator(seed=argparse_obj.seed)
+    payloads = list(tweet_generator.payloads(argparse_obj.n_tweets))
+    created_ats = [json.loads(data)['created_at'] for data in payloads]
+    n_tweets = len(payloads)
+
+    legacy_rows, legacy_secs = time_it(legacy_extract_tweet_row, payloads)
+    rows, secs = time_it(extract_tweet_row, payloads)
+    print(f"{n_tweets} tweets ({len(set(created_ats))} distinct created_at)")
+    print(f"{'legacy json + dateutil:':26s}{n_tweets / legacy_secs:10.0f} tweets/s")
+    print(f"{f'extractor ({tweet_extractor.JSON_BACKEND}):':26s}{n_tweets / secs:10.0f} tweets/s "
+          + f"({legacy_secs / secs:.1f}x)")
+    if tweet_extractor.JSON_BACKEND != "json":
+        # the same extractor with the stdlib decoder
+        tweet_extractor.loads = json.loads
+        _, json_secs = time_it(extract_tweet_row, payloads)
+        print(f"{'extractor (json):':26s}{n_tweets / json_secs:10.0f} tweets/s "
+              + f"({legacy_secs / json_secs:.1f}x)")
+
+    _, dateutil_secs = time_it(date_parser.parse, created_ats)
+    parse_created_at.cache_clear()
+    _, fast_secs = time_it(parse_created_at, created_ats)
+    # without repeated timestamps only the precompiled pattern helps
+    parse_created_at.cache_clear()
+    _, uncached_secs = time_it(parse_created_at.__wrapped__, created_ats)
+    print(f"created_at with dateutil:         {n_tweets / dateutil_secs:10.0f} /s")
+    print(f"created_at with parse_created_at: {n_tweets / fast_secs:10.0f} /s "
+          + f"({dateutil_secs / fast_secs:.1f}x, {n_tweets / uncached_secs:.0f} /s uncached)")
+    print(f"rows differ for {sum(row != legacy_row for row, legacy_row in zip(rows, legacy_rows))} tweets")
+
+
+if __name__ == "__main__":
+    main()
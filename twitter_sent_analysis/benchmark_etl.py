@@ -0,0 +1,283 @@
+"""
+Benchmark of the ETL stages on their own. The tweets mode times the stages of the
+Twitter pipeline on synthetic tweets, the rt mode times the Rotten Tomatoes
+pipeline on train.tsv. Every run is appended as one JSON line to the output file
+so that results can be compared across commits
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from synthetic_tweets import SyntheticTweetGenerator
+from synthetic_tweets import vocabulary_from_csv
+from mysql_tweet_writer import TWEET_COLUMNS
+from tweet_extractor import loads
+from tweet_extractor import tweet_row_from_json
+from gen_tweets_sentiment_from_mysql import TweetObject
+from sentiment_engine import SentimentEngine
+from sentiment_engine import SCORING_BACKENDS
+from lemma_cache import LemmaCache
+from term_frequency import count_words
+
+# the rt mode imports the Rotten Tomatoes script, found from the path of this file
+RT_SCRIPT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                              os.pardir, 'rotten_tomatoes_movie_reviews_sent_analysis'))
+if not os.path.isfile(os.path.join(RT_SCRIPT_DIR, 'gen_rt_review_sentiment.py')):
+    raise ImportError(f"gen_rt_review_sentiment.py is not in {RT_SCRIPT_DIR}, "
+                      + "rotten_tomatoes_movie_reviews_sent_analysis must stay next to twitter_sent_analysis")
+if RT_SCRIPT_DIR not in sys.path:
+    sys.path.append(RT_SCRIPT_DIR)
+from gen_rt_review_sentiment import MovieReviewObject
+BENCHMARK_MODES = ("tweets", "rt")
+BENCHMARK_DBS = ("sqlite", "mysql", "none")
+
+
+class StageTimer:
+    ''' Times named stages and records their throughput '''
+
+    def __init__(self) -> None:
+        self.stages = {}
+
+    def time(self, name, n_items, func, *args, **kwargs):
+        ''' Run func, record its wall time for n_items and return its result.
+            With n_items None the length of the result is used '''
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        secs = perf_counter() - start
+        if n_items is None:
+            n_items = len(result)
+        self.stages[name] = {"secs": round(secs, 6),
+                             "items": n_items,
+                             "items_per_sec": round(n_items / secs, 1) if secs > 0 else None}
+        print(f"{name:24s} {secs:9.3f} s {n_items / max(secs, 1e-9):12.0f} items/s")
+        return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def insert_rows_sqlite(rows, batch_size):
+    ''' Insert rows into an in-memory SQLite table shaped like the tweets table '''
+    sqlite_con = sqlite3.connect(":memory:")
+    sqlite_con.execute(f"CREATE TABLE tweets (ID INTEGER PRIMARY KEY, {', '.join(TWEET_COLUMNS)})")
+    query = f"INSERT INTO tweets ({', '.join(TWEET_COLUMNS)})" +\
+        f" VALUES ({', '.join(['?'] * len(TWEET_COLUMNS))})"
+    # sqlite3 has no datetime adapter on recent Pythons
+    rows = [(row[0], row[1], row[2].isoformat(sep=' ')) + row[3:] for row in rows]
+    for start in range(0, len(rows), batch_size):
+        sqlite_con.executemany(query, rows[start:start + batch_size])
+        sqlite_con.commit()
+    sqlite_con.close()
+
+
+def insert_rows_mysql(rows, batch_size):
+    ''' Insert rows into the MySQL table of twitter_configuration.ini '''
+    from twitter_config_loader import TwitterConfig
+    from mysql_tweet_writer import MySQLTweetWriter
+
+    with MySQLTweetWriter(TwitterConfig(), batch_size=batch_size) as tweet_writer:
+        for start in range(0, len(rows), batch_size):
+            tweet_writer.write_rows(rows[start:start + batch_size])
+
+
+def render_word_cloud(word_frequencies):
+    from wordcloud import WordCloud, STOPWORDS
+
+    word_frequencies = {word: count for word, count in word_frequencies.items()
+                        if word not in STOPWORDS}
+    return WordCloud(background_color="white",
+                     height=1000,
+                     width=800).generate_from_frequencies(word_frequencies).to_array()
+
+
+def benchmark_tweets(timer, argparse_obj):
+    n_tweets = argparse_obj.n_tweets
+    vocabulary = vocabulary_from_csv(argparse_obj.vocab_csv) if argparse_obj.vocab_csv else None
+    tweet_generator = SyntheticTweetGenerator(vocabulary,
+                                              zipf_a=argparse_obj.zipf_a,
+                                              retweet_share=argparse_obj.retweet_share,
+                                              seed=argparse_obj.seed)
+    payloads = timer.time("generate", n_tweets, lambda: list(tweet_generator.payloads(n_tweets)))
+
+    json_tweets = timer.time("json_parse", n_tweets, lambda: [loads(data) for data in payloads])
+    rows = timer.time("extract", n_tweets,
+                      lambda: [row for row in map(tweet_row_from_json, json_tweets) if row is not None])
+    if argparse_obj.db == "sqlite":
+        timer.time("db_insert_sqlite", len(rows), insert_rows_sqlite, rows, argparse_obj.batch_size)
+    elif argparse_obj.db == "mysql":
+        timer.time("db_insert_mysql", len(rows), insert_rows_mysql, rows, argparse_obj.batch_size)
+
+    tweet_df = pd.DataFrame([(row[2], row[1]) for row in rows], columns=['created_at', 'tweet'])
+    lemma_cache = LemmaCache()
+    tweet_df = timer.time("preprocess_tweets", len(tweet_df),
+                          TweetObject.preprocess_tweets, tweet_df, lemma_cache)
+    clean_tweets = tweet_df['clean_tweets']
+
+    with SentimentEngine(argparse_obj.workers, backend=argparse_obj.backend) as sentiment_engine:
+        tweet_df['sentiment'] = timer.time(f"sentiment_{argparse_obj.backend}", len(tweet_df),
+                                           sentiment_engine.tweet_labels, clean_tweets)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # a first run fills the persistent sentiment cache, a second run reads it
+        for stage in ("sentiment_cache_cold", "sentiment_cache_warm"):
+            with SentimentEngine(argparse_obj.workers, backend=argparse_obj.backend,
+                                 cache_path=os.path.join(cache_dir, "sentiment_cache.sqlite")) as cached_engine:
+                timer.time(stage, len(tweet_df), cached_engine.tweet_labels, clean_tweets)
+    # the per tweet TextBlob path is slow, so it is timed on a sample
+    sample = clean_tweets.iloc[:argparse_obj.legacy_sample]
+    timer.time("generate_sentiment", len(sample),
+               lambda: sample.apply(TweetObject.generate_sentiment))
+
+    with tempfile.TemporaryDirectory() as csv_dir:
+        timer.time("csv_write", len(tweet_df), tweet_df.to_csv,
+                   os.path.join(csv_dir, "benchmark_tweets.csv"))
+    word_frequencies = timer.time("word_counts", len(tweet_df), count_words, clean_tweets)
+    if not argparse_obj.skip_word_cloud:
+        timer.time("word_cloud", len(word_frequencies), render_word_cloud, word_frequencies)
+
+
+def benchmark_rt(timer, argparse_obj):
+    movie_review_obj = MovieReviewObject()
+    review_df = timer.time("read_train_tsv", None, movie_review_obj.get_df_from_file, argparse_obj.rt_file)
+    if argparse_obj.n_tweets:
+        review_df = review_df.iloc[:argparse_obj.n_tweets]
+    review_df = timer.time("preprocess", len(review_df),
+                           movie_review_obj.preprocess, review_df, LemmaCache())
+
+    with SentimentEngine(argparse_obj.workers, backend=argparse_obj.backend) as sentiment_engine:
+        review_df['sentiment'] = timer.time(f"sentiment_{argparse_obj.backend}", len(review_df),
+                                            sentiment_engine.review_labels, review_df['cleanPhrase'])
+    sample = review_df['cleanPhrase'].iloc[:argparse_obj.legacy_sample]
+    timer.time("generate_sentiment", len(sample),
+               lambda: sample.apply(movie_review_obj.generate_sentiment))
+
+    accuracy = (review_df['sentiment'] == review_df['Sentiment']).mean()
+    print(f"Accuracy = {accuracy:.4f}")
+    return {"accuracy": round(float(accuracy), 6)}
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Time the ETL stages on synthetic tweets or the Rotten Tomatoes phrases")
+
+    parser.add_argument('-m',
+                        '--mode',
+                        type=str,
+                        choices=BENCHMARK_MODES,
+                        action='store',
+                        default="tweets",
+                        help="Benchmark the Twitter stages or the Rotten Tomatoes stages")
+    parser.add_argument('-n',
+                        '--n_tweets',
+                        type=int,
+                        action='store',
+                        default=20000,
+                        help="Number of synthetic tweets, or max number of phrases in rt mode (0 for all)")
+    parser.add_argument('-db',
+                        '--db',
+                        type=str,
+                        choices=BENCHMARK_DBS,
+                        action='store',
+                        default="sqlite",
+                        help="Time inserts into an in-memory SQLite stand-in or the configured MySQL table")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of rows per insert transaction")
+    parser.add_argument('--vocab_csv',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="csv file with a tweet column the synthetic vocabulary is drawn from")
+    parser.add_argument('--zipf_a',
+                        type=float,
+                        action='store',
+                        default=1.2,
+                        help="Zipf exponent of the word ranks of the synthetic tweets")
+    parser.add_argument('--retweet_share',
+                        type=float,
+                        action='store',
+                        default=0.3,
+                        help="Share of synthetic tweets that are retweets")
+    parser.add_argument('--seed',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Random seed of the synthetic tweets")
+    parser.add_argument('-workers',
+                        '--workers',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Number of processes scoring sentiment, defaults to the number of cores")
+    parser.add_argument('-backend',
+                        '--backend',
+                        type=str,
+                        choices=SCORING_BACKENDS,
+                        action='store',
+                        default="textblob",
+                        help="Sentiment scoring backend")
+    parser.add_argument('--legacy_sample',
+                        type=int,
+                        action='store',
+                        default=2000,
+                        help="Number of texts scored one at a time with generate_sentiment")
+    parser.add_argument('--skip_word_cloud',
+                        action='store_true',
+                        help="Do not time rendering the word cloud")
+    parser.add_argument('--rt_file',
+                        type=str,
+                        action='store',
+                        default=os.path.join(RT_SCRIPT_DIR, "data", "sentiment-analysis-on-movie-reviews.zip"),
+                        help="train.tsv or the Kaggle zip containing it")
+    parser.add_argument('-o',
+                        '--output',
+                        type=str,
+                        action='store',
+                        default="benchmarks/etl_benchmarks.jsonl",
+                        help="File the results are appended to as one JSON line per run")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    timer = StageTimer()
+    if argparse_obj.mode == "tweets":
+        extra_results = benchmark_tweets(timer, argparse_obj)
+    else:
+        extra_results = benchmark_rt(timer, argparse_obj)
+
+    results = {"mode": argparse_obj.mode,
+               "commit": git_commit(),
+               "timestamp": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "cpu_count": os.cpu_count(),
+               "params": vars(argparse_obj),
+               "stages": timer.stages}
+    results.update(extra_results or {})
+    os.makedirs(os.path.dirname(os.path.abspath(argparse_obj.output)), exist_ok=True)
+    with open(argparse_obj.output, "a") as results_file:
+        results_file.write(json.dumps(results) + "\n")
+    print(f"Results appended to {argparse_obj.output}")
+
+
+if __name__ == "__main__":
+    main()
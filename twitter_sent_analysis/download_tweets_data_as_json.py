@@ -1,15 +1,18 @@
-import os
-import gzip
-import json
 import tweepy
 import argparse
 
-from time import time
-from typing import List
-from dateutil import parser
+from typing import TYPE_CHECKING, List
+from jsonl_sink import RotatingJsonlSink
+from tweet_pipeline import TweetPipeline
+from tweet_pipeline import QUEUE_POLICIES
 from twitter_config_loader import TwitterConfig
+from pipeline_metrics import METRICS
+from pipeline_metrics import DEBUG_LOG
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
 
-DEBUG = True
+if TYPE_CHECKING:
+    from stream_replay import ReplayStreamSource
 
 
 class TweepyConfig:
@@ -30,36 +33,36 @@ class TweepyConfig:
 class TweetStreamListener(tweepy.StreamListener):
     ''' Tweepy listener class that inherits from tweepy.StreamListener '''
 
-    def __init__(self) -> None:
+    def __init__(self, tweet_pipeline: 'TweetPipeline') -> None:
         super().__init__()
+        self.tweet_pipeline = tweet_pipeline
         self.tweet_download_limit = 10000000
         self.tweet_download_count = 0
 
     @staticmethod
     def on_connect() -> None:
+        METRICS.increment("stream_connects_total")
         print("Connected to the Twitter API now")
 
     @staticmethod
     def on_status(status):
         if not(status.retweeted_status):
-            if DEBUG:
-                print(self.status)
+            DEBUG_LOG.log("%s", status)
 
     def on_data(self, data):
-        ''' Read tweets as JSON objs and extract data '''
-        json_data = json.loads(data)
-
-        with gzip.open(f'json/{str(time())[:7]}.jsonl.gz', 'a') as output:
-            output.write(json.dumps(json_data).encode('utf8') + b"\n")
-
+        ''' Queue raw tweet payloads for the pipeline workers to save '''
         self.tweet_download_count += 1
+        METRICS.increment("stream_payloads_total")
         if self.tweet_download_count > self.tweet_download_limit:
             print(
                 "Personal Tweet access limit reached. Aborting now. [This can be altered]")
             return False
 
+        self.tweet_pipeline.put(data)
+
     @staticmethod
     def on_error(status_code):
+        METRICS.increment(f"stream_errors_{status_code}_total")
         # returning False in on_error disconnects the stream
         if status_code == 420:
             print("Request rate limit reached")
@@ -73,16 +76,23 @@ class TweetStreamListener(tweepy.StreamListener):
 
 
 def download_tweets_by_filters(api,
+                               tweet_pipeline: 'TweetPipeline',
                                track: List[str] = None,
                                follow: List[str] = None,
                                locations: List[str] = None,
-                               languages: List[str] = None):
+                               languages: List[str] = None,
+                               stream_source: 'ReplayStreamSource' = None):
+    ''' Stream the tweets matching the filters into tweet_pipeline. A stream_source
+        such as a ReplayStreamSource replaces the Twitter API for load tests '''
     _track = track if track is not None else []
     _follow = follow if follow is not None else []
     _locations = locations if locations is not None else []
     _languages = languages if languages is not None else ['en']
 
-    customStreamListener = TweetStreamListener()
+    customStreamListener = TweetStreamListener(tweet_pipeline)
+    if stream_source is not None:
+        stream_source.run(customStreamListener)
+        return
     customStream = tweepy.Stream(
         auth=api.auth, listener=customStreamListener)
 
@@ -119,6 +129,40 @@ def validate_and_return_args():
                         action='store',
                         default=None,
                         help="Name of file containing geo-locations i.e. -122.75,36.8,-121.75,37.8,-74,40,-73,41")
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        action='store',
+                        default=2,
+                        help="Number of worker threads saving tweets")
+    parser.add_argument('-q',
+                        '--queue_size',
+                        type=int,
+                        action='store',
+                        default=10000,
+                        help="Max number of raw tweets waiting in the queue for a worker")
+    parser.add_argument('--queue_policy',
+                        type=str,
+                        choices=QUEUE_POLICIES,
+                        action='store',
+                        default="block",
+                        help="Block the stream or drop tweets when the queue is full")
+    parser.add_argument('--put_timeout',
+                        type=float,
+                        action='store',
+                        default=None,
+                        help="Max seconds the blocking policy waits for space before dropping a tweet")
+    parser.add_argument('--segment_mb',
+                        type=float,
+                        action='store',
+                        default=64,
+                        help="Uncompressed size in MB after which a new .jsonl.gz file is started")
+    parser.add_argument('--segment_secs',
+                        type=float,
+                        action='store',
+                        default=600,
+                        help="Age in seconds after which a new .jsonl.gz file is started")
+    add_metrics_args(parser)
 
     return parser.parse_args()
 
@@ -162,12 +206,28 @@ def main():
     if argparse_obj.locations:
         print(f"\tLocations from {argparse_obj.locations}")
 
-    os.makedirs("json", exist_ok=True)
-    download_tweets_by_filters(api,
-                               track=track_filter,
-                               follow=follow_filter,
-                               locations=location_filter,
-                               languages=['en'])
+    configure_metrics(argparse_obj)
+    json_sink = RotatingJsonlSink("json",
+                                  max_segment_bytes=int(argparse_obj.segment_mb * 1024 * 1024),
+                                  max_segment_secs=argparse_obj.segment_secs)
+    # the payloads are already JSON text and are written without decoding
+    tweet_pipeline = TweetPipeline(json_sink.write,
+                                   n_workers=argparse_obj.workers,
+                                   max_queue_size=argparse_obj.queue_size,
+                                   policy=argparse_obj.queue_policy,
+                                   put_timeout=argparse_obj.put_timeout)
+    try:
+        download_tweets_by_filters(api,
+                                   tweet_pipeline,
+                                   track=track_filter,
+                                   follow=follow_filter,
+                                   locations=location_filter,
+                                   languages=['en'])
+    finally:
+        # save the tweets still queued when the stream stops or is interrupted
+        tweet_pipeline.close()
+        json_sink.close()
+        METRICS.close()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,24 @@
-import sys
-import json
 import tweepy
 import argparse
-import mysql.connector
-from typing import List
-from dateutil import parser
-from mysql.connector import Error
+from functools import partial
+from typing import TYPE_CHECKING, List
+from mysql_tweet_writer import MySQLTweetWriter
+from tweet_spool import TweetSpool
+from tweet_spool import SpooledTweetWriter
+from tweet_pipeline import TweetPipeline
+from tweet_pipeline import QUEUE_POLICIES
+from tweet_deduplicator import TweetDeduplicator
+from tweet_extractor import loads
+from tweet_extractor import extract_tweet_row
+from tweet_extractor import tweet_row_from_json
 from twitter_config_loader import TwitterConfig
-from twitter_config_loader import print_error
-from twitter_config_loader import print_warning
+from pipeline_metrics import METRICS
+from pipeline_metrics import DEBUG_LOG
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
 
-DEBUG = True
+if TYPE_CHECKING:
+    from stream_replay import ReplayStreamSource
 
 
 class TweepyConfig:
@@ -31,66 +39,36 @@ class TweepyConfig:
 class TweetStreamListener(tweepy.StreamListener):
     ''' Tweepy listener class that inherits from tweepy.StreamListener '''
 
-    def __init__(self) -> None:
+    def __init__(self, tweet_pipeline: 'TweetPipeline') -> None:
         super().__init__()
+        self.tweet_pipeline = tweet_pipeline
         self.tweet_download_limit = 10000000
         self.tweet_download_count = 0
 
     @staticmethod
     def on_connect() -> None:
+        METRICS.increment("stream_connects_total")
         print("Connected to the Twitter API now")
 
     @staticmethod
     def on_status(status):
         if not(status.retweeted_status):
-            if DEBUG:
-                print(self.status)
+            DEBUG_LOG.log("%s", status)
 
     def on_data(self, data):
-        ''' Read tweets as JSON objs and extract data '''
-        json_data = json.loads(data)
-
-        try:
-            tweet_id = json_data['id']
-            tweet = json_data['text']
-            created_at = parser.parse(json_data['created_at'])
-            reply_count = json_data['reply_count']
-            retweet_count = json_data['retweet_count']
-            user_name = json_data['user']['screen_name']
-            user_friends_count = json_data['user']['friends_count']
-            user_followers_count = json_data['user']['followers_count']
-            tweet_place = json_data['place']['country'] if \
-                json_data['place'] != None else 'NULL'
-        except Exception as e:
-            if DEBUG:
-                print(f"Error: {e}")
-            return
-
-        try:
-            favorite_count = json_data['favorite_count']
-        except Exception as e:
-            if DEBUG:
-                print_warning()
-            favorite_count = 0
-        try:
-            user_location = json_data['user']['location']
-        except Exception as e:
-            if DEBUG:
-                print_warning()
-            user_location = "NULL"
-
+        ''' Queue raw tweet payloads for the pipeline workers to parse and insert '''
         self.tweet_download_count += 1
+        METRICS.increment("stream_payloads_total")
         if self.tweet_download_count > self.tweet_download_limit:
             print(
                 "Personal Tweet access limit reached. Aborting now. [This can be altered]")
             return False
 
-        insert_tweets_in_mysql_db(tweet_id, tweet, created_at, tweet_place, favorite_count,
-                                  retweet_count, reply_count, user_name, user_location,
-                                  user_followers_count, user_friends_count)
+        self.tweet_pipeline.put(data)
 
     @staticmethod
     def on_error(status_code):
+        METRICS.increment(f"stream_errors_{status_code}_total")
         # returning False in on_error disconnects the stream
         if status_code == 420:
             print("Request rate limit reached")
@@ -103,69 +81,57 @@ class TweetStreamListener(tweepy.StreamListener):
         # returning non-False reconnects the stream, with backoff.
 
 
-def insert_tweets_in_mysql_db(tweet_id: str,
-                              tweet: str,
-                              created_at: str,
-                              tweet_place: str,
-                              favorite_count: str,
-                              retweet_count: str,
-                              reply_count: str,
-                              user_name: str,
-                              user_location: str,
-                              user_followers_count: str,
-                              user_friends_count: str):
-    ''' Function to connect to the mysql db and insert tweet data '''
-    cur_config = TwitterConfig()
-    try:
-        mysql_con = mysql.connector.connect(
-            host=cur_config.MYSQL_HOST,
-            user=cur_config.MYSQL_USERNAME,
-            password=cur_config.MYSQL_PASSWORD,
-            database=cur_config.MYSQL_DATABASE,
-            auth_plugin='mysql_native_password',
-            charset='utf8mb4')
-
-        if mysql_con.is_connected():
-            # Insert data from twitter api
-            cursor = mysql_con.cursor()
-            query = f"INSERT INTO {cur_config.MYSQL_TABLE}" +\
-                " (tweet_id, tweet, created_at, tweet_place, favorite_count," +\
-                " retweet_count, reply_count, user_name, user_location," +\
-                " user_followers_count, user_friends_count)" +\
-                " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);"
-            cursor.execute(query, (tweet_id, tweet, created_at, tweet_place, favorite_count,
-                                   retweet_count, reply_count, user_name, user_location,
-                                   user_followers_count, user_friends_count))
-            mysql_con.commit()
-
-    except Error as e:
-        print_error()
-        print(e)
-
-    try:
-        cursor.close()
-        mysql_con.close()
-    except UnboundLocalError:
-        print_error()
-        sys.exit(-1)
-
-    if DEBUG:
-        print(f"Inserted Tweet '{tweet[:(min(len(tweet), 60))]}...'"
-              + f"into {cur_config.MYSQL_TABLE}")
-    return
+def insert_tweet_payload(data, tweet_writer: 'MySQLTweetWriter') -> None:
+    ''' Pipeline handler that parses a raw payload and buffers it in the writer '''
+    tweet_row = extract_tweet_row(data)
+    if tweet_row is not None:
+        tweet_writer.add(tweet_row)
+
+
+def insert_deduplicated_tweet_payload(data,
+                                      tweet_writer: 'MySQLTweetWriter',
+                                      deduplicator: 'TweetDeduplicator') -> None:
+    ''' Pipeline handler that drops tweets already seen and stores the original
+        tweet of a retweet once, counting its later retweets in seen_retweets.
+        The writer must collapse retweets '''
+    json_data = loads(data)
+    tweet_id = json_data.get('id')
+    # payloads that are not tweets and tweets delivered twice
+    if tweet_id is None or deduplicator.is_duplicate(tweet_id):
+        return
+
+    original_json = json_data.get('retweeted_status')
+    if original_json is None:
+        tweet_row = tweet_row_from_json(json_data)
+        if tweet_row is not None:
+            tweet_writer.add(tweet_row + (0,))
+    elif deduplicator.is_duplicate(original_json['id']):
+        tweet_writer.add_retweet(original_json['id'])
+    else:
+        # the untruncated text of the original is stored instead of "RT @user: ..."
+        tweet_row = tweet_row_from_json(original_json)
+        if tweet_row is not None:
+            tweet_writer.add(tweet_row + (1,))
 
 
 def download_tweets_by_filters(api,
+                               tweet_pipeline: 'TweetPipeline',
                                track: List[str] = None,
                                follow: List[str] = None,
                                locations: List[str] = None,
-                               languages: List[str] = None):
+                               languages: List[str] = None,
+                               stream_source: 'ReplayStreamSource' = None):
+    ''' Stream the tweets matching the filters into tweet_pipeline. A stream_source
+        such as a ReplayStreamSource replaces the Twitter API for load tests '''
     _track = track if track is not None else []
     _follow = follow if follow is not None else []
     _locations = locations if locations is not None else []
     _languages = languages if languages is not None else ['en']
 
-    customStreamListener = TweetStreamListener()
+    customStreamListener = TweetStreamListener(tweet_pipeline)
+    if stream_source is not None:
+        stream_source.run(customStreamListener)
+        return
     customStream = tweepy.Stream(
         auth=api.auth, listener=customStreamListener)
 
@@ -202,6 +168,75 @@ def validate_and_return_args():
                         action='store',
                         default=None,
                         help="Name of file containing geo-locations i.e. -122.75,36.8,-121.75,37.8,-74,40,-73,41")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of tweets buffered before a batched insert into MySQL")
+    parser.add_argument('--flush_interval',
+                        type=float,
+                        action='store',
+                        default=5.0,
+                        help="Max seconds buffered tweets wait before being inserted into MySQL")
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        action='store',
+                        default=2,
+                        help="Number of worker threads parsing and inserting tweets")
+    parser.add_argument('-q',
+                        '--queue_size',
+                        type=int,
+                        action='store',
+                        default=10000,
+                        help="Max number of raw tweets waiting in the queue for a worker")
+    parser.add_argument('--queue_policy',
+                        type=str,
+                        choices=QUEUE_POLICIES,
+                        action='store',
+                        default="block",
+                        help="Block the stream or drop tweets when the queue is full")
+    parser.add_argument('--put_timeout',
+                        type=float,
+                        action='store',
+                        default=None,
+                        help="Max seconds the blocking policy waits for space before dropping a tweet")
+    parser.add_argument('--dedupe',
+                        action='store_true',
+                        help="Drop tweets already seen and store retweets as a count on the original tweet")
+    parser.add_argument('--seen_size',
+                        type=int,
+                        action='store',
+                        default=1000000,
+                        help="Number of tweet ids remembered in memory by --dedupe")
+    parser.add_argument('--bloom_file',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/seen_tweets.bloom",
+                        default=None,
+                        help="File of a Bloom filter remembering the last --bloom_capacity or more " +
+                             "tweet ids seen by --dedupe across runs")
+    parser.add_argument('--bloom_capacity',
+                        type=int,
+                        action='store',
+                        default=10000000,
+                        help="Number of tweet ids the Bloom filter is sized for")
+    parser.add_argument('--spool',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="spool",
+                        default=None,
+                        help="Log every tweet in this directory and insert them from there, " +
+                             "so tweets wait for MySQL during outages")
+    parser.add_argument('--drain_timeout',
+                        type=float,
+                        action='store',
+                        default=60.0,
+                        help="Max seconds to insert the rest of the --spool on exit, the rest is inserted on the next start")
+    add_metrics_args(parser)
 
     return parser.parse_args()
 
@@ -245,11 +280,52 @@ def main():
     if argparse_obj.locations:
         print(f"\tLocations from {argparse_obj.locations}")
 
-    download_tweets_by_filters(api,
-                               track=track_filter,
-                               follow=follow_filter,
-                               locations=location_filter,
-                               languages=['en'])
+    configure_metrics(argparse_obj)
+    writer_factory = partial(MySQLTweetWriter,
+                             cur_config,
+                             batch_size=argparse_obj.batch_size,
+                             flush_interval=argparse_obj.flush_interval,
+                             collapse_retweets=argparse_obj.dedupe)
+    if argparse_obj.spool:
+        # MySQL is only connected to by the drainer of the spool
+        tweet_writer = SpooledTweetWriter(TweetSpool(argparse_obj.spool),
+                                          writer_factory,
+                                          batch_size=argparse_obj.batch_size)
+    else:
+        tweet_writer = writer_factory()
+    deduplicator = None
+    if argparse_obj.dedupe:
+        deduplicator = TweetDeduplicator(argparse_obj.seen_size,
+                                         bloom_path=argparse_obj.bloom_file,
+                                         bloom_capacity=argparse_obj.bloom_capacity)
+        tweet_handler = partial(insert_deduplicated_tweet_payload,
+                                tweet_writer=tweet_writer,
+                                deduplicator=deduplicator)
+    else:
+        tweet_handler = partial(insert_tweet_payload, tweet_writer=tweet_writer)
+    tweet_pipeline = TweetPipeline(tweet_handler,
+                                   n_workers=argparse_obj.workers,
+                                   max_queue_size=argparse_obj.queue_size,
+                                   policy=argparse_obj.queue_policy,
+                                   put_timeout=argparse_obj.put_timeout)
+    try:
+        download_tweets_by_filters(api,
+                                   tweet_pipeline,
+                                   track=track_filter,
+                                   follow=follow_filter,
+                                   locations=location_filter,
+                                   languages=['en'])
+    finally:
+        # drain the queue and flush tweets still buffered when the stream stops or is interrupted
+        tweet_pipeline.close()
+        if argparse_obj.spool:
+            tweet_writer.close(drain_timeout=argparse_obj.drain_timeout)
+        else:
+            tweet_writer.close()
+        if deduplicator is not None:
+            deduplicator.print_stats()
+            deduplicator.close()
+        METRICS.close()
 
 
 if __name__ == "__main__":
@@ -1,20 +1,32 @@
 import os
+import sys
 import argparse
 import pandas as pd
+from collections import Counter
 import mysql.connector
-import matplotlib.pyplot as plt
 from mysql.connector import Error
 
-from textblob import TextBlob
-from wordcloud import WordCloud
+from sentiment_engine import SentimentEngine
+from sentiment_engine import SCORING_BACKENDS
+from sentiment_engine import polarity_to_tweet_labels
 from twitter_config_loader import TwitterConfig
 from twitter_config_loader import print_error
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-
-import nltk
-nltk.download('stopwords')
-nltk.download('wordnet')
+from nltk_resources import english_stopwords
+from lemma_cache import LemmaCache
+from text_normalizer import TextNormalizer
+from term_frequency import TermFrequencyStore
+from term_frequency import TIME_WINDOWS
+from term_frequency import count_words
+from parquet_store import ParquetTweetWriter
+from parquet_store import read_tweets_parquet
+from pipeline_metrics import METRICS
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
+
+# MySQL DATE_FORMAT of the start of every time bucket
+TIME_BUCKET_FORMATS = {"minute": "%Y-%m-%d %H:%i",
+                       "hour": "%Y-%m-%d %H:00",
+                       "day": "%Y-%m-%d"}
 
 
 class TweetObject:
@@ -55,33 +67,187 @@ class TweetObject:
         mysql_con.close()
         return tweet_df
 
+    def stream_mysql_dataframes(self, table, columns=('created_at', 'tweet'),
+                                chunksize=50000, min_id=0):
+        """ Retrieve the rows of table with an ID above min_id in ID order
+            and yield them as Pandas dataframes of at most chunksize rows.
+            Every chunk is read with its own query (WHERE ID > last ID LIMIT chunksize),
+            so no result set is left open on the server while a chunk is processed.
+            MySQL errors are raised instead of ending the stream early """
+        mysql_con = self.connect_mysql()
+        print(f"Connected to {self.MYSQL_DATABASE} as {self.MYSQL_USER} now")
+        # the ID column is always read to continue after the last row of a chunk
+        select_columns = ['ID'] + [column for column in columns if column != 'ID']
+        query = f"SELECT {','.join(select_columns)} FROM {table}" +\
+            " WHERE ID > %s ORDER BY ID LIMIT %s;"
+        last_id = int(min_id)
+        row_offset = 0
+        try:
+            while True:
+                # the connection may have been closed by the server while the last chunk was processed
+                mysql_con.ping(reconnect=True, attempts=3, delay=1)
+                cursor = mysql_con.cursor()
+                cursor.execute(query, (last_id, int(chunksize)))
+                fetched_data = cursor.fetchall()
+                cursor.close()
+                if not fetched_data:
+                    break
+                # the index continues across chunks like a single dataframe
+                chunk_df = pd.DataFrame(fetched_data,
+                                        columns=select_columns,
+                                        index=range(row_offset, row_offset + len(fetched_data)))
+                last_id = int(chunk_df['ID'].iloc[-1])
+                row_offset += len(fetched_data)
+                yield chunk_df[list(columns)]
+        finally:
+            mysql_con.close()
+
+    def connect_mysql(self):
+        """ Return a new connection to the sql db """
+        return mysql.connector.connect(
+            host=self.MYSQL_HOST,
+            user=self.MYSQL_USER,
+            password=self.MYSQL_PASSWORD,
+            database=self.MYSQL_DATABASE,
+            auth_plugin='mysql_native_password',
+            charset='utf8mb4'
+        )
+
+    def get_sentiment_watermark(self, results_table):
+        """ Return the highest tweet ID already scored in results_table """
+        mysql_con = self.connect_mysql()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.execute(f"SELECT COALESCE(MAX(ID), 0) FROM {results_table};")
+            watermark = cursor.fetchone()[0]
+            cursor.close()
+        finally:
+            mysql_con.close()
+        return watermark
+
+    def save_sentiment_results(self, tweet_df, results_table):
+        """ Store the clean text and sentiment of every tweet
+            in tweet_df in results_table keyed by the tweet ID """
+        # the keyword column is only written when the tweets were tagged with keywords
+        if 'keyword' in tweet_df:
+            query = f"INSERT INTO {results_table}" +\
+                " (ID, created_at, clean_tweet, sentiment, keyword)" +\
+                " VALUES (%s, %s, %s, %s, %s)" +\
+                " ON DUPLICATE KEY UPDATE clean_tweet = VALUES(clean_tweet)," +\
+                " sentiment = VALUES(sentiment), keyword = VALUES(keyword)"
+            keywords = tweet_df['keyword']
+        else:
+            query = f"INSERT INTO {results_table}" +\
+                " (ID, created_at, clean_tweet, sentiment)" +\
+                " VALUES (%s, %s, %s, %s)" +\
+                " ON DUPLICATE KEY UPDATE clean_tweet = VALUES(clean_tweet)," +\
+                " sentiment = VALUES(sentiment)"
+            keywords = None
+        rows = [(int(tweet_id), created_at, clean_tweet, int(sentiment))
+                for tweet_id, created_at, clean_tweet, sentiment in zip(
+                    tweet_df['ID'], tweet_df['created_at'],
+                    tweet_df['clean_tweets'], tweet_df['sentiment'])]
+        if keywords is not None:
+            rows = [row + (keyword,) for row, keyword in zip(rows, keywords)]
+        mysql_con = self.connect_mysql()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.executemany(query, rows)
+            mysql_con.commit()
+            cursor.close()
+        finally:
+            mysql_con.close()
+
+    def get_sentiment_counts(self, results_table):
+        """ Return the number of stored tweets per sentiment in results_table """
+        mysql_con = self.connect_mysql()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.execute(f"SELECT sentiment, COUNT(*) FROM {results_table} GROUP BY sentiment;")
+            sentiment_counts = {sentiment: count for sentiment, count in cursor.fetchall()}
+            cursor.close()
+        finally:
+            mysql_con.close()
+        return sentiment_counts
+
+    def get_sentiment_time_series(self, results_table, time_bucket,
+                                  by_keyword=False, since=None, until=None):
+        """ Return the number and share of positive, neutral and negative
+            tweets in results_table per time bucket, and per keyword when
+            by_keyword is True, counted by a GROUP BY in the sql db """
+        bucket_expr = f"DATE_FORMAT(created_at, '{TIME_BUCKET_FORMATS[time_bucket]}')"
+        group_columns = "bucket, keyword" if by_keyword else "bucket"
+        conditions, params = ["created_at IS NOT NULL"], []
+        # ranges on the indexed DATETIME column instead of on formatted strings
+        if since is not None:
+            conditions.append("created_at >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < %s")
+            params.append(until)
+        query = f"SELECT {bucket_expr} AS bucket" +\
+            (", keyword" if by_keyword else "") +\
+            ", SUM(sentiment = 1), SUM(sentiment = 0), SUM(sentiment = -1), COUNT(*)" +\
+            f" FROM {results_table} WHERE {' AND '.join(conditions)}" +\
+            f" GROUP BY {group_columns} ORDER BY {group_columns};"
+
+        mysql_con = self.connect_mysql()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.execute(query, tuple(params))
+            fetched_data = cursor.fetchall()
+            cursor.close()
+        finally:
+            mysql_con.close()
+
+        columns = ['bucket'] + (['keyword'] if by_keyword else []) +\
+            ['positive', 'neutral', 'negative', 'total']
+        series_df = pd.DataFrame(fetched_data, columns=columns)
+        series_df['bucket'] = pd.to_datetime(series_df['bucket'])
+        return add_sentiment_percentages(series_df)
+
     @staticmethod
-    def preprocess_tweets(tweet_df):
+    def preprocess_tweets(tweet_df, lemma_cache=None):
         """ Take orginial tweets as df and normalize them
-            by removing punctuation, stop words, hmtl, emoticons and
-            convert uppercase to lowercase. Gen canonical form using
-            WordNetLemmatizer """
-        stopwords_set = set(stopwords.words('english'))
-        wordnet_lemmatizer = WordNetLemmatizer()
+            by removing urls, mentions, retweet markers, punctuation,
+            stop words, hmtl, emoticons and convert uppercase to lowercase.
+            Gen canonical form using WordNetLemmatizer. Identical tweets
+            (i.e. retweets) are normalized once """
+        tweet_normalizer = TextNormalizer(english_stopwords(), lemma_cache)
 
         tweet_text_col_name = "tweet"
-        tweet_df['clean_tweets'] = tweet_df[tweet_text_col_name]
-        tweet_df['tweet_len'] = None
-
-        exclude_items = ['[^a-zA-Z]', 'rt', 'http', 'RT', 'co']
-        exclude = '|'.join(exclude_items)
-
-        tweet_df['clean_tweets'].replace(
-            to_replace=exclude, value=" ", regex=True, inplace=True)
+        tweet_df['clean_tweets'] = tweet_normalizer.normalize_column(
+            tweet_df[tweet_text_col_name])
+        tweet_df['tweet_len'] = tweet_df['clean_tweets'].str.len()
 
-        def normalize(tweet):
-            return ' '.join([wordnet_lemmatizer.lemmatize(
-                word) for word in tweet.lower().split()
-                if not word in stopwords_set and len(word) > 1])
-
-        tweet_df['clean_tweets'] = tweet_df['clean_tweets'].apply(normalize)
-        tweet_df['tweet_len'] = tweet_df['clean_tweets'].apply(len)
+        return tweet_df
 
+    @staticmethod
+    def to_compact_dtypes(tweet_df, keep_text=False):
+        """ Convert processed tweets to lean dtypes: datetime64 created_at,
+            int16 tweet_len, int8 sentiment and Arrow backed strings (category
+            without pyarrow) for the texts. The raw tweet text is dropped
+            unless keep_text is True """
+        try:
+            text_dtype = pd.StringDtype("pyarrow")
+            text_dtype.construct_array_type()
+        except (AttributeError, ImportError, TypeError):
+            # pandas before 1.3 has no Arrow backed strings
+            text_dtype = 'category'
+
+        if not keep_text:
+            tweet_df = tweet_df.drop(columns='tweet', errors='ignore')
+        elif 'tweet' in tweet_df:
+            tweet_df['tweet'] = tweet_df['tweet'].astype(text_dtype)
+        if not pd.api.types.is_datetime64_any_dtype(tweet_df['created_at']):
+            tweet_df['created_at'] = pd.to_datetime(tweet_df['created_at'], errors='coerce')
+        tweet_df['clean_tweets'] = tweet_df['clean_tweets'].astype(text_dtype)
+        # tweets are at most 280 characters long
+        tweet_df['tweet_len'] = tweet_df['tweet_len'].astype('int16')
+        if 'sentiment' in tweet_df:
+            tweet_df['sentiment'] = tweet_df['sentiment'].astype('int8')
+        if 'keyword' in tweet_df:
+            tweet_df['keyword'] = tweet_df['keyword'].astype('category')
         return tweet_df
 
     @staticmethod
@@ -89,6 +255,7 @@ class TweetObject:
         ''' Function takes in the tweet text
             and returns a sentiment polarity score
             -1, 0, or 1'''
+        from textblob import TextBlob
 
         tweet_analysis = TextBlob(tweet_text)
         if tweet_analysis.sentiment.polarity > 0:
@@ -99,11 +266,16 @@ class TweetObject:
             return -1  # Negative
 
     @staticmethod
-    def save_df_as_csv(tweet_df, csv_name="cleaned_tweets.csv"):
+    def save_df_as_csv(tweet_df, csv_name="cleaned_tweets.csv", append=False):
+        """ Write tweet_df to ./csv/csv_name, or append it
+            without the header when append is True """
         try:
             os.makedirs("csv", exist_ok=True)
-            tweet_df.to_csv(f'./csv/{csv_name}')
-            print(f"{csv_name} saved successfully in ./csv/{csv_name}")
+            tweet_df.to_csv(f'./csv/{csv_name}',
+                            mode='a' if append else 'w',
+                            header=not append)
+            if not append:
+                print(f"{csv_name} saved successfully in ./csv/{csv_name}")
 
         except Error as e:
             print(e)
@@ -111,13 +283,26 @@ class TweetObject:
 
     @staticmethod
     def gen_word_cloud(tweet_df, wordcloud_img_name="clean_tweets_word_cloud.jpg"):
-        """ Take in a tweet_df and plot a WordCloud with matplotlib """
+        """ Take in a tweet_df and plot a WordCloud of the
+            word counts of its clean tweets with matplotlib """
+        TweetObject.gen_word_cloud_from_frequencies(count_words(tweet_df['clean_tweets']),
+                                                    wordcloud_img_name)
+
+    @staticmethod
+    def gen_word_cloud_from_frequencies(word_frequencies,
+                                        wordcloud_img_name="clean_tweets_word_cloud.jpg"):
+        """ Take in a word to count mapping and plot a WordCloud with matplotlib """
+        # only imported by the runs that draw a word cloud
+        import matplotlib.pyplot as plt
+        from wordcloud import WordCloud, STOPWORDS
+
+        word_frequencies = {word: count for word, count in word_frequencies.items()
+                            if word not in STOPWORDS}
         plt.figure(figsize=(5, 6))
         tweet_wordcloud = WordCloud(
             background_color="white",
             height=1000,
-            width=800).generate(
-            " ".join(tweet_df['clean_tweets']))
+            width=800).generate_from_frequencies(word_frequencies)
 
         plt.imshow(tweet_wordcloud, interpolation='bilinear')
         plt.axis('off')
@@ -147,8 +332,426 @@ def validate_and_return_args():
     parser.add_argument('-sent',
                         action='store_true',
                         help="Sentiment Analysis Flag")
+    parser.add_argument('-chunk',
+                        '--chunksize',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Stream tweets from the db and process them in chunks of this many rows")
+    parser.add_argument('-inc',
+                        '--incremental',
+                        action='store_true',
+                        help="Only clean and score tweets not yet stored in the sentiment results table")
+    parser.add_argument('-workers',
+                        '--workers',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Number of processes scoring sentiment, defaults to the number of cores")
+    parser.add_argument('-backend',
+                        '--backend',
+                        type=str,
+                        choices=SCORING_BACKENDS,
+                        action='store',
+                        default="textblob",
+                        help="Sentiment scoring backend, lexicon is a fast vectorized version of textblob")
+    parser.add_argument('-agreement',
+                        '--agreement',
+                        type=int,
+                        nargs='?',
+                        action='store',
+                        const=10000,
+                        default=None,
+                        help="Report the label agreement of the backend with TextBlob on this many tweets")
+    parser.add_argument('-sentiment_cache',
+                        '--sentiment_cache',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/sentiment_cache.sqlite",
+                        default=None,
+                        help="SQLite file caching the polarity of every clean text between runs")
+    parser.add_argument('--sentiment_cache_size',
+                        type=int,
+                        action='store',
+                        default=5000000,
+                        help="Max number of texts kept in the sentiment cache, the least recently used are evicted")
+    parser.add_argument('-lemma_cache',
+                        '--lemma_cache',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/lemma_cache.pkl",
+                        default=None,
+                        help="File persisting the token to lemma cache between runs")
+    parser.add_argument('-keywords',
+                        '--keywords',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Name of file containing keywords i.e. batman,joker. With -inc the first one "
+                        + "found in each tweet is stored in the results table")
+    parser.add_argument('-agg',
+                        '--aggregate',
+                        type=str,
+                        choices=tuple(TIME_BUCKET_FORMATS),
+                        action='store',
+                        default=None,
+                        help="Count the stored sentiments per time bucket of this size in the db")
+    parser.add_argument('-agg_keyword',
+                        '--agg_keyword',
+                        action='store_true',
+                        help="Also group the -agg counts by the stored keyword")
+    parser.add_argument('-since',
+                        '--since',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Only count tweets created at or after this UTC time i.e. '2020-03-10 17:00'")
+    parser.add_argument('-until',
+                        '--until',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Only count tweets created before this UTC time")
+    parser.add_argument('-tf',
+                        '--term_frequencies',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/term_frequencies.pkl",
+                        default=None,
+                        help="File persisting the word counts the word cloud is built from")
+    parser.add_argument('-tf_window',
+                        '--tf_window',
+                        type=str,
+                        choices=tuple(TIME_WINDOWS),
+                        action='store',
+                        default=None,
+                        help="Keep the word counts per time window of this size")
+    parser.add_argument('-tf_keywords',
+                        '--tf_keywords',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Name of file containing keywords to also keep word counts for i.e. batman,joker")
+    parser.add_argument('-tf_top_k',
+                        '--tf_top_k',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Only keep the approx counts of the top k words in a count-min sketch")
+    parser.add_argument('-tf_sketch_width',
+                        '--tf_sketch_width',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Width of the count-min sketch of every window, about the number of distinct "
+                        + "words of a window. Default grows with -tf_window from 1024 per minute to 65536 per day")
+    parser.add_argument('-wc_since',
+                        '--wc_since',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Only use time windows starting at or after this time i.e. '2020-03-10 17:00'")
+    parser.add_argument('-wc_until',
+                        '--wc_until',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Only use time windows starting before this time")
+    parser.add_argument('-wc_keyword',
+                        '--wc_keyword',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Only use the word counts of tweets containing this keyword from -tf_keywords")
+    parser.add_argument('-wc_only',
+                        '--wc_only',
+                        action='store_true',
+                        help="Render the word cloud from the -tf file without reading the db")
+    parser.add_argument('-lean',
+                        '--lean',
+                        action='store_true',
+                        help="Keep the processed tweets in compact dtypes and drop the raw text once cleaned")
+    parser.add_argument('-keep_text',
+                        '--keep_text',
+                        action='store_true',
+                        help="Keep the raw tweet text with -lean, i.e. to save it in the csv or Parquet files")
+    parser.add_argument('-parquet',
+                        '--parquet_dir',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="parquet/tweets",
+                        default=None,
+                        help="Also save the processed tweets as Parquet files partitioned by date in this directory")
+    parser.add_argument('-from_parquet',
+                        '--from_parquet',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="parquet/tweets",
+                        default=None,
+                        help="Report -sent and -agg from the tweets saved with -parquet without reading the db")
+    add_metrics_args(parser)
+
+    argparse_obj = parser.parse_args()
+    if argparse_obj.wc_only and not (argparse_obj.term_frequencies and argparse_obj.wc_filename):
+        parser.error("-wc_only requires -tf and -wc")
+    if argparse_obj.from_parquet and not (argparse_obj.sent or argparse_obj.aggregate):
+        parser.error("-from_parquet requires -sent or -agg")
+    return argparse_obj
+
+
+def add_sentiment_percentages(series_df):
+    """ Add the share of every sentiment in the total of its row """
+    for sentiment_name in ('positive', 'neutral', 'negative'):
+        series_df[sentiment_name] = series_df[sentiment_name].astype('int64')
+        series_df[f"{sentiment_name}_pct"] = (
+            series_df[sentiment_name] / series_df['total'] * 100).round(2)
+    return series_df
+
+
+def sentiment_time_series_from_parquet(parquet_dir, time_bucket, by_keyword=False,
+                                       since=None, until=None):
+    """ Return the same counts as TweetObject.get_sentiment_time_series for the
+        tweets saved with -parquet, reading only the created_at, sentiment
+        and keyword columns of the tweets created in [since, until) """
+    columns = ['created_at', 'sentiment'] + (['keyword'] if by_keyword else [])
+    tweet_df = read_tweets_parquet(parquet_dir, columns, since=since, until=until)
+    tweet_df = tweet_df[tweet_df['created_at'].notna()]
+
+    group_columns = [tweet_df['created_at'].dt.floor(TIME_WINDOWS[time_bucket]).rename('bucket')]
+    if by_keyword:
+        group_columns.append(tweet_df['keyword'].astype(object).rename('keyword'))
+    # tweets without a keyword are counted in their own group like in the sql GROUP BY
+    counts = tweet_df.groupby(group_columns, dropna=False)['sentiment'].value_counts().unstack(fill_value=0)
+    series_df = pd.DataFrame({'positive': counts.get(1, 0),
+                              'neutral': counts.get(0, 0),
+                              'negative': counts.get(-1, 0)},
+                             index=counts.index)
+    series_df['total'] = series_df.sum(axis=1)
+    return add_sentiment_percentages(series_df.reset_index())
+
+
+def report_from_parquet(tweet_obj, cur_config, argparse_obj):
+    """ Print the sentiment percentages and the -agg counts of the tweets saved
+        with -parquet without reading the db or the tweet texts """
+    if argparse_obj.sent:
+        sentiment_df = read_tweets_parquet(argparse_obj.from_parquet, ['sentiment'],
+                                           since=argparse_obj.since, until=argparse_obj.until)
+        print_sentiment_percentages(sentiment_df['sentiment'].value_counts(), sentiment_df.shape[0])
+    if argparse_obj.aggregate:
+        aggregate_sentiment_time_series(tweet_obj, cur_config, argparse_obj)
+
+
+def read_keywords_file(filename):
+    """ Return the whitespace separated keywords in filename """
+    if filename is None:
+        return []
+    with open(filename, "r") as file:
+        return file.read().strip().split()
+
+
+def tag_first_keyword(tweets, keywords):
+    """ Return the first of keywords contained in every tweet, or None """
+    lower_tweets = tweets.fillna('').str.lower()
+    tagged_keywords = pd.Series([None] * len(tweets), index=tweets.index, dtype=object)
+    # earlier keywords overwrite later ones
+    for keyword in reversed(keywords):
+        tagged_keywords[lower_tweets.str.contains(keyword.lower(), regex=False)] = keyword
+    return tagged_keywords
+
+
+def new_term_frequency_store(argparse_obj, resume=False):
+    """ Return the word count store selected in argparse_obj, loaded from
+        the -tf file when resume is True and the file exists """
+    if resume and argparse_obj.term_frequencies and os.path.isfile(argparse_obj.term_frequencies):
+        return TermFrequencyStore.load(argparse_obj.term_frequencies)
+    return TermFrequencyStore(argparse_obj.tf_window, argparse_obj.tf_top_k,
+                              sketch_width=argparse_obj.tf_sketch_width)
+
+
+def update_term_frequencies(term_frequency_store, processed_tweets, keywords):
+    """ Add the word counts of a dataframe of processed tweets """
+    term_frequency_store.update(processed_tweets['clean_tweets'],
+                                created_at=processed_tweets['created_at'],
+                                raw_texts=processed_tweets.get('tweet'),
+                                keywords=keywords)
+
+
+def clean_and_score_tweets(tweet_obj, sentiment_engine, lemma_cache, tweet_df,
+                           argparse_obj, report_agreement=False):
+    """ Clean the tweets of tweet_df and add their sentiment. With -lean the
+        dataframe is converted to compact dtypes after cleaning and the raw text
+        is dropped unless -keep_text is given or keywords are matched against it """
+    processed_tweets = tweet_obj.preprocess_tweets(tweet_df, lemma_cache)
+    if argparse_obj.lean:
+        keep_text = argparse_obj.keep_text or bool(argparse_obj.tf_keywords) or \
+            (argparse_obj.incremental and bool(argparse_obj.keywords))
+        processed_tweets = tweet_obj.to_compact_dtypes(processed_tweets, keep_text)
+    if report_agreement and argparse_obj.agreement:
+        sentiment_engine.print_agreement_report(processed_tweets['clean_tweets'],
+                                                polarity_to_tweet_labels,
+                                                argparse_obj.agreement)
+    sentiment = sentiment_engine.tweet_labels(processed_tweets['clean_tweets'])
+    processed_tweets['sentiment'] = sentiment.astype('int8') if argparse_obj.lean else sentiment
+    return processed_tweets
+
+
+def render_word_cloud(tweet_obj, term_frequency_store, argparse_obj):
+    """ Plot the word cloud of the time windows and keyword selected in argparse_obj """
+    word_frequencies = term_frequency_store.frequencies(since=argparse_obj.wc_since,
+                                                        until=argparse_obj.wc_until,
+                                                        keyword=argparse_obj.wc_keyword)
+    if not word_frequencies:
+        print("No word counts for the selected time windows and keyword")
+        return
+    tweet_obj.gen_word_cloud_from_frequencies(word_frequencies,
+                                              f"{argparse_obj.wc_filename}_word_cloud.jpg")
+
+
+def print_sentiment_percentages(sentiment_counts, total_tweets):
+    """ Print the share of each sentiment from a sentiment to count mapping """
+    total_tweets = max(total_tweets, 1)
+    print("Percentage of Positive tweets {0:.2f}%".format(
+        (sentiment_counts.get(1, 0) / total_tweets) * 100))
+    print("Percentage of Neutral tweets {0:.2f}%".format(
+        (sentiment_counts.get(0, 0) / total_tweets) * 100))
+    print("Percentage of Negative tweets {0:.2f}%".format(
+        (sentiment_counts.get(-1, 0) / total_tweets) * 100))
+
+
+def process_tweets_in_chunks(tweet_obj, sentiment_engine, lemma_cache, table, argparse_obj):
+    """ Clean and score the tweets one chunk at a time, appending every chunk
+        to the csv and Parquet files and adding up the sentiment and word counts """
+    sentiment_counts = Counter()
+    term_frequency_store = new_term_frequency_store(argparse_obj)
+    keywords = read_keywords_file(argparse_obj.tf_keywords)
+    count_terms = argparse_obj.wc_filename or argparse_obj.term_frequencies
+    parquet_writer = ParquetTweetWriter(argparse_obj.parquet_dir) if argparse_obj.parquet_dir else None
+    total_tweets = 0
+
+    try:
+        for chunk_df in tweet_obj.stream_mysql_dataframes(table, chunksize=argparse_obj.chunksize):
+            processed_tweets = clean_and_score_tweets(tweet_obj, sentiment_engine, lemma_cache,
+                                                      chunk_df, argparse_obj,
+                                                      report_agreement=total_tweets == 0)
+
+            sentiment_counts.update(processed_tweets['sentiment'].value_counts().to_dict())
+            if count_terms:
+                update_term_frequencies(term_frequency_store, processed_tweets, keywords)
+            if argparse_obj.csv_filename:
+                tweet_obj.save_df_as_csv(processed_tweets,
+                                         f"{argparse_obj.csv_filename}_tweets.csv",
+                                         append=total_tweets > 0)
+            total_tweets += processed_tweets.shape[0]
+            print(f"Processed {total_tweets} tweets")
+            if parquet_writer is not None:
+                parquet_writer.write(processed_tweets)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
 
-    return parser.parse_args()
+    if argparse_obj.sent:
+        print_sentiment_percentages(sentiment_counts, total_tweets)
+    if argparse_obj.term_frequencies:
+        term_frequency_store.save(argparse_obj.term_frequencies)
+    if argparse_obj.wc_filename:
+        render_word_cloud(tweet_obj, term_frequency_store, argparse_obj)
+
+
+def aggregate_sentiment_time_series(tweet_obj, cur_config, argparse_obj):
+    """ Print and save the sentiment counts of the stored results per time
+        bucket, and keyword, selected in argparse_obj """
+    if argparse_obj.from_parquet:
+        series_df = sentiment_time_series_from_parquet(argparse_obj.from_parquet,
+                                                       argparse_obj.aggregate,
+                                                       by_keyword=argparse_obj.agg_keyword,
+                                                       since=argparse_obj.since,
+                                                       until=argparse_obj.until)
+    else:
+        series_df = tweet_obj.get_sentiment_time_series(cur_config.MYSQL_SENTIMENT_TABLE,
+                                                        argparse_obj.aggregate,
+                                                        by_keyword=argparse_obj.agg_keyword,
+                                                        since=argparse_obj.since,
+                                                        until=argparse_obj.until)
+    print(f"Sentiment per {argparse_obj.aggregate} in {series_df.shape[0]} rows")
+    print(series_df)
+    csv_name = argparse_obj.csv_filename or cur_config.MYSQL_TABLE
+    tweet_obj.save_df_as_csv(series_df.set_index('bucket'),
+                             f"{csv_name}_sentiment_per_{argparse_obj.aggregate}.csv")
+    return series_df
+
+
+def process_new_tweets_incrementally(tweet_obj, sentiment_engine, lemma_cache,
+                                     cur_config, argparse_obj):
+    """ Clean and score only the tweets with an ID above the last one stored
+        in the sentiment results table, store them and report over all stored results """
+    results_table = cur_config.MYSQL_SENTIMENT_TABLE
+    chunksize = argparse_obj.chunksize or 50000
+
+    watermark = tweet_obj.get_sentiment_watermark(results_table)
+    print(f"Scoring tweets in {cur_config.MYSQL_TABLE} with ID > {watermark}")
+    csv_path = f"./csv/{argparse_obj.csv_filename}_tweets.csv"
+    # new results are appended to the csv file written by earlier runs
+    csv_exists = os.path.isfile(csv_path)
+    # the stored word counts cover the tweets scored by earlier runs
+    term_frequency_store = new_term_frequency_store(argparse_obj, resume=True)
+    keywords = read_keywords_file(argparse_obj.tf_keywords)
+    stored_keywords = read_keywords_file(argparse_obj.keywords)
+    parquet_writer = ParquetTweetWriter(argparse_obj.parquet_dir) if argparse_obj.parquet_dir else None
+
+    new_tweets = 0
+    try:
+        for chunk_df in tweet_obj.stream_mysql_dataframes(cur_config.MYSQL_TABLE,
+                                                          columns=('ID', 'created_at', 'tweet'),
+                                                          chunksize=chunksize, min_id=watermark):
+            processed_tweets = clean_and_score_tweets(tweet_obj, sentiment_engine, lemma_cache,
+                                                      chunk_df, argparse_obj,
+                                                      report_agreement=new_tweets == 0)
+            if stored_keywords:
+                processed_tweets['keyword'] = tag_first_keyword(processed_tweets['tweet'],
+                                                                stored_keywords)
+            # each committed chunk moves the watermark so an interrupted run resumes
+            tweet_obj.save_sentiment_results(processed_tweets, results_table)
+            if argparse_obj.term_frequencies:
+                update_term_frequencies(term_frequency_store, processed_tweets, keywords)
+                term_frequency_store.save(argparse_obj.term_frequencies)
+
+            if argparse_obj.csv_filename:
+                tweet_obj.save_df_as_csv(processed_tweets.set_index('ID'),
+                                         f"{argparse_obj.csv_filename}_tweets.csv",
+                                         append=csv_exists or new_tweets > 0)
+            if parquet_writer is not None:
+                # files of earlier runs are kept and new ones added next to them
+                parquet_writer.write(processed_tweets)
+            new_tweets += processed_tweets.shape[0]
+            print(f"Scored {new_tweets} new tweets")
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    if argparse_obj.sent:
+        sentiment_counts = tweet_obj.get_sentiment_counts(results_table)
+        print_sentiment_percentages(sentiment_counts, sum(sentiment_counts.values()))
+    if argparse_obj.wc_filename and argparse_obj.term_frequencies:
+        render_word_cloud(tweet_obj, term_frequency_store, argparse_obj)
+    elif argparse_obj.wc_filename:
+        # the stored clean texts are counted without cleaning them again
+        word_frequencies = Counter()
+        for clean_df in tweet_obj.stream_mysql_dataframes(results_table,
+                                                          columns=('clean_tweet',),
+                                                          chunksize=chunksize):
+            for clean_tweet in clean_df['clean_tweet']:
+                word_frequencies.update(clean_tweet.split())
+        tweet_obj.gen_word_cloud_from_frequencies(word_frequencies,
+                                                  f"{argparse_obj.wc_filename}_word_cloud.jpg")
+    if argparse_obj.aggregate:
+        aggregate_sentiment_time_series(tweet_obj, cur_config, argparse_obj)
 
 
 def main():
@@ -156,30 +759,83 @@ def main():
     cur_config = TwitterConfig()
     tweet_obj = TweetObject(cur_config.MYSQL_HOST, cur_config.MYSQL_USERNAME,
                             cur_config.MYSQL_PASSWORD, cur_config.MYSQL_DATABASE)
-
-    tweet_df = tweet_obj.connect_mysql_and_get_dataframe(
-        f"SELECT created_at,tweet FROM {cur_config.MYSQL_TABLE};")
-
-    processed_tweets = tweet_obj.preprocess_tweets(tweet_df)
-    processed_tweets['sentiment'] = processed_tweets['clean_tweets'].apply(
-        tweet_obj.generate_sentiment)
+    lemma_cache = LemmaCache(path=argparse_obj.lemma_cache)
+    configure_metrics(argparse_obj)
+
+    try:
+        run_sentiment_analysis(tweet_obj, lemma_cache, cur_config, argparse_obj)
+    except Error as e:
+        # a run cut short by MySQL must not look like a complete one
+        print(e)
+        print_error()
+        print("Sentiment analysis stopped before all tweets were processed")
+        return 1
+    finally:
+        lemma_cache.print_stats()
+        lemma_cache.save()
+        METRICS.close()
+    return 0
+
+
+def run_sentiment_analysis(tweet_obj, lemma_cache, cur_config, argparse_obj):
+    """ Clean and score the tweets and generate the reports selected in argparse_obj """
+    if argparse_obj.wc_only:
+        render_word_cloud(tweet_obj,
+                          TermFrequencyStore.load(argparse_obj.term_frequencies),
+                          argparse_obj)
+        return
+    if argparse_obj.from_parquet:
+        report_from_parquet(tweet_obj, cur_config, argparse_obj)
+        return
+    if argparse_obj.aggregate and not argparse_obj.incremental:
+        # only the stored results are read, nothing is scored
+        aggregate_sentiment_time_series(tweet_obj, cur_config, argparse_obj)
+        return
+
+    with SentimentEngine(argparse_obj.workers,
+                         backend=argparse_obj.backend,
+                         cache_path=argparse_obj.sentiment_cache,
+                         cache_max_entries=argparse_obj.sentiment_cache_size) as sentiment_engine:
+        if argparse_obj.incremental:
+            process_new_tweets_incrementally(tweet_obj, sentiment_engine, lemma_cache,
+                                             cur_config, argparse_obj)
+            return
+
+        if argparse_obj.chunksize:
+            # peak memory is bounded by the chunk size instead of the table size
+            process_tweets_in_chunks(tweet_obj, sentiment_engine, lemma_cache,
+                                     cur_config.MYSQL_TABLE, argparse_obj)
+            return
+
+        query = f"SELECT created_at,tweet FROM {cur_config.MYSQL_TABLE};"
+
+        tweet_df = tweet_obj.connect_mysql_and_get_dataframe(query)
+
+        processed_tweets = clean_and_score_tweets(tweet_obj, sentiment_engine, lemma_cache,
+                                                  tweet_df, argparse_obj, report_agreement=True)
+        # with -lean the dataframe holding the raw text can now be freed
+        del tweet_df
 
     if argparse_obj.sent:
-        print("Percentage of Positive tweets {0:.2f}%".format(
-            (processed_tweets['sentiment'].value_counts()[1] / processed_tweets.shape[0]) * 100))
-        print("Percentage of Neutral tweets {0:.2f}%".format(
-            (processed_tweets['sentiment'].value_counts()[0] / processed_tweets.shape[0]) * 100))
-        print("Percentage of Negative tweets {0:.2f}%".format(
-            (processed_tweets['sentiment'].value_counts()[-1] / processed_tweets.shape[0]) * 100))
+        print_sentiment_percentages(processed_tweets['sentiment'].value_counts(),
+                                    processed_tweets.shape[0])
 
     # The names of the jpg and the csv files can be altered
-    if argparse_obj.wc_filename:
-        tweet_obj.gen_word_cloud(processed_tweets,
-                                 f"{argparse_obj.word_cloud_filename}_word_cloud.jpg")
+    if argparse_obj.wc_filename or argparse_obj.term_frequencies:
+        term_frequency_store = new_term_frequency_store(argparse_obj)
+        update_term_frequencies(term_frequency_store, processed_tweets,
+                                read_keywords_file(argparse_obj.tf_keywords))
+        if argparse_obj.term_frequencies:
+            term_frequency_store.save(argparse_obj.term_frequencies)
+        if argparse_obj.wc_filename:
+            render_word_cloud(tweet_obj, term_frequency_store, argparse_obj)
     if argparse_obj.csv_filename:
         tweet_obj.save_df_as_csv(processed_tweets,
                                  f"{argparse_obj.csv_filename}_tweets.csv")
+    if argparse_obj.parquet_dir:
+        with ParquetTweetWriter(argparse_obj.parquet_dir) as parquet_writer:
+            parquet_writer.write(processed_tweets)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
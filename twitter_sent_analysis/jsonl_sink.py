@@ -0,0 +1,175 @@
+"""
+Utility file containing the RotatingJsonlSink class that appends raw tweet JSON
+to rotating gzip compressed JSONL segments with a manifest per segment
+"""
+import os
+import re
+import gzip
+import json
+import threading
+from time import time
+from typing import Union
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# tweets end with "timestamp_ms":"1583860002000", read it without decoding the payload
+TIMESTAMP_MS_RE = re.compile(rb'"timestamp_ms":\s*"(\d+)"')
+
+
+def read_segment_manifest(segment_path: str) -> dict:
+    ''' Return the manifest of a closed segment or None if it has none '''
+    try:
+        with open(segment_path + MANIFEST_SUFFIX, "r") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+class RotatingJsonlSink:
+    ''' Keeps one open gzip handle and appends raw tweet JSON lines to it.
+    A new segment is started when the uncompressed segment size reaches
+    max_segment_bytes or the segment is older than max_segment_secs. A timer
+    thread also closes a segment older than max_segment_secs while the stream
+    is quiet, and the next line opens a new one.
+    Closed segments are fsynced and described by a <segment>.manifest.json
+    with the row count, uncompressed byte range and time span '''
+
+    def __init__(self,
+                 directory: str = "json",
+                 max_segment_bytes: int = 64 * 1024 * 1024,
+                 max_segment_secs: float = 600,
+                 compresslevel: int = 6) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_secs = max_segment_secs
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._raw_file = None
+        self._gzip_file = None
+        self.segment_index = 0
+        # uncompressed bytes written by this sink over all segments
+        self.stream_offset = 0
+        self.rows_written = 0
+        self.segments_closed = 0
+
+        self._closed = threading.Event()
+        self._rotator = threading.Thread(target=self._close_expired_periodically,
+                                         name="jsonl_sink_rotator",
+                                         daemon=True)
+        self._rotator.start()
+
+    def _open_segment(self) -> None:
+        self.segment_start = time()
+        self.segment_path = os.path.join(
+            self.directory, f"{int(self.segment_start)}_{self.segment_index:05d}.jsonl.gz")
+        self.segment_index += 1
+        self.segment_rows = 0
+        self.segment_bytes = 0
+        self.segment_start_offset = self.stream_offset
+        self.min_timestamp_ms = None
+        self.max_timestamp_ms = None
+
+        self._raw_file = open(self.segment_path, "wb")
+        self._gzip_file = gzip.GzipFile(fileobj=self._raw_file,
+                                        mode="wb",
+                                        compresslevel=self.compresslevel)
+
+    def _close_segment(self) -> None:
+        # closing the GzipFile writes the trailer but leaves the raw file open
+        self._gzip_file.close()
+        self._raw_file.flush()
+        os.fsync(self._raw_file.fileno())
+        compressed_bytes = self._raw_file.tell()
+        self._raw_file.close()
+        self._gzip_file = self._raw_file = None
+
+        manifest = {"file": os.path.basename(self.segment_path),
+                    "rows": self.segment_rows,
+                    "uncompressed_bytes": self.segment_bytes,
+                    "compressed_bytes": compressed_bytes,
+                    "byte_range": [self.segment_start_offset, self.stream_offset],
+                    "opened_at": self.segment_start,
+                    "closed_at": time(),
+                    "min_timestamp_ms": self.min_timestamp_ms,
+                    "max_timestamp_ms": self.max_timestamp_ms}
+        manifest_path = self.segment_path + MANIFEST_SUFFIX
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        # a manifest is only visible once its segment is complete
+        os.replace(manifest_path + ".tmp", manifest_path)
+        self.segments_closed += 1
+
+    def _close_expired_segment(self) -> None:
+        with self._lock:
+            if self._gzip_file is not None and time() - self.segment_start >= self.max_segment_secs:
+                self._close_segment()
+
+    def _close_expired_periodically(self) -> None:
+        while not self._closed.wait(min(1.0, self.max_segment_secs)):
+            self._close_expired_segment()
+
+    def write(self, data: Union[str, bytes]) -> None:
+        ''' Append one raw JSON payload as a line of the current segment '''
+        if isinstance(data, str):
+            data = data.encode("utf8")
+        data = data.strip()
+        if not data:
+            return
+        line = data + b"\n"
+
+        match = TIMESTAMP_MS_RE.search(data, max(0, len(data) - 64))
+        timestamp_ms = int(match.group(1)) if match else int(time() * 1000)
+
+        with self._lock:
+            if self._gzip_file is None:
+                self._open_segment()
+            elif (self.segment_bytes >= self.max_segment_bytes
+                  or time() - self.segment_start >= self.max_segment_secs):
+                self._close_segment()
+                self._open_segment()
+
+            self._gzip_file.write(line)
+            self.segment_rows += 1
+            self.segment_bytes += len(line)
+            self.stream_offset += len(line)
+            self.rows_written += 1
+            if self.min_timestamp_ms is None or timestamp_ms < self.min_timestamp_ms:
+                self.min_timestamp_ms = timestamp_ms
+            if self.max_timestamp_ms is None or timestamp_ms > self.max_timestamp_ms:
+                self.max_timestamp_ms = timestamp_ms
+
+    def flush(self) -> None:
+        ''' Write the lines of the current segment through to disk, so that they
+            can be read back from it if the process dies before closing it.
+            A segment older than max_segment_secs is closed instead '''
+        self._close_expired_segment()
+        with self._lock:
+            if self._gzip_file is not None:
+                # a sync flush ends the compressed data written so far on a byte boundary
+                self._gzip_file.flush()
+                os.fsync(self._raw_file.fileno())
+
+    def stats(self) -> dict:
+        return {"rows_written": self.rows_written,
+                "bytes_written": self.stream_offset,
+                "segments_closed": self.segments_closed}
+
+    def close(self) -> None:
+        ''' Close and fsync the current segment and write its manifest '''
+        self._closed.set()
+        self._rotator.join()
+        with self._lock:
+            if self._gzip_file is not None:
+                self._close_segment()
+        print(f"Saved {self.rows_written} tweets ({self.stream_offset} bytes) "
+              + f"in {self.segments_closed} segments under ./{self.directory}")
+
+    def __enter__(self) -> 'RotatingJsonlSink':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
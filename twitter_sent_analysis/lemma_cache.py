@@ -0,0 +1,95 @@
+"""
+Utility file containing the LemmaCache class, a bounded LRU token to lemma
+cache around WordNetLemmatizer that can be persisted between runs.
+Shared by the Twitter and the Rotten Tomatoes pipelines
+"""
+import os
+import pickle
+from collections import OrderedDict
+
+from nltk_resources import wordnet_lemmatizer
+
+
+class LemmaCache:
+    ''' Bounded LRU cache of WordNetLemmatizer.lemmatize results. Token frequencies
+    in tweets and reviews are very skewed so most lookups are hits. If path is
+    given the cache is loaded from it on creation and written to it by save.
+    With track_new the lemmas computed since the last pop_new_lemmas are kept,
+    so that a worker process can send them back to the cache of its parent '''
+
+    def __init__(self, maxsize: int = 200000, path: str = None, track_new: bool = False) -> None:
+        self.maxsize = maxsize
+        self.path = path
+        self._new_lemmas = {} if track_new else None
+        self.hits = 0
+        self.misses = 0
+        # created on the first miss so that a warm cache never loads wordnet
+        self._lemmatizer = None
+        self._lemmas = OrderedDict()
+
+        if path is not None and os.path.isfile(path):
+            with open(path, "rb") as cache_file:
+                self._lemmas = pickle.load(cache_file)
+            while len(self._lemmas) > maxsize:
+                self._lemmas.popitem(last=False)
+
+    def lemmatize(self, token: str) -> str:
+        lemma = self._lemmas.get(token)
+        if lemma is not None:
+            self.hits += 1
+            self._lemmas.move_to_end(token)
+            return lemma
+
+        self.misses += 1
+        if self._lemmatizer is None:
+            self._lemmatizer = wordnet_lemmatizer()
+        lemma = self._lemmatizer.lemmatize(token)
+        self._add(token, lemma)
+        if self._new_lemmas is not None:
+            self._new_lemmas[token] = lemma
+        return lemma
+
+    def _add(self, token: str, lemma: str) -> None:
+        self._lemmas[token] = lemma
+        self._lemmas.move_to_end(token)
+        if len(self._lemmas) > self.maxsize:
+            # evict the least recently used token
+            self._lemmas.popitem(last=False)
+
+    def pop_new_lemmas(self) -> dict:
+        ''' Return the token to lemma pairs computed since the last call '''
+        new_lemmas = self._new_lemmas or {}
+        if self._new_lemmas is not None:
+            self._new_lemmas = {}
+        return new_lemmas
+
+    def update(self, lemmas: dict) -> None:
+        ''' Add the lemmas computed by another cache, i.e. of a worker process '''
+        for token, lemma in lemmas.items():
+            self._add(token, lemma)
+
+    def __len__(self) -> int:
+        return len(self._lemmas)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self._lemmas),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate()}
+
+    def print_stats(self) -> None:
+        print(f"Lemma cache: {len(self._lemmas)} tokens, {self.hits} hits, "
+              + f"{self.misses} misses, hit rate {self.hit_rate() * 100:.2f}%")
+
+    def save(self) -> None:
+        ''' Write the cache to path so that the next run starts warm '''
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "wb") as cache_file:
+            pickle.dump(self._lemmas, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + ".tmp", self.path)
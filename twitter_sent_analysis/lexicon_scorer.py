@@ -0,0 +1,86 @@
+"""
+Utility file containing the LexiconSentimentScorer class, a vectorized scorer
+that loads the TextBlob polarity lexicon once and scores whole columns of
+cleaned text with numpy reductions over token id arrays
+"""
+from typing import Iterable
+
+import numpy as np
+
+NEGATIONS = ("no", "not", "n't", "never")
+
+
+class LexiconSentimentScorer:
+    ''' Scores cleaned texts with the polarity lexicon used by TextBlob's
+    PatternAnalyzer. The polarity of a text is the mean polarity of its known
+    words, where a known adverb such as "really" scales the next known word by its
+    intensity and a preceding negation scales a word by -0.5, as PatternAnalyzer does.
+    Unlike PatternAnalyzer only adjacent modifiers and negations are applied,
+    which makes little difference on texts without stopwords and punctuation '''
+
+    def __init__(self) -> None:
+        # the same lexicon object TextBlob(text).sentiment reads
+        from textblob.en import sentiment as pattern_sentiment
+        pattern_sentiment.load()
+
+        words = list(dict.keys(pattern_sentiment))
+        self.vocabulary = {word: token_id for token_id, word in enumerate(words)}
+        # scores averaged over all senses and part-of-speech tags, as used for untagged text
+        self.token_polarity = np.array([dict.__getitem__(pattern_sentiment, word)[None][0]
+                                        for word in words], dtype=np.float64)
+        self.token_intensity = np.array([dict.__getitem__(pattern_sentiment, word)[None][2]
+                                         for word in words], dtype=np.float64)
+        self.token_is_modifier = np.array(["RB" in dict.__getitem__(pattern_sentiment, word)
+                                           for word in words], dtype=bool)
+        self.negations = frozenset(NEGATIONS)
+
+    def polarity(self, texts: Iterable[str]) -> np.ndarray:
+        ''' Return the polarity of every text as a float64 array '''
+        token_lists = [text.lower().split() for text in texts]
+        n_texts = len(token_lists)
+        text_lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=n_texts)
+        n_tokens = int(text_lengths.sum())
+        if n_tokens == 0:
+            return np.zeros(n_texts, dtype=np.float64)
+
+        vocabulary_get = self.vocabulary.get
+        negations = self.negations
+        token_ids = np.fromiter((vocabulary_get(token, -1)
+                                 for tokens in token_lists for token in tokens),
+                                dtype=np.int64, count=n_tokens)
+        is_negation = np.fromiter((token in negations
+                                   for tokens in token_lists for token in tokens),
+                                  dtype=bool, count=n_tokens)
+        text_index = np.repeat(np.arange(n_texts), text_lengths)
+
+        known = token_ids >= 0
+        safe_ids = np.where(known, token_ids, 0)
+        polarity = np.where(known, self.token_polarity[safe_ids], 0.0)
+        intensity = self.token_intensity[safe_ids]
+        is_modifier = known & self.token_is_modifier[safe_ids]
+
+        # whether the previous token belongs to the same text
+        same_text = np.zeros(n_tokens, dtype=bool)
+        same_text[1:] = text_index[1:] == text_index[:-1]
+
+        # "really good": the modifier and the word form one assessment scaled by the modifier
+        modified = np.zeros(n_tokens, dtype=bool)
+        modified[1:] = known[1:] & is_modifier[:-1] & same_text[1:]
+        previous_intensity = np.ones(n_tokens, dtype=np.float64)
+        previous_intensity[1:] = intensity[:-1]
+        polarity = np.where(modified,
+                            np.clip(polarity * previous_intensity, -1.0, 1.0),
+                            polarity)
+        assessed = known.copy()
+        assessed[:-1] &= ~modified[1:]
+
+        # "not good" = slightly bad
+        negated = np.zeros(n_tokens, dtype=bool)
+        negated[1:] = known[1:] & is_negation[:-1] & same_text[1:]
+        polarity = np.where(negated, polarity * -0.5, polarity)
+
+        polarity_sums = np.bincount(text_index[assessed],
+                                    weights=polarity[assessed],
+                                    minlength=n_texts)
+        assessment_counts = np.bincount(text_index[assessed], minlength=n_texts)
+        return polarity_sums / np.maximum(assessment_counts, 1)
@@ -0,0 +1,289 @@
+"""
+Load test of the JSON and MySQL stream listeners without the Twitter API.
+Archived .jsonl.gz tweets or synthetic tweets are streamed into the listener by a
+ReplayStreamSource at a set rate, with bursts, disconnects and 420 responses, and
+the sustained throughput, the latency until the listener buffers a tweet and,
+for the MySQL listener, until it is committed, and the message loss are reported
+"""
+import os
+import glob
+import json
+import argparse
+from datetime import datetime
+from functools import partial
+
+import download_tweets_data_as_json
+import download_tweets_data_to_mysql
+from jsonl_sink import RotatingJsonlSink
+from tweet_pipeline import TweetPipeline
+from tweet_pipeline import QUEUE_POLICIES
+from stream_replay import LoadTestProbe
+from stream_replay import ReplayStreamSource
+from tweet_extractor import loads
+from stream_replay import read_jsonl_payloads
+from synthetic_tweets import SyntheticTweetGenerator
+from pipeline_metrics import METRICS
+from pipeline_metrics import add_metrics_args
+from pipeline_metrics import configure_metrics
+
+LISTENERS = ("json", "mysql")
+
+
+def load_payloads(argparse_obj):
+    ''' Return the payloads to stream, read before the test so that
+        generating or decompressing them is not timed '''
+    if argparse_obj.json_glob:
+        json_paths = sorted(glob.glob(argparse_obj.json_glob))
+        payloads = []
+        for payload in read_jsonl_payloads(json_paths):
+            if len(payloads) == argparse_obj.n_tweets:
+                break
+            payloads.append(payload)
+        return payloads
+    tweet_generator = SyntheticTweetGenerator(seed=argparse_obj.seed)
+    return list(tweet_generator.payloads(argparse_obj.n_tweets))
+
+
+def _tweet_id(payload):
+    try:
+        return loads(payload).get('id')
+    except (ValueError, AttributeError):
+        return None
+
+
+def _record_commit(probe, rows) -> None:
+    probe.record_commit(row[0] for row in rows)
+
+
+def run_load_test(argparse_obj):
+    payloads = load_payloads(argparse_obj)
+    print(f"Streaming {len(payloads)} tweets into the {argparse_obj.listener} listener")
+
+    if argparse_obj.listener == "json":
+        listener_module = download_tweets_data_as_json
+        tweet_sink = RotatingJsonlSink(argparse_obj.output_dir)
+        handler = tweet_sink.write
+        probe = LoadTestProbe()
+    else:
+        from twitter_config_loader import TwitterConfig
+        from mysql_tweet_writer import MySQLTweetWriter
+
+        listener_module = download_tweets_data_to_mysql
+        # times every tweet until the transaction with its row is committed
+        probe = LoadTestProbe(commit_key=_tweet_id)
+        on_commit = partial(_record_commit, probe)
+        if argparse_obj.spool:
+            from tweet_spool import TweetSpool
+            from tweet_spool import SpooledTweetWriter
+
+            tweet_sink = SpooledTweetWriter(TweetSpool(argparse_obj.spool),
+                                            partial(MySQLTweetWriter, TwitterConfig(),
+                                                    batch_size=argparse_obj.batch_size,
+                                                    on_commit=on_commit),
+                                            batch_size=argparse_obj.batch_size)
+        else:
+            tweet_sink = MySQLTweetWriter(TwitterConfig(), batch_size=argparse_obj.batch_size,
+                                          on_commit=on_commit)
+        handler = partial(download_tweets_data_to_mysql.insert_tweet_payload,
+                          tweet_writer=tweet_sink)
+    stream_source = ReplayStreamSource(payloads,
+                                       rate=argparse_obj.rate,
+                                       burst_every=argparse_obj.burst_every,
+                                       burst_secs=argparse_obj.burst_secs,
+                                       burst_multiplier=argparse_obj.burst_multiplier,
+                                       disconnect_every=argparse_obj.disconnect_every,
+                                       disconnect_secs=argparse_obj.disconnect_secs,
+                                       rate_limit_every=argparse_obj.rate_limit_every,
+                                       rate_limit_secs=argparse_obj.rate_limit_secs,
+                                       on_send=probe.record_send)
+    tweet_pipeline = TweetPipeline(probe.wrap_handler(handler),
+                                   n_workers=argparse_obj.workers,
+                                   max_queue_size=argparse_obj.queue_size,
+                                   policy=argparse_obj.queue_policy,
+                                   put_timeout=argparse_obj.put_timeout)
+    try:
+        listener_module.download_tweets_by_filters(None, tweet_pipeline,
+                                                   stream_source=stream_source)
+    finally:
+        tweet_pipeline.close()
+        # buffered rows are committed, and their commit latencies recorded, on close
+        tweet_sink.close()
+
+    source_stats = stream_source.stats()
+    probe_stats = probe.stats()
+    # rows the MySQL writer could not commit were handled but not stored
+    write_failed = tweet_sink.stats().get("rows_failed", 0) if argparse_obj.listener == "mysql" else 0
+    lost = len(payloads) - probe_stats["handled"] + write_failed
+    results = {"listener": argparse_obj.listener,
+               "timestamp": datetime.now().isoformat(timespec="seconds"),
+               "params": vars(argparse_obj),
+               "source": source_stats,
+               "pipeline": tweet_pipeline.stats(),
+               "probe": probe_stats,
+               "metrics": METRICS.snapshot(),
+               "write_failed": write_failed,
+               "lost": lost,
+               "loss_pct": lost / max(len(payloads), 1) * 100}
+    if argparse_obj.listener == "mysql":
+        results["writer"] = tweet_sink.stats()
+
+    print(f"Sent {source_stats['sent']} tweets at {source_stats['send_rate']:.1f} tweets/s, "
+          + f"{source_stats['disconnects']} disconnects, {source_stats['rate_limits']} rate limits, "
+          + f"max lag {source_stats['max_lag_secs'] * 1000:.1f} ms")
+    print(f"Handled {probe_stats['handled']} tweets at {probe_stats['throughput']:.1f} tweets/s")
+    if probe_stats["handled"]:
+        print(f"Latency until buffered by the listener p50 {probe_stats['latency_p50_ms']:.2f} ms, "
+              + f"p95 {probe_stats['latency_p95_ms']:.2f} ms, "
+              + f"p99 {probe_stats['latency_p99_ms']:.2f} ms, "
+              + f"max {probe_stats['latency_max_ms']:.2f} ms")
+    if probe_stats.get("committed"):
+        print(f"Latency until committed to MySQL p50 {probe_stats['commit_latency_p50_ms']:.2f} ms, "
+              + f"p95 {probe_stats['commit_latency_p95_ms']:.2f} ms, "
+              + f"p99 {probe_stats['commit_latency_p99_ms']:.2f} ms, "
+              + f"max {probe_stats['commit_latency_max_ms']:.2f} ms")
+    print(f"Lost {lost} tweets ({results['loss_pct']:.2f}%): "
+          + f"{source_stats['lost_in_disconnects']} during disconnects and rate limits, "
+          + f"{source_stats['unsent']} after the stream stopped, "
+          + f"{tweet_pipeline.stats()['dropped']} dropped by the queue, "
+          + f"{tweet_pipeline.stats()['failed']} failed, "
+          + f"{write_failed} not committed to MySQL")
+    return results
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Load test the stream listeners with archived or synthetic tweets")
+
+    parser.add_argument('-listener',
+                        '--listener',
+                        type=str,
+                        choices=LISTENERS,
+                        action='store',
+                        default="json",
+                        help="Listener and sink under test")
+    parser.add_argument('-j',
+                        '--json_glob',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="Glob of .jsonl.gz files to replay, synthetic tweets are streamed if not given")
+    parser.add_argument('-n',
+                        '--n_tweets',
+                        type=int,
+                        action='store',
+                        default=20000,
+                        help="Number of tweets to stream")
+    parser.add_argument('--seed',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Random seed of the synthetic tweets")
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        action='store',
+                        default=1000.0,
+                        help="Tweets streamed per second, 0 streams as fast as the listener accepts")
+    parser.add_argument('--burst_every',
+                        type=float,
+                        action='store',
+                        default=None,
+                        help="Seconds between the starts of bursts")
+    parser.add_argument('--burst_secs',
+                        type=float,
+                        action='store',
+                        default=1.0,
+                        help="Length of a burst in seconds")
+    parser.add_argument('--burst_multiplier',
+                        type=float,
+                        action='store',
+                        default=10.0,
+                        help="Rate multiplier during bursts")
+    parser.add_argument('--disconnect_every',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Drop the connection after this many tweets")
+    parser.add_argument('--disconnect_secs',
+                        type=float,
+                        action='store',
+                        default=1.0,
+                        help="Seconds the connection stays down")
+    parser.add_argument('--rate_limit_every',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Send a 420 response after this many tweets")
+    parser.add_argument('--rate_limit_secs',
+                        type=float,
+                        action='store',
+                        default=5.0,
+                        help="Seconds the stream waits after a 420 the listener does not stop on")
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        action='store',
+                        default=2,
+                        help="Number of worker threads parsing and saving tweets")
+    parser.add_argument('-q',
+                        '--queue_size',
+                        type=int,
+                        action='store',
+                        default=10000,
+                        help="Max number of raw tweets waiting in the queue for a worker")
+    parser.add_argument('--queue_policy',
+                        type=str,
+                        choices=QUEUE_POLICIES,
+                        action='store',
+                        default="block",
+                        help="Block the stream or drop tweets when the queue is full")
+    parser.add_argument('--put_timeout',
+                        type=float,
+                        action='store',
+                        default=None,
+                        help="Max seconds the blocking policy waits for space before dropping a tweet")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of tweets per batched insert of the MySQL listener")
+    parser.add_argument('--spool',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="spool_load_test",
+                        default=None,
+                        help="Log the tweets of the MySQL listener in this spool directory, which is " +
+                             "inserted into MySQL by a drainer thread")
+    parser.add_argument('--output_dir',
+                        type=str,
+                        action='store',
+                        default="json_load_test",
+                        help="Directory the JSON listener writes to")
+    parser.add_argument('-o',
+                        '--output',
+                        type=str,
+                        action='store',
+                        default="benchmarks/listener_load_tests.jsonl",
+                        help="File the results are appended to as one JSON line per run")
+    add_metrics_args(parser)
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    configure_metrics(argparse_obj)
+    try:
+        results = run_load_test(argparse_obj)
+    finally:
+        METRICS.close()
+    os.makedirs(os.path.dirname(os.path.abspath(argparse_obj.output)), exist_ok=True)
+    with open(argparse_obj.output, "a") as results_file:
+        results_file.write(json.dumps(results) + "\n")
+    print(f"Results appended to {argparse_obj.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Utility file containing the MySQLTweetWriter class that buffers parsed tweets
+and inserts them into MySQL in batches over a pooled connection
+"""
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mysql.connector import Error
+from mysql.connector import pooling
+from pipeline_metrics import METRICS
+from pipeline_metrics import DEBUG_LOG
+from twitter_config_loader import TwitterConfig
+from twitter_config_loader import print_error
+
+# column order of the rows passed to MySQLTweetWriter.add
+TWEET_COLUMNS = ("tweet_id", "tweet", "created_at", "tweet_place", "favorite_count",
+                 "retweet_count", "reply_count", "user_name", "user_location",
+                 "user_followers_count", "user_friends_count")
+# column added after TWEET_COLUMNS when retweets are collapsed into their original tweet
+RETWEET_COUNT_COLUMN = "seen_retweets"
+# position of every spool replayed into MySQL, updated in the transaction of its rows
+SPOOL_POSITION_TABLE = "tweet_spool_positions"
+SPOOL_POSITION_SCHEMA = f"CREATE TABLE IF NOT EXISTS {SPOOL_POSITION_TABLE} (" +\
+    "spool VARCHAR(255) NOT NULL PRIMARY KEY, segment BIGINT NOT NULL, segment_offset BIGINT NOT NULL)"
+
+
+def _to_tsv_field(field) -> str:
+    ''' Escape a value for the default LOAD DATA field and line terminators '''
+    if field is None:
+        return "\\N"
+    if isinstance(field, datetime):
+        # same format mysql.connector sends for datetime parameters
+        return field.strftime("%Y-%m-%d %H:%M:%S")
+    return str(field).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+class MySQLTweetWriter:
+    ''' Long-lived writer that holds a MySQL connection pool and inserts
+    buffered tweets with multi-row executemany inserts. The buffer is flushed
+    when it reaches batch_size rows, when flush_interval seconds have passed
+    since the last flush, and once more on close. With collapse_retweets rows
+    end with a seen_retweets count that is added to the stored row of a
+    tweet_id already in the table. Otherwise rows with a tweet_id already in
+    the table are skipped by the unique tweet_id index, so reinserting tweets
+    after a crash or replaying them into a filled table does not fail the batch.
+    on_commit is called with the rows of every committed batch '''
+
+    def __init__(self,
+                 cur_config: 'TwitterConfig',
+                 batch_size: int = 500,
+                 flush_interval: float = 5.0,
+                 pool_size: int = 2,
+                 allow_local_infile: bool = False,
+                 collapse_retweets: bool = False,
+                 on_commit: Callable[[List[Tuple]], None] = None) -> None:
+        self.table = cur_config.MYSQL_TABLE
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="tweet_writer",
+            pool_size=pool_size,
+            host=cur_config.MYSQL_HOST,
+            user=cur_config.MYSQL_USERNAME,
+            password=cur_config.MYSQL_PASSWORD,
+            database=cur_config.MYSQL_DATABASE,
+            auth_plugin='mysql_native_password',
+            charset='utf8mb4',
+            allow_local_infile=allow_local_infile)
+        # mysql.connector rewrites executemany of a single-row INSERT into one multi-row INSERT
+        self.columns = TWEET_COLUMNS + ((RETWEET_COUNT_COLUMN,) if collapse_retweets else ())
+        self.query = f"INSERT INTO {self.table}" +\
+            f" ({', '.join(self.columns)})" +\
+            f" VALUES ({', '.join(['%s'] * len(self.columns))})"
+        if collapse_retweets:
+            self.query += f" ON DUPLICATE KEY UPDATE {RETWEET_COUNT_COLUMN} =" +\
+                f" {RETWEET_COUNT_COLUMN} + VALUES({RETWEET_COUNT_COLUMN})"
+        else:
+            # unlike INSERT IGNORE only duplicate keys are skipped, other errors still fail the batch
+            self.query += " ON DUPLICATE KEY UPDATE tweet_id = tweet_id"
+
+        self._buffer = []
+        # tweet_id to number of retweets not yet added to the stored row
+        self._retweet_counts = Counter()
+        self._buffer_lock = threading.Lock()
+        # write_rows takes the lock again when called from flush
+        self._flush_lock = threading.RLock()
+        self._last_flush = time.time()
+
+        self.start_time = time.time()
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.retweets_failed = 0
+        self.retweets_collapsed = 0
+        self.flush_count = 0
+        self.flush_secs_total = 0.0
+        self.flush_secs_max = 0.0
+
+        # flushes a partially filled buffer when the stream is quiet
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="tweet_writer_flusher",
+                                         daemon=True)
+        self._flusher.start()
+
+    def add(self, row: Tuple) -> None:
+        ''' Buffer one tweet row ordered as TWEET_COLUMNS '''
+        with self._buffer_lock:
+            self._buffer.append(row)
+            flush_due = len(self._buffer) >= self.batch_size or \
+                time.time() - self._last_flush >= self.flush_interval
+        if flush_due:
+            self.flush()
+
+    def add_retweet(self, tweet_id) -> None:
+        ''' Buffer one retweet of a tweet already stored or buffered, which adds
+            one to its seen_retweets count instead of inserting a row '''
+        with self._buffer_lock:
+            self._retweet_counts[str(tweet_id)] += 1
+            flush_due = len(self._buffer) + len(self._retweet_counts) >= self.batch_size or \
+                time.time() - self._last_flush >= self.flush_interval
+        if flush_due:
+            self.flush()
+
+    def flush(self) -> int:
+        ''' Insert all buffered rows in one transaction and return the row count '''
+        with self._flush_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+                retweet_counts, self._retweet_counts = self._retweet_counts, Counter()
+                self._last_flush = time.time()
+            if not rows and not retweet_counts:
+                return 0
+
+            try:
+                self.write_rows(rows, retweet_counts=retweet_counts)
+            except Error as e:
+                print_error()
+                print(e)
+                retweets_failed = sum(retweet_counts.values())
+                self.rows_failed += len(rows)
+                self.retweets_failed += retweets_failed
+                METRICS.increment("mysql_rows_failed_total", len(rows))
+                METRICS.increment("mysql_retweets_failed_total", retweets_failed)
+                return 0
+            return len(rows)
+
+    def write_rows(self, rows: List[Tuple], load_data: bool = False,
+                   retweet_counts: Dict[str, int] = None,
+                   spool_position: Tuple[str, int, int] = None) -> None:
+        ''' Insert rows in one transaction, bypassing the buffer. With load_data the rows
+        are bulk loaded with LOAD DATA LOCAL INFILE, which needs allow_local_infile.
+        retweet_counts are added to the seen_retweets of the stored rows after the insert.
+        spool_position (spool, segment, offset) is saved in the same transaction.
+        Raises mysql.connector.Error if the rows could not be committed '''
+        with self._flush_lock:
+            flush_start = time.perf_counter()
+            with METRICS.stage("mysql_flush", len(rows)):
+                mysql_con = self.pool.get_connection()
+                try:
+                    cursor = mysql_con.cursor()
+                    if load_data:
+                        self._load_data_infile(cursor, rows)
+                    elif rows:
+                        cursor.executemany(self.query, rows)
+                    if retweet_counts:
+                        self._add_retweet_counts(cursor, retweet_counts)
+                    if spool_position is not None:
+                        cursor.execute(f"INSERT INTO {SPOOL_POSITION_TABLE} VALUES (%s, %s, %s)"
+                                       + " ON DUPLICATE KEY UPDATE segment = VALUES(segment),"
+                                       + " segment_offset = VALUES(segment_offset)", spool_position)
+                    mysql_con.commit()
+                    cursor.close()
+                finally:
+                    # returns the connection to the pool
+                    mysql_con.close()
+
+            flush_secs = time.perf_counter() - flush_start
+            self.rows_written += len(rows)
+            self.retweets_collapsed += sum(retweet_counts.values()) if retweet_counts else 0
+            self.flush_count += 1
+            self.flush_secs_total += flush_secs
+            self.flush_secs_max = max(self.flush_secs_max, flush_secs)
+
+            DEBUG_LOG.log("Inserted %d tweets into %s in %.1f ms (%.1f rows/s overall)",
+                          len(rows), self.table, flush_secs * 1000, self.rows_per_second())
+            if self.on_commit is not None:
+                self.on_commit(rows)
+
+    def read_spool_position(self, spool: str) -> Optional[Tuple[int, int]]:
+        ''' Return the (segment, offset) of spool saved by write_rows, None if there
+            is none. Creates the SPOOL_POSITION_TABLE on first use '''
+        mysql_con = self.pool.get_connection()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.execute(SPOOL_POSITION_SCHEMA)
+            cursor.execute(f"SELECT segment, segment_offset FROM {SPOOL_POSITION_TABLE} WHERE spool = %s",
+                           (spool,))
+            position = cursor.fetchone()
+            cursor.close()
+        finally:
+            mysql_con.close()
+        return tuple(position) if position is not None else None
+
+    def clear_spool_position(self, spool: str) -> None:
+        ''' Forget the position of a drained spool, whose segments are numbered from 0 again '''
+        mysql_con = self.pool.get_connection()
+        try:
+            cursor = mysql_con.cursor()
+            cursor.execute(f"DELETE FROM {SPOOL_POSITION_TABLE} WHERE spool = %s", (spool,))
+            mysql_con.commit()
+            cursor.close()
+        finally:
+            mysql_con.close()
+
+    def _add_retweet_counts(self, cursor, retweet_counts: Dict[str, int]) -> None:
+        # one UPDATE for all the tweets retweeted since the last flush
+        tweet_ids = list(retweet_counts)
+        cursor.execute(f"UPDATE {self.table} SET {RETWEET_COUNT_COLUMN} = {RETWEET_COUNT_COLUMN} +"
+                       + " CASE tweet_id" + " WHEN %s THEN %s" * len(tweet_ids) + " ELSE 0 END"
+                       + f" WHERE tweet_id IN ({', '.join(['%s'] * len(tweet_ids))})",
+                       tuple(value for tweet_id in tweet_ids
+                             for value in (tweet_id, retweet_counts[tweet_id])) + tuple(tweet_ids))
+
+    def _load_data_infile(self, cursor, rows: List[Tuple]) -> None:
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf8",
+                                         delete=False) as tsv_file:
+            for row in rows:
+                tsv_file.write("\t".join(_to_tsv_field(field) for field in row) + "\n")
+        try:
+            # IGNORE skips the rows with a tweet_id already in the table
+            cursor.execute(f"LOAD DATA LOCAL INFILE '{tsv_file.name}' IGNORE INTO TABLE {self.table}"
+                           + " CHARACTER SET utf8mb4"
+                           + f" ({', '.join(self.columns)})")
+        finally:
+            os.remove(tsv_file.name)
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            if time.time() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def rows_per_second(self) -> float:
+        elapsed = time.time() - self.start_time
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> dict:
+        ''' Return insert throughput and flush latency statistics '''
+        return {"rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "retweets_failed": self.retweets_failed,
+                "retweets_collapsed": self.retweets_collapsed,
+                "flush_count": self.flush_count,
+                "rows_per_second": self.rows_per_second(),
+                "avg_flush_ms": (self.flush_secs_total / self.flush_count * 1000
+                                 if self.flush_count else 0.0),
+                "max_flush_ms": self.flush_secs_max * 1000}
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(f"Wrote {stats['rows_written']} tweets into {self.table} "
+              + f"({stats['rows_failed']} failed, {stats['retweets_collapsed']} retweets collapsed, "
+              + f"{stats['retweets_failed']} failed) "
+              + f"at {stats['rows_per_second']:.1f} rows/s, "
+              + f"{stats['flush_count']} flushes, avg flush {stats['avg_flush_ms']:.1f} ms, "
+              + f"max flush {stats['max_flush_ms']:.1f} ms")
+
+    def close(self) -> None:
+        ''' Stop the periodic flusher and flush the remaining rows '''
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        self.print_stats()
+
+    def __enter__(self) -> 'MySQLTweetWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,38 @@
+"""
+Utility file containing lazy, local only loaders of the nltk corpora used to
+clean text. Nothing is downloaded at runtime, install the corpora once with
+python -m nltk.downloader stopwords wordnet
+"""
+from functools import lru_cache
+
+NLTK_CORPORA = ("stopwords", "wordnet")
+
+
+@lru_cache(maxsize=None)
+def require_nltk_corpus(name: str) -> str:
+    ''' Return the local path of the nltk corpus name or raise a LookupError
+        telling how to install it. The result is cached per process '''
+    import nltk
+    # corpora can be installed unzipped or as zip files
+    for resource_name in (f"corpora/{name}", f"corpora/{name}.zip"):
+        try:
+            return str(nltk.data.find(resource_name))
+        except LookupError:
+            pass
+    raise LookupError(f"The nltk corpus '{name}' is not installed locally. "
+                      + f"Install it once with: python -m nltk.downloader {name}")
+
+
+@lru_cache(maxsize=None)
+def english_stopwords() -> frozenset:
+    ''' Return the nltk english stopwords, loaded on the first call '''
+    require_nltk_corpus("stopwords")
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+def wordnet_lemmatizer():
+    ''' Return a WordNetLemmatizer after checking that wordnet is installed '''
+    require_nltk_corpus("wordnet")
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
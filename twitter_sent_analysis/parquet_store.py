@@ -0,0 +1,148 @@
+"""
+Utility file containing the ParquetTweetWriter class that streams processed
+tweet chunks into a Parquet dataset partitioned by date, and read_tweets_parquet
+that reads it back with column projection and predicate pushdown.
+Needs pyarrow, which is only imported when Parquet is used
+"""
+import os
+from datetime import datetime
+from typing import List
+
+import pandas as pd
+
+# written with dictionary encoding, the other columns are written plain
+DICTIONARY_COLUMNS = ("sentiment", "keyword")
+PARTITION_COLUMN = "date"
+UNKNOWN_DATE_PARTITION = "unknown"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError as e:
+        raise ImportError("Parquet output needs pyarrow, install it with: pip install pyarrow") from e
+    return pyarrow
+
+
+def _column_types(pa) -> dict:
+    ''' Return the Arrow types of the processed tweet columns, other columns keep their inferred type '''
+    return {"ID": pa.int64(),
+            "created_at": pa.timestamp("s"),
+            "tweet": pa.string(),
+            "clean_tweets": pa.string(),
+            "tweet_len": pa.int16(),
+            "sentiment": pa.int8(),
+            "keyword": pa.dictionary(pa.int32(), pa.string())}
+
+
+class ParquetTweetWriter:
+    ''' Appends chunks of processed tweets to root_dir/date=YYYY-MM-DD/ with one
+    Parquet file per date and writer, and one row group per chunk and date. Files
+    are written under a name starting with "_", which dataset readers skip, and
+    renamed on close, so readers never see a file without its footer. The schema
+    is fixed by the first chunk '''
+
+    def __init__(self, root_dir: str = "parquet/tweets", compression: str = "zstd") -> None:
+        self.pa = _import_pyarrow()
+        self.root_dir = root_dir
+        self.compression = compression
+        # files of later runs are added next to the ones of earlier runs
+        self.file_name = f"part-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}.parquet"
+        self.schema = None
+        self._writers = {}
+        self.rows_written = 0
+
+    def _table_schema(self, tweet_df: pd.DataFrame):
+        column_types = _column_types(self.pa)
+        inferred_schema = self.pa.Schema.from_pandas(tweet_df, preserve_index=False)
+        return self.pa.schema([self.pa.field(field.name, column_types[field.name])
+                               if field.name in column_types else field
+                               for field in inferred_schema])
+
+    def _writer(self, date_partition: str):
+        writer = self._writers.get(date_partition)
+        if writer is None:
+            partition_dir = os.path.join(self.root_dir, f"{PARTITION_COLUMN}={date_partition}")
+            os.makedirs(partition_dir, exist_ok=True)
+            writer = self.pa.parquet.ParquetWriter(
+                os.path.join(partition_dir, "_" + self.file_name),
+                self.schema,
+                compression=self.compression,
+                use_dictionary=[name for name in DICTIONARY_COLUMNS if name in self.schema.names])
+            self._writers[date_partition] = writer
+        return writer
+
+    def write(self, tweet_df: pd.DataFrame) -> None:
+        ''' Append the rows of tweet_df, which must have a created_at column '''
+        if tweet_df.empty:
+            return
+        tweet_df = tweet_df.reset_index(drop=True)
+        if not pd.api.types.is_datetime64_any_dtype(tweet_df['created_at']):
+            tweet_df['created_at'] = pd.to_datetime(tweet_df['created_at'], errors='coerce')
+        if self.schema is None:
+            self.schema = self._table_schema(tweet_df)
+        # older pyarrow cannot cast strings to dictionaries, categories are converted directly
+        for field in self.schema:
+            if self.pa.types.is_dictionary(field.type) and field.name in tweet_df and \
+                    not isinstance(tweet_df[field.name].dtype, pd.CategoricalDtype):
+                tweet_df[field.name] = tweet_df[field.name].astype('category')
+        # sub-second parts are dropped, created_at is stored to the second
+        table = self.pa.Table.from_pandas(tweet_df[self.schema.names], preserve_index=False)
+        table = table.cast(self.schema, safe=False)
+
+        date_partitions = tweet_df['created_at'].dt.strftime("%Y-%m-%d").fillna(UNKNOWN_DATE_PARTITION)
+        for date_partition, row_indices in date_partitions.groupby(date_partitions).indices.items():
+            self._writer(date_partition).write_table(table.take(row_indices))
+        self.rows_written += len(tweet_df)
+
+    def close(self) -> None:
+        ''' Write the footers and make the files visible to readers '''
+        for date_partition, writer in self._writers.items():
+            writer.close()
+            partition_dir = os.path.join(self.root_dir, f"{PARTITION_COLUMN}={date_partition}")
+            os.replace(os.path.join(partition_dir, "_" + self.file_name),
+                       os.path.join(partition_dir, self.file_name))
+        if self._writers:
+            print(f"Saved {self.rows_written} tweets in {len(self._writers)} date partitions "
+                  + f"under ./{self.root_dir}")
+        self._writers = {}
+
+    def __enter__(self) -> 'ParquetTweetWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_tweets_parquet(root_dir: str,
+                        columns: List[str] = None,
+                        since: str = None,
+                        until: str = None,
+                        keyword: str = None) -> pd.DataFrame:
+    ''' Read the columns of the tweets created in [since, until) from a dataset
+        written by ParquetTweetWriter. Only the selected columns are decoded,
+        date partitions outside the range are skipped and row groups are
+        skipped by their created_at statistics '''
+    pa = _import_pyarrow()
+    dataset = pa.dataset.dataset(root_dir,
+                                 format="parquet",
+                                 partitioning=pa.dataset.partitioning(
+                                     pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"))
+    conditions = []
+    if since is not None:
+        since = pd.Timestamp(since)
+        conditions += [pa.dataset.field(PARTITION_COLUMN) >= since.strftime("%Y-%m-%d"),
+                       pa.dataset.field("created_at") >= pa.scalar(since, type=pa.timestamp("s"))]
+    if until is not None:
+        until = pd.Timestamp(until)
+        conditions += [pa.dataset.field(PARTITION_COLUMN) <= until.strftime("%Y-%m-%d"),
+                       pa.dataset.field("created_at") < pa.scalar(until, type=pa.timestamp("s"))]
+    if keyword is not None:
+        conditions.append(pa.dataset.field("keyword") == keyword)
+    filter_expression = None
+    for condition in conditions:
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    return dataset.to_table(columns=columns, filter=filter_expression).to_pandas()
@@ -0,0 +1,268 @@
+"""
+Utility file containing the lightweight instrumentation shared by the pipelines:
+counters, gauges and latency histograms in a MetricsRegistry, periodic structured
+log lines, a Prometheus text format dump, opt-in cProfile hooks per stage and
+sampled debug logging that costs one comparison when turned off
+"""
+import os
+import json
+import time
+import bisect
+import pstats
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger("twitter_sent_analysis")
+
+# upper bounds in seconds of the latency histogram buckets, the last one is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    ''' Counts of observed values per bucket of upper bounds buckets, with their sum '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        ''' Return the upper bound of the bucket holding the q quantile '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket_index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[bucket_index] if bucket_index < len(self.buckets) \
+                    else float("inf")
+        return float("inf")
+
+
+class MetricsRegistry:
+    ''' Thread safe counters, gauges and histograms of named metrics. Stages named
+    in profile_stages are run under cProfile once every profile_every calls and
+    their accumulated stats are written to profile_dir on close '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # gauges read when a snapshot is taken instead of on every update
+        self._gauge_callbacks = {}
+        self.histograms = {}
+        self.profile_stages = frozenset()
+        self.profile_every = 1
+        self.profile_dir = "profiles"
+        self._profilers = {}
+        self._stage_calls = {}
+        self._profiling = set()
+        self._reporter = None
+        self._stop_reporting = threading.Event()
+        self.prometheus_path = None
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def register_gauge(self, name: str, read_value: Callable[[], float]) -> None:
+        ''' Report the value returned by read_value as gauge name '''
+        with self._lock:
+            self._gauge_callbacks[name] = read_value
+
+    def _read_gauges(self) -> dict:
+        gauges = dict(self.gauges)
+        for name, read_value in self._gauge_callbacks.items():
+            gauges[name] = read_value()
+        return gauges
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(self, name: str, n_items: int = 1):
+        ''' Time a block as one call of stage name processing n_items records.
+            Records {name}_seconds of every call and {name}_items_total of the
+            calls that succeed, and profiles the block if the stage is selected '''
+        profiler = self._stage_profiler(name) if name in self.profile_stages else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self._profiling.discard(name)
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+        # items of calls that raised are not counted
+        self.increment(f"{name}_items_total", n_items)
+
+    def _stage_profiler(self, name: str):
+        ''' Return the profiler of stage name if this call is to be profiled '''
+        with self._lock:
+            calls = self._stage_calls.get(name, 0)
+            self._stage_calls[name] = calls + 1
+            # cProfile can only run one profiler per thread and a profiler
+            # can not be enabled twice, so concurrent calls are not profiled
+            if calls % self.profile_every or self._profiling:
+                return None
+            self._profiling.add(name)
+            return self._profilers.setdefault(name, cProfile.Profile())
+
+    def snapshot(self) -> dict:
+        ''' Return the current value of every metric, histograms summarized '''
+        with self._lock:
+            snapshot = dict(self.counters)
+            snapshot.update(self._read_gauges())
+            for name, histogram in self.histograms.items():
+                snapshot[f"{name}_count"] = histogram.count
+                snapshot[f"{name}_avg_ms"] = round(histogram.sum / histogram.count * 1000, 3) \
+                    if histogram.count else 0.0
+                snapshot[f"{name}_p50_ms"] = histogram.quantile(0.5) * 1000
+                snapshot[f"{name}_p99_ms"] = histogram.quantile(0.99) * 1000
+        return snapshot
+
+    def log_snapshot(self) -> None:
+        ''' Log the snapshot as one JSON line '''
+        logger.info(json.dumps({"ts": round(time.time(), 3), "metrics": self.snapshot()}))
+
+    def prometheus_text(self) -> str:
+        ''' Return all metrics in the Prometheus text exposition format '''
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+            for name, value in sorted(self._read_gauges().items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(histogram.buckets + ("+Inf",),
+                                                     histogram.counts):
+                    cumulative_count += bucket_count
+                    lines.append(f'{name}_bucket{{le="{upper_bound}"}} {cumulative_count}')
+                lines += [f"{name}_sum {histogram.sum}", f"{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        ''' Write the Prometheus text dump to path, i.e. for the node exporter textfile collector '''
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w") as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        os.replace(path + ".tmp", path)
+
+    def _report_periodically(self, interval: float) -> None:
+        while not self._stop_reporting.wait(interval):
+            self.log_snapshot()
+            if self.prometheus_path:
+                self.write_prometheus(self.prometheus_path)
+
+    def start_reporting(self, interval: float = None, prometheus_path: str = None) -> None:
+        ''' Log a snapshot and rewrite the Prometheus dump every interval seconds '''
+        self.prometheus_path = prometheus_path
+        if interval:
+            self._reporter = threading.Thread(target=self._report_periodically,
+                                              args=(interval,),
+                                              name="metrics_reporter",
+                                              daemon=True)
+            self._reporter.start()
+
+    def close(self) -> None:
+        ''' Stop reporting, write the final dump and the stage profiles '''
+        self._stop_reporting.set()
+        if self._reporter is not None:
+            self._reporter.join()
+            self.log_snapshot()
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+        for name, profiler in self._profilers.items():
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile_path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(profile_path)
+            print(f"Profile of {name} saved in {profile_path}, top functions:")
+            pstats.Stats(profile_path).sort_stats("cumulative").print_stats(10)
+
+
+class SampledLogger:
+    ''' Logs one of every every_n messages at debug level. With every_n 0 the
+    messages are dropped after a single comparison and never formatted '''
+
+    def __init__(self, every_n: int = 0) -> None:
+        self.every_n = every_n
+        self._calls = 0
+
+    def log(self, message: str, *args) -> None:
+        if not self.every_n:
+            return
+        self._calls += 1
+        if self._calls % self.every_n == 0:
+            logger.debug(message, *args)
+
+
+# shared by all the modules of a process
+METRICS = MetricsRegistry()
+DEBUG_LOG = SampledLogger()
+
+
+def add_metrics_args(parser) -> None:
+    ''' Add the instrumentation options to an argparse parser '''
+    parser.add_argument('--metrics_interval',
+                        type=float,
+                        action='store',
+                        default=None,
+                        help="Log a JSON line with all metrics every this many seconds")
+    parser.add_argument('--metrics_file',
+                        type=str,
+                        action='store',
+                        default=None,
+                        help="File the metrics are written to in the Prometheus text format")
+    parser.add_argument('--profile',
+                        type=str,
+                        nargs='+',
+                        action='store',
+                        default=[],
+                        help="Stages to run under cProfile i.e. preprocess scoring mysql_flush")
+    parser.add_argument('--profile_every',
+                        type=int,
+                        action='store',
+                        default=1,
+                        help="Only profile one of every this many calls of a stage")
+    parser.add_argument('--log_sample',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Log one of every this many debug messages, 0 turns them off")
+
+
+def configure_metrics(argparse_obj) -> MetricsRegistry:
+    ''' Set up METRICS and DEBUG_LOG from the add_metrics_args options '''
+    if argparse_obj.metrics_interval or argparse_obj.log_sample:
+        logging.basicConfig(level=logging.DEBUG if argparse_obj.log_sample else logging.INFO,
+                            format="%(asctime)s %(levelname)s %(message)s")
+        logger.setLevel(logging.DEBUG if argparse_obj.log_sample else logging.INFO)
+    DEBUG_LOG.every_n = argparse_obj.log_sample
+    METRICS.profile_stages = frozenset(argparse_obj.profile)
+    METRICS.profile_every = max(1, argparse_obj.profile_every)
+    METRICS.start_reporting(argparse_obj.metrics_interval, argparse_obj.metrics_file)
+    return METRICS
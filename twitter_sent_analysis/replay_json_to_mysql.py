@@ -0,0 +1,169 @@
+import os
+import glob
+import gzip
+import json
+import argparse
+from time import time
+from collections import deque
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+from mysql.connector import Error
+from jsonl_sink import read_segment_manifest
+from mysql_tweet_writer import MySQLTweetWriter
+from twitter_config_loader import TwitterConfig
+from twitter_config_loader import print_error
+from tweet_extractor import extract_tweet_row
+
+
+def parse_json_file(json_path: str, start_line: int) -> Tuple[str, List[int], List[Tuple], int]:
+    ''' Decompress and parse one .jsonl.gz file from start_line on.
+        Returns the path, the line number and the row of every tweet and the line count '''
+    line_numbers, tweet_rows = [], []
+    line_count = 0
+    try:
+        with gzip.open(json_path, "rb") as json_file:
+            for line in json_file:
+                line_no = line_count
+                line_count += 1
+                # limit notices and other stream messages are not tweets
+                if line_no < start_line or b'"created_at"' not in line:
+                    continue
+                tweet_row = extract_tweet_row(line)
+                if tweet_row is not None:
+                    line_numbers.append(line_no)
+                    tweet_rows.append(tweet_row)
+    except EOFError:
+        # the segment is still being written, replay the complete lines
+        pass
+    return json_path, line_numbers, tweet_rows, line_count
+
+
+class ReplayProgress:
+    ''' Per file line offsets of the tweets already committed to MySQL,
+    saved as JSON so an interrupted replay resumes where it stopped '''
+
+    def __init__(self, progress_path: str) -> None:
+        self.progress_path = progress_path
+        self.offsets = {}
+        if os.path.isfile(progress_path):
+            with open(progress_path, "r") as progress_file:
+                self.offsets = json.load(progress_file)
+
+    def offset(self, json_path: str) -> int:
+        return self.offsets.get(os.path.basename(json_path), 0)
+
+    def is_done(self, json_path: str) -> bool:
+        ''' A file is done when all rows of its closed segment were replayed '''
+        manifest = read_segment_manifest(json_path)
+        return manifest is not None and self.offset(json_path) >= manifest["rows"]
+
+    def save(self, json_path: str, offset: int) -> None:
+        self.offsets[os.path.basename(json_path)] = offset
+        with open(self.progress_path + ".tmp", "w") as progress_file:
+            json.dump(self.offsets, progress_file)
+        os.replace(self.progress_path + ".tmp", self.progress_path)
+
+
+def replay_json_files(json_paths: List[str],
+                      tweet_writer: 'MySQLTweetWriter',
+                      progress: 'ReplayProgress',
+                      n_workers: int = 4,
+                      batch_size: int = 5000,
+                      load_data: bool = False) -> int:
+    ''' Parse json_paths in a process pool and bulk insert the tweets in batches,
+        saving the progress of a file after each committed batch '''
+    pending = [path for path in json_paths if not progress.is_done(path)]
+    print(f"Replaying {len(pending)} of {len(json_paths)} files with {n_workers} workers")
+
+    replayed = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # parse at most two files per worker ahead of the inserts to bound memory
+        parsing = deque()
+        pending = deque(pending)
+        while pending or parsing:
+            while pending and len(parsing) < 2 * n_workers:
+                json_path = pending.popleft()
+                parsing.append(executor.submit(
+                    parse_json_file, json_path, progress.offset(json_path)))
+
+            json_path, line_numbers, tweet_rows, line_count = parsing.popleft().result()
+            for start in range(0, len(tweet_rows), batch_size):
+                tweet_writer.write_rows(tweet_rows[start:start + batch_size],
+                                        load_data=load_data)
+                last_line = line_numbers[min(start + batch_size, len(tweet_rows)) - 1]
+                progress.save(json_path, last_line + 1)
+            progress.save(json_path, max(line_count, progress.offset(json_path)))
+            replayed += len(tweet_rows)
+            print(f"Replayed {len(tweet_rows)} tweets from {json_path}")
+    return replayed
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Bulk load tweets archived as .jsonl.gz files by " +
+                    "download_tweets_data_as_json.py into the MySQL db")
+
+    parser.add_argument('-j',
+                        '--json_glob',
+                        type=str,
+                        action='store',
+                        default="json/*.jsonl.gz",
+                        help="Glob of the .jsonl.gz files to replay")
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count(),
+                        help="Number of processes decompressing and parsing files")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=5000,
+                        help="Number of tweets inserted per transaction")
+    parser.add_argument('-p',
+                        '--progress_file',
+                        type=str,
+                        action='store',
+                        default="json/replay_progress.json",
+                        help="File tracking the replayed line offset of every file")
+    parser.add_argument('--load_data',
+                        action='store_true',
+                        help="Bulk load with LOAD DATA LOCAL INFILE (the server needs local_infile=ON)")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    cur_config = TwitterConfig()
+
+    json_paths = sorted(glob.glob(argparse_obj.json_glob))
+    if not json_paths:
+        print(f"No files match {argparse_obj.json_glob}")
+        return -1
+
+    progress = ReplayProgress(argparse_obj.progress_file)
+    tweet_writer = MySQLTweetWriter(cur_config,
+                                    pool_size=1,
+                                    allow_local_infile=argparse_obj.load_data)
+    start_time = time()
+    try:
+        replayed = replay_json_files(json_paths,
+                                     tweet_writer,
+                                     progress,
+                                     n_workers=argparse_obj.workers,
+                                     batch_size=argparse_obj.batch_size,
+                                     load_data=argparse_obj.load_data)
+        print(f"Replayed {replayed} tweets in {time() - start_time:.1f} s")
+    except Error as e:
+        print_error()
+        print(e)
+        print(f"Replay stopped, rerun to resume from {argparse_obj.progress_file}")
+    finally:
+        tweet_writer.close()
+
+
+if __name__ == "__main__":
+    main()
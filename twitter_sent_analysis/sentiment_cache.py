@@ -0,0 +1,124 @@
+"""
+Utility file containing the SentimentCache class, a persistent polarity cache
+in a SQLite file keyed by a hash of the clean text and the scorer version.
+Used by SentimentEngine in the Twitter and the Rotten Tomatoes pipelines
+"""
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+
+# max number of keys per SELECT, below the SQLite variable limit of older versions
+LOOKUP_BATCH_SIZE = 900
+
+
+class SentimentCache:
+    ''' Maps the 16 byte blake2b hash of a clean text, keyed with scorer_version,
+    to its polarity. Texts scored by another scorer version have other keys, so
+    they miss instead of returning stale polarities. Every entry records the last
+    run that used it, and evict deletes the entries of the least recent runs
+    until at most max_entries are left. store calls evict once the stored
+    entries may exceed max_entries. Safe to call from several threads '''
+
+    def __init__(self,
+                 path: str = "cache/sentiment_cache.sqlite",
+                 scorer_version: str = "",
+                 max_entries: int = 5000000) -> None:
+        self.path = path
+        self.scorer_version = scorer_version
+        self.max_entries = max_entries
+        # blake2b keys are at most 64 bytes
+        self._hash_key = hashlib.blake2b(scorer_version.encode("utf8"), digest_size=32).digest()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute("CREATE TABLE IF NOT EXISTS polarity (key BLOB PRIMARY KEY, "
+                          + "polarity REAL NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID")
+        self._con.execute("CREATE INDEX IF NOT EXISTS polarity_last_used ON polarity (last_used)")
+        self._con.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        # runs are numbered to order the entries for eviction
+        self._con.execute("INSERT OR IGNORE INTO meta VALUES ('run', 0)")
+        self._con.execute("UPDATE meta SET value = value + 1 WHERE name = 'run'")
+        self.run = self._con.execute("SELECT value FROM meta WHERE name = 'run'").fetchone()[0]
+        self._con.commit()
+        # upper bound of the entry count, replaced entries are counted again until evict
+        self._size = self._con.execute("SELECT COUNT(*) FROM polarity").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _keys(self, texts: List[str]) -> List[bytes]:
+        return [hashlib.blake2b(text.encode("utf8"), digest_size=16, key=self._hash_key).digest()
+                for text in texts]
+
+    def lookup(self, texts: List[str]) -> np.ndarray:
+        ''' Return the cached polarity of every text, NaN for the texts not cached '''
+        keys = self._keys(texts)
+        cached = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch_keys = keys[start:start + LOOKUP_BATCH_SIZE]
+                cached.update(self._con.execute(
+                    f"SELECT key, polarity FROM polarity WHERE key IN ({', '.join(['?'] * len(batch_keys))})",
+                    batch_keys))
+            self._con.executemany("UPDATE polarity SET last_used = ? WHERE key = ?",
+                                  ((self.run, key) for key in cached))
+            self._con.commit()
+        self.hits += len(cached)
+        self.misses += len(keys) - len(cached)
+        return np.fromiter((cached.get(key, np.nan) for key in keys), dtype=np.float64, count=len(keys))
+
+    def store(self, texts: List[str], polarity: np.ndarray) -> None:
+        with self._lock:
+            self._con.executemany("INSERT OR REPLACE INTO polarity VALUES (?, ?, ?)",
+                                  zip(self._keys(texts), polarity.tolist(), [self.run] * len(texts)))
+            self._con.commit()
+            self._size += len(texts)
+            evict_due = self._size > self.max_entries
+        if evict_due:
+            self.evict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM polarity").fetchone()[0]
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def evict(self) -> int:
+        ''' Delete the least recently used entries beyond max_entries '''
+        with self._lock:
+            self._size = self._con.execute("SELECT COUNT(*) FROM polarity").fetchone()[0]
+            excess = self._size - self.max_entries
+            if excess <= 0:
+                return 0
+            self._con.execute("DELETE FROM polarity WHERE key IN "
+                              + "(SELECT key FROM polarity ORDER BY last_used LIMIT ?)", (excess,))
+            self._con.commit()
+            self._size -= excess
+        self.evicted += excess
+        return excess
+
+    def stats(self) -> dict:
+        return {"size": len(self),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate(),
+                "evicted": self.evicted}
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(f"Sentiment cache: {stats['size']} texts, {stats['hits']} hits, {stats['misses']} misses, "
+              + f"hit rate {stats['hit_rate'] * 100:.2f}%, {stats['evicted']} evicted")
+
+    def close(self) -> None:
+        with self._lock:
+            self._con.close()
@@ -0,0 +1,176 @@
+"""
+Utility file containing the SentimentEngine class that scores columns of text
+with TextBlob polarity in chunks over a process pool, or with the vectorized
+lexicon backend. Shared by the Twitter and the Rotten Tomatoes pipelines
+"""
+import os
+from typing import Callable, Iterable, List
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from lexicon_scorer import LexiconSentimentScorer
+from pipeline_metrics import METRICS
+
+SCORING_BACKENDS = ("textblob", "lexicon")
+# bumped when a backend scores differently, which invalidates its cached polarities
+SCORER_VERSIONS = {"textblob": 1, "lexicon": 1}
+
+# pattern sentiment analyzer loaded once per process by _load_analyzer
+_pattern_sentiment = None
+
+
+def _load_analyzer() -> None:
+    global _pattern_sentiment
+    if _pattern_sentiment is None:
+        # the analyzer TextBlob(text).sentiment uses by default, without building a TextBlob per text
+        from textblob.en import sentiment as pattern_sentiment
+        # the lexicon is parsed lazily on the first call
+        pattern_sentiment("good")
+        _pattern_sentiment = pattern_sentiment
+
+
+def _score_chunk(texts: List[str]) -> np.ndarray:
+    ''' Return the TextBlob polarity of every text in texts '''
+    _load_analyzer()
+    return np.fromiter((_pattern_sentiment(text)[0] for text in texts),
+                       dtype=np.float64,
+                       count=len(texts))
+
+
+def scorer_version(backend: str) -> str:
+    ''' Return the version of backend and of the TextBlob lexicon both backends use '''
+    try:
+        from importlib.metadata import version
+        textblob_version = version("textblob")
+    except Exception:
+        textblob_version = "unknown"
+    return f"{backend}-{SCORER_VERSIONS[backend]}-textblob-{textblob_version}"
+
+
+def polarity_to_tweet_labels(polarity: np.ndarray) -> np.ndarray:
+    ''' Map polarities to 1 (positive), 0 (neutral) or -1 (negative)
+        like TweetObject.generate_sentiment '''
+    return np.sign(polarity).astype(np.int64)
+
+
+def polarity_to_review_labels(polarity: np.ndarray) -> np.ndarray:
+    ''' Map polarities to the 0 (negative) to 4 (positive) labels
+        with the same bounds as MovieReviewObject.generate_sentiment '''
+    negative_bound = -0.3
+    positive_bound = 0.3
+    neutral = 0
+    return np.select([polarity > positive_bound,
+                      (neutral < polarity) & (polarity < positive_bound),
+                      polarity == neutral,
+                      (negative_bound < polarity) & (polarity < neutral)],
+                     [4, 3, 2, 1],
+                     default=0).astype(np.int64)
+
+
+class SentimentEngine:
+    ''' Scores columns of text with TextBlob polarity. With the "textblob" backend
+    the texts are split into chunks of chunksize that are scored by n_workers
+    processes, each of which loads the analyzer once. With a single worker the
+    texts are scored in-process. The "lexicon" backend scores all texts at once
+    in-process with LexiconSentimentScorer. With cache_path the polarities are
+    looked up in a SentimentCache first and only the texts not cached are scored '''
+
+    def __init__(self,
+                 n_workers: int = None,
+                 chunksize: int = 2000,
+                 backend: str = "textblob",
+                 cache_path: str = None,
+                 cache_max_entries: int = 5000000) -> None:
+        if backend not in SCORING_BACKENDS:
+            raise ValueError(f"backend must be one of {SCORING_BACKENDS}, got {backend}")
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.backend = backend
+        self._executor = None
+        self._lexicon_scorer = None
+        self.cache = None
+        if cache_path is not None:
+            from sentiment_cache import SentimentCache
+
+            self.cache = SentimentCache(cache_path, scorer_version(backend), cache_max_entries)
+
+    def polarity(self, texts: Iterable[str]) -> np.ndarray:
+        ''' Return the polarity of every text as a float64 array.
+            Identical texts are scored once '''
+        unique_texts = {}
+        codes = np.fromiter((unique_texts.setdefault(text, len(unique_texts)) for text in texts),
+                            dtype=np.int64)
+        # profiles of the textblob backend only cover the parent process
+        with METRICS.stage("scoring", len(codes)):
+            unique_texts = list(unique_texts)
+            if self.cache is None:
+                return self._unique_polarity(unique_texts)[codes]
+
+            polarity = self.cache.lookup(unique_texts)
+            missing = np.flatnonzero(np.isnan(polarity))
+            if len(missing):
+                missing_texts = [unique_texts[index] for index in missing]
+                polarity[missing] = self._unique_polarity(missing_texts)
+                self.cache.store(missing_texts, polarity[missing])
+            return polarity[codes]
+
+    def _unique_polarity(self, texts: List[str]) -> np.ndarray:
+        if self.backend == "lexicon":
+            if self._lexicon_scorer is None:
+                self._lexicon_scorer = LexiconSentimentScorer()
+            return self._lexicon_scorer.polarity(texts)
+
+        if self.n_workers == 1 or len(texts) <= self.chunksize:
+            return _score_chunk(texts)
+
+        if self._executor is None:
+            # kept open so that chunked callers do not pay the process startup again
+            self._executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                                 initializer=_load_analyzer)
+        chunks = [texts[start:start + self.chunksize]
+                  for start in range(0, len(texts), self.chunksize)]
+        return np.concatenate(list(self._executor.map(_score_chunk, chunks)))
+
+    def tweet_labels(self, texts: Iterable[str]) -> np.ndarray:
+        ''' Return the -1, 0 or 1 sentiment of every tweet text '''
+        return polarity_to_tweet_labels(self.polarity(texts))
+
+    def review_labels(self, texts: Iterable[str]) -> np.ndarray:
+        ''' Return the 0 to 4 sentiment of every review phrase '''
+        return polarity_to_review_labels(self.polarity(texts))
+
+    def print_agreement_report(self,
+                               texts: Iterable[str],
+                               polarity_to_labels: Callable[[np.ndarray], np.ndarray],
+                               sample_size: int = 10000) -> None:
+        ''' Compare the labels of this engine's backend with TextBlob
+            on the first sample_size texts '''
+        texts = list(texts)[:sample_size]
+        backend_polarity = self.polarity(texts)
+        textblob_polarity = _score_chunk(texts)
+        backend_labels = polarity_to_labels(backend_polarity)
+        textblob_labels = polarity_to_labels(textblob_polarity)
+
+        print(f"Agreement of the {self.backend} backend with TextBlob on {len(texts)} texts:")
+        print("\tSame label {0:.2f}%".format(
+            np.mean(backend_labels == textblob_labels) * 100 if texts else 100.0))
+        print("\tSame polarity {0:.2f}%".format(
+            np.mean(np.isclose(backend_polarity, textblob_polarity)) * 100 if texts else 100.0))
+        print("\tMean absolute polarity difference {0:.4f}".format(
+            np.mean(np.abs(backend_polarity - textblob_polarity)) if texts else 0.0))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.cache is not None:
+            self.cache.evict()
+            self.cache.print_stats()
+            self.cache.close()
+            self.cache = None
+
+    def __enter__(self) -> 'SentimentEngine':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -16,6 +16,9 @@ def get_mysql_configuration():
         "MySQL Database Name(i.e. twitter_db): ")
     mysql_conf_dict['TABLE'] = input(
         "MySQL Table Name(i.e. TWEETS_BY_KEYWORD): ")
+    mysql_conf_dict['SENTIMENT_TABLE'] = input(
+        f"MySQL Sentiment Table Name(Enter for {mysql_conf_dict['TABLE']}_SENTIMENT): ") \
+        or f"{mysql_conf_dict['TABLE']}_SENTIMENT"
 
     return mysql_conf_dict
 
@@ -46,6 +49,7 @@ def write_to_conf_file():
         fptr.write(f"USERNAME: {mysql_conf_dict['USERNAME']}\n")
         fptr.write(f"PASSWORD: {mysql_conf_dict['PASSWORD']}\n")
         fptr.write(f"TABLE: {mysql_conf_dict['TABLE']}\n")
+        fptr.write(f"SENTIMENT_TABLE: {mysql_conf_dict['SENTIMENT_TABLE']}\n")
         fptr.write(f"DATABASE: {mysql_conf_dict['DATABASE']}\n")
         fptr.write('\n')
 
@@ -0,0 +1,548 @@
+"""
+Supervisor that splits the keywords, userids and locations of the filter files
+across several worker processes, each with its own stream, pipeline and sink.
+Tweets matched by the filters of several shards are dropped through a Bloom filter
+file shared by the workers once another shard saved them, workers that exit are
+restarted with exponential backoff, and when a filter file changes only the
+shards whose filters changed are restarted
+"""
+import os
+import queue
+import signal
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from time import time, sleep
+from collections import defaultdict
+from typing import Dict, List
+
+from tweet_pipeline import TweetPipeline
+from tweet_pipeline import QUEUE_POLICIES
+from tweet_deduplicator import BloomFilter
+from tweet_deduplicator import TweetDeduplicator
+from tweet_extractor import loads
+from tweet_extractor import extract_tweet_row
+from download_tweets_data_as_json import validate_file_and_rtn_filter_list
+
+SHARD_SINKS = ("json", "mysql")
+# max filters per connection of the v1.1 filter stream
+STREAM_LIMITS = {"track": 400, "follow": 5000, "locations": 25}
+
+
+def _filter_weight(kind: str, item: str) -> int:
+    # a location is a comma separated bounding box of 4 coordinates
+    return max(1, len(item.split(",")) // 4) if kind == "locations" else 1
+
+
+def _stable_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf8"), digest_size=8).digest(), "little")
+
+
+def partition_filters(filters: Dict[str, List[str]], n_shards: int) -> List[Dict[str, List[str]]]:
+    ''' Split the filters into at least n_shards shards within STREAM_LIMITS.
+        Every filter goes to the shard given by its hash, so adding or removing
+        a filter leaves the other shards unchanged while their number is the same '''
+    while True:
+        shards = [{kind: [] for kind in STREAM_LIMITS} for _ in range(n_shards)]
+        for kind, items in filters.items():
+            for item in items:
+                shards[_stable_hash(f"{kind}:{item}") % n_shards][kind].append(item)
+        if all(sum(_filter_weight(kind, item) for item in shard[kind]) <= limit
+               for shard in shards for kind, limit in STREAM_LIMITS.items()):
+            return shards
+        n_shards += 1
+
+
+def _stop_shard(signum, frame):
+    raise SystemExit(0)
+
+
+def run_shard(shard_index: int,
+              filters: Dict[str, List[str]],
+              argparse_obj,
+              bloom_path: str,
+              bloom_lock,
+              stats_queue) -> None:
+    ''' Worker process streaming the tweets of one shard into its own sink.
+        The ids of its tweets are added to the shared Bloom filter at bloom_path
+        only once the sink saved them, so a tweet lost by a crashed shard is not
+        dropped by the others. Tweets received by two shards before either saved
+        them are saved twice. Its counters are put on stats_queue every
+        report_secs and on exit '''
+    # the supervisor stops the workers on Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_shard)
+    from twitter_config_loader import TwitterConfig
+    from download_tweets_data_as_json import download_tweets_by_filters
+
+    deduplicator = TweetDeduplicator(argparse_obj.seen_size,
+                                     bloom_path=bloom_path,
+                                     bloom_capacity=argparse_obj.bloom_capacity,
+                                     bloom_lock=bloom_lock,
+                                     bloom_window_secs=argparse_obj.bloom_window)
+    stop_saving = threading.Event()
+    if argparse_obj.sink == "mysql":
+        from mysql_tweet_writer import MySQLTweetWriter
+
+        # the MySQL unique tweet_id index skips the tweets also saved by another shard
+        sink = MySQLTweetWriter(TwitterConfig(), batch_size=argparse_obj.batch_size,
+                                on_commit=lambda rows: deduplicator.mark_saved(row[0] for row in rows))
+
+        def handler(data) -> None:
+            tweet_row = extract_tweet_row(data)
+            if tweet_row is not None and not deduplicator.is_duplicate(tweet_row[0], remember_shared=False):
+                sink.add(tweet_row)
+
+        def save() -> None:
+            pass
+    else:
+        from jsonl_sink import RotatingJsonlSink
+
+        sink = RotatingJsonlSink(os.path.join(argparse_obj.json_dir, f"shard_{shard_index:02d}"))
+        # ids of the tweets written since the last flush of the sink
+        unsaved_ids = []
+        unsaved_lock = threading.Lock()
+
+        def handler(data) -> None:
+            # stream messages that are not tweets are archived as they are
+            tweet_id = loads(data).get('id')
+            if tweet_id is None:
+                sink.write(data)
+            elif not deduplicator.is_duplicate(tweet_id, remember_shared=False):
+                sink.write(data)
+                with unsaved_lock:
+                    unsaved_ids.append(tweet_id)
+
+        def save() -> None:
+            with unsaved_lock:
+                saved_ids = unsaved_ids[:]
+                del unsaved_ids[:]
+            sink.flush()
+            deduplicator.mark_saved(saved_ids)
+
+        def save_periodically() -> None:
+            while not stop_saving.wait(argparse_obj.flush_secs):
+                save()
+
+        threading.Thread(target=save_periodically, name="shard_flusher", daemon=True).start()
+
+    tweet_pipeline = TweetPipeline(handler,
+                                   n_workers=argparse_obj.threads,
+                                   max_queue_size=argparse_obj.queue_size,
+                                   policy=argparse_obj.queue_policy)
+
+    def shard_stats() -> dict:
+        pipeline_stats = tweet_pipeline.stats()
+        return {"shard": shard_index,
+                "pid": os.getpid(),
+                "received": pipeline_stats["enqueued"] + pipeline_stats["dropped"],
+                "processed": pipeline_stats["processed"],
+                "duplicates": deduplicator.stats()["duplicates"],
+                "failed": pipeline_stats["failed"],
+                "dropped": pipeline_stats["dropped"]}
+
+    stop_reporting = threading.Event()
+
+    def report() -> None:
+        while not stop_reporting.wait(argparse_obj.report_secs):
+            stats_queue.put(shard_stats())
+
+    threading.Thread(target=report, name="shard_stats", daemon=True).start()
+    if argparse_obj.synthetic:
+        from stream_replay import ReplayStreamSource
+        from synthetic_tweets import SyntheticTweetGenerator
+
+        api = None
+        # every shard sends the same tweets, like shards with overlapping filters
+        tweet_generator = SyntheticTweetGenerator(seed=argparse_obj.seed)
+        stream_source = ReplayStreamSource(tweet_generator.payloads(argparse_obj.synthetic),
+                                           rate=argparse_obj.rate)
+    else:
+        from download_tweets_data_as_json import TweepyConfig
+
+        api = TweepyConfig(TwitterConfig()).tweepy_api()
+        stream_source = None
+    try:
+        download_tweets_by_filters(api,
+                                   tweet_pipeline,
+                                   track=filters["track"],
+                                   follow=filters["follow"],
+                                   locations=filters["locations"],
+                                   languages=['en'],
+                                   stream_source=stream_source)
+    finally:
+        # the queued tweets are saved before a stopped worker exits
+        tweet_pipeline.close()
+        stop_saving.set()
+        save()
+        sink.close()
+        deduplicator.close()
+        stop_reporting.set()
+        stats_queue.put(shard_stats())
+
+
+class ShardSupervisor:
+    ''' Runs one run_shard process per shard of the filters read from filter_files
+    and checks them every poll_secs. A worker that exits is restarted after
+    backoff * 2^n seconds, capped at max_backoff, where n counts its restarts
+    since it last ran for stable_secs. With synthetic streams workers that
+    finish are not restarted. The filter files are checked every watch_secs and
+    the shards whose filters changed are restarted with their new filters.
+    The shards share the Bloom filter of argparse_obj.bloom_file, or without
+    it one in a temporary file deleted when the run ends '''
+
+    def __init__(self,
+                 filter_files: Dict[str, str],
+                 argparse_obj,
+                 n_shards: int = 2,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 stable_secs: float = 60.0,
+                 poll_secs: float = 0.5,
+                 watch_secs: float = 5.0,
+                 report_secs: float = 10.0) -> None:
+        self.filter_files = {kind: path for kind, path in filter_files.items() if path is not None}
+        self.argparse_obj = argparse_obj
+        self.n_shards = n_shards
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_secs = stable_secs
+        self.poll_secs = poll_secs
+        self.watch_secs = watch_secs
+        self.report_secs = report_secs
+
+        self.bloom_path = argparse_obj.bloom_file
+        self._bloom_dir = None
+        self.bloom_lock = multiprocessing.Lock()
+        self.stats_queue = multiprocessing.Queue()
+        self.shard_filters = []
+        self.workers = {}
+        self.started_at = {}
+        self.restart_at = {}
+        self.failures = defaultdict(int)
+        self._file_versions = None
+        # last counters of every worker process, also of the stopped ones
+        self.worker_stats = {}
+        self.restarts = 0
+        self.rebalances = 0
+
+    def _read_file_versions(self) -> Dict[str, int]:
+        return {path: os.stat(path).st_mtime_ns for path in self.filter_files.values()}
+
+    def load_filters(self) -> Dict[str, List[str]]:
+        return {kind: validate_file_and_rtn_filter_list(path)
+                for kind, path in self.filter_files.items()}
+
+    def _start(self, shard_index: int) -> None:
+        worker = multiprocessing.Process(target=run_shard,
+                                         name=f"shard_{shard_index:02d}",
+                                         args=(shard_index,
+                                               self.shard_filters[shard_index],
+                                               self.argparse_obj,
+                                               self.bloom_path,
+                                               self.bloom_lock,
+                                               self.stats_queue))
+        worker.start()
+        self.workers[shard_index] = worker
+        self.started_at[shard_index] = time()
+
+    def _stop(self, shard_index: int) -> None:
+        self.restart_at.pop(shard_index, None)
+        worker = self.workers.pop(shard_index, None)
+        if worker is None:
+            return
+        worker.terminate()
+        worker.join(30)
+        if worker.is_alive():
+            worker.kill()
+            worker.join()
+
+    def _is_runnable(self, shard_index: int) -> bool:
+        # the filter stream rejects connections without filters
+        return self.argparse_obj.synthetic or any(self.shard_filters[shard_index].values())
+
+    def apply_partition(self, shard_filters: List[Dict[str, List[str]]]) -> List[int]:
+        ''' Restart the shards whose filters differ from shard_filters and
+            return their indices. Unchanged shards keep streaming '''
+        old_filters = self.shard_filters
+        self.shard_filters = shard_filters
+        changed = [shard_index for shard_index in range(max(len(old_filters), len(shard_filters)))
+                   if shard_index >= len(old_filters) or shard_index >= len(shard_filters)
+                   or old_filters[shard_index] != shard_filters[shard_index]]
+        for shard_index in changed:
+            self._stop(shard_index)
+            self.failures.pop(shard_index, None)
+            if shard_index < len(shard_filters) and self._is_runnable(shard_index):
+                self._start(shard_index)
+        return changed
+
+    def check_filter_files(self) -> None:
+        try:
+            file_versions = self._read_file_versions()
+            if file_versions == self._file_versions:
+                return
+            filters = self.load_filters()
+        except (OSError, EOFError):
+            # i.e. a file emptied or replaced while it is rewritten, it is read again on the next check
+            print("Could not read the filter files, keeping the current shards")
+            return
+        self._file_versions = file_versions
+        shard_filters = partition_filters(filters, self.n_shards)
+        if self.shard_filters:
+            changed = self.apply_partition(shard_filters)
+            if changed:
+                self.rebalances += 1
+                print(f"Filter files changed, restarted shards {changed} of {len(shard_filters)}")
+        else:
+            self.apply_partition(shard_filters)
+            for shard_index, shard in enumerate(shard_filters):
+                print(f"\tshard {shard_index}: " + ", ".join(f"{len(shard[kind])} {kind}" for kind in STREAM_LIMITS))
+
+    def check_workers(self) -> None:
+        now = time()
+        for shard_index, worker in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            worker.join()
+            del self.workers[shard_index]
+            if worker.exitcode == 0 and self.argparse_obj.synthetic:
+                continue
+            if now - self.started_at[shard_index] >= self.stable_secs:
+                self.failures[shard_index] = 0
+            delay = min(self.max_backoff, self.backoff * 2 ** self.failures[shard_index])
+            self.failures[shard_index] += 1
+            self.restart_at[shard_index] = now + delay
+            print(f"Shard {shard_index} exited with code {worker.exitcode}, restarting in {delay:.0f} s")
+
+        for shard_index, restart_time in list(self.restart_at.items()):
+            if now >= restart_time:
+                del self.restart_at[shard_index]
+                self.restarts += 1
+                self._start(shard_index)
+
+    def drain_stats(self) -> None:
+        while True:
+            try:
+                shard_stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.worker_stats[shard_stats["pid"]] = shard_stats
+
+    def stats(self) -> dict:
+        combined = defaultdict(int)
+        for shard_stats in self.worker_stats.values():
+            for name in ("received", "processed", "duplicates", "failed", "dropped"):
+                combined[name] += shard_stats[name]
+        combined["running_shards"] = len(self.workers)
+        combined["restarts"] = self.restarts
+        combined["rebalances"] = self.rebalances
+        return dict(combined)
+
+    def print_stats(self, elapsed: float) -> None:
+        stats = self.stats()
+        unique = stats.get("processed", 0) - stats.get("duplicates", 0)
+        print(f"{stats['running_shards']} shards received {stats.get('received', 0)} tweets "
+              + f"({stats.get('received', 0) / max(elapsed, 1e-9):.0f}/s), saved {unique} "
+              + f"({unique / max(elapsed, 1e-9):.0f}/s), duplicates {stats.get('duplicates', 0)}, "
+              + f"failed {stats.get('failed', 0)}, dropped {stats.get('dropped', 0)}, "
+              + f"restarts {stats['restarts']}, rebalances {stats['rebalances']}")
+
+    def run(self) -> None:
+        ''' Supervise the shards until they all finish or Ctrl-C is pressed '''
+        if self.bloom_path is None:
+            self._bloom_dir = tempfile.mkdtemp(prefix="sharded_seen_")
+            self.bloom_path = os.path.join(self._bloom_dir, "seen.bloom")
+        # created once here so that the workers open the same file
+        BloomFilter(self.bloom_path, self.argparse_obj.bloom_capacity).flush()
+        start_time = time()
+        last_file_check = last_report = start_time
+        self.check_filter_files()
+        try:
+            while self.workers or self.restart_at:
+                sleep(self.poll_secs)
+                self.drain_stats()
+                self.check_workers()
+                now = time()
+                if now - last_file_check >= self.watch_secs:
+                    last_file_check = now
+                    self.check_filter_files()
+                if now - last_report >= self.report_secs:
+                    last_report = now
+                    self.print_stats(now - start_time)
+        except KeyboardInterrupt:
+            print("Stopping the shards")
+        finally:
+            for shard_index in list(self.workers):
+                self._stop(shard_index)
+            self.drain_stats()
+            self.print_stats(time() - start_time)
+            if self._bloom_dir is not None:
+                shutil.rmtree(self._bloom_dir, ignore_errors=True)
+
+
+def validate_and_return_args():
+    parser = argparse.ArgumentParser(
+        description="Stream tweets with several processes, each streaming a shard of the filters")
+
+    parser.add_argument('-t',
+                        '--track',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing keywords i.e. batman,joker")
+    parser.add_argument('-f',
+                        '--follow',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing userids i.e. 25073877")
+    parser.add_argument('-l',
+                        '--locations',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        default=None,
+                        help="Name of file containing geo-locations i.e. -122.75,36.8,-121.75,37.8,-74,40,-73,41")
+    parser.add_argument('-s',
+                        '--shards',
+                        type=int,
+                        action='store',
+                        default=2,
+                        help="Min number of shards, each streamed by one process. More are used if " +
+                             "the filters exceed the limits of one stream")
+    parser.add_argument('-sink',
+                        '--sink',
+                        type=str,
+                        choices=SHARD_SINKS,
+                        action='store',
+                        default="json",
+                        help="Save the tweets of each shard as .jsonl.gz files or into MySQL")
+    parser.add_argument('--json_dir',
+                        type=str,
+                        action='store',
+                        default="json",
+                        help="Directory with one shard_NN directory of .jsonl.gz files per shard")
+    parser.add_argument('-b',
+                        '--batch_size',
+                        type=int,
+                        action='store',
+                        default=500,
+                        help="Number of tweets per batched insert into MySQL")
+    parser.add_argument('-w',
+                        '--threads',
+                        type=int,
+                        action='store',
+                        default=2,
+                        help="Number of worker threads saving tweets in each shard")
+    parser.add_argument('-q',
+                        '--queue_size',
+                        type=int,
+                        action='store',
+                        default=10000,
+                        help="Max number of raw tweets waiting in the queue of each shard")
+    parser.add_argument('--queue_policy',
+                        type=str,
+                        choices=QUEUE_POLICIES,
+                        action='store',
+                        default="block",
+                        help="Block the stream or drop tweets when the queue of a shard is full")
+    parser.add_argument('--seen_size',
+                        type=int,
+                        action='store',
+                        default=1000000,
+                        help="Number of tweet ids remembered in memory by each shard")
+    parser.add_argument('--bloom_file',
+                        type=str,
+                        nargs='?',
+                        action='store',
+                        const="cache/sharded_seen.bloom",
+                        default=None,
+                        help="Keep the Bloom filter the shards share to drop tweets saved by another " +
+                             "shard in this file, so that it also drops the tweets saved by earlier runs. " +
+                             "Without it the filter is only kept for this run")
+    parser.add_argument('--bloom_capacity',
+                        type=int,
+                        action='store',
+                        default=10000000,
+                        help="Number of tweet ids per generation of the Bloom filter, after which " +
+                             "the ids of the generation before are forgotten")
+    parser.add_argument('--bloom_window',
+                        type=float,
+                        action='store',
+                        default=3600.0,
+                        help="Seconds after which the Bloom filter starts a new generation and forgets " +
+                             "the ids of the generation before, 0 to only rotate when it is full")
+    parser.add_argument('--flush_secs',
+                        type=float,
+                        action='store',
+                        default=1.0,
+                        help="Seconds between flushes of the json sink of each shard, after which " +
+                             "its tweets are dropped by the other shards")
+    parser.add_argument('--backoff',
+                        type=float,
+                        action='store',
+                        default=1.0,
+                        help="Seconds before the first restart of a worker, doubled on every further restart")
+    parser.add_argument('--max_backoff',
+                        type=float,
+                        action='store',
+                        default=60.0,
+                        help="Max seconds before a worker is restarted")
+    parser.add_argument('--watch_secs',
+                        type=float,
+                        action='store',
+                        default=5.0,
+                        help="Seconds between checks of the filter files for changes")
+    parser.add_argument('--report_secs',
+                        type=float,
+                        action='store',
+                        default=10.0,
+                        help="Seconds between reports of the combined throughput")
+    parser.add_argument('--synthetic',
+                        type=int,
+                        action='store',
+                        default=None,
+                        help="Stream this many synthetic tweets per shard from a local stand-in " +
+                             "instead of the Twitter API")
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        action='store',
+                        default=1000.0,
+                        help="Tweets per second of each --synthetic shard, 0 for as fast as it accepts")
+    parser.add_argument('--seed',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help="Random seed of the synthetic tweets")
+
+    return parser.parse_args()
+
+
+def main():
+    argparse_obj = validate_and_return_args()
+    if (argparse_obj.track is None
+        and argparse_obj.follow is None
+            and argparse_obj.locations is None):
+        print("No filters files selected. Please add them")
+        return -1
+
+    supervisor = ShardSupervisor({"track": argparse_obj.track,
+                                  "follow": argparse_obj.follow,
+                                  "locations": argparse_obj.locations},
+                                 argparse_obj,
+                                 n_shards=argparse_obj.shards,
+                                 backoff=argparse_obj.backoff,
+                                 max_backoff=argparse_obj.max_backoff,
+                                 watch_secs=argparse_obj.watch_secs,
+                                 report_secs=argparse_obj.report_secs)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
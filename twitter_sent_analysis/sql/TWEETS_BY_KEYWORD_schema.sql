@@ -2,7 +2,7 @@ CREATE TABLE TWEETS_BY_KEYWORD (
     ID INT AUTO_INCREMENT,
     tweet_id VARCHAR(255) NOT NULL,
     tweet TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
-    created_at VARCHAR(50),
+    created_at DATETIME,          /* UTC */
     tweet_place VARCHAR(255),   /* Nullable object */
     favorite_count INT(11),       /* Nullable object */
     retweet_count INT(11) NOT NULL,
@@ -12,5 +12,8 @@ CREATE TABLE TWEETS_BY_KEYWORD (
     user_location VARCHAR(255), /* Nullable object */
     user_followers_count INT(11) NOT NULL,
     user_friends_count INT(11) NOT NULL,
-    PRIMARY KEY (ID)
+    seen_retweets INT(11) NOT NULL DEFAULT 0,  /* retweets collapsed into this tweet */
+    PRIMARY KEY (ID),
+    UNIQUE INDEX uniq_tweet_id (tweet_id),
+    INDEX idx_created_at (created_at)
 );
@@ -0,0 +1,21 @@
+CREATE TABLE TWEETS_BY_KEYWORD_SENTIMENT (
+    ID INT NOT NULL,              /* ID of the scored tweet in TWEETS_BY_KEYWORD */
+    created_at DATETIME,          /* UTC */
+    keyword VARCHAR(255),         /* Nullable, first keyword found in the tweet */
+    clean_tweet TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+    sentiment TINYINT NOT NULL,   /* -1, 0 or 1 */
+    PRIMARY KEY (ID),
+    INDEX idx_created_at_sentiment (created_at, sentiment),
+    INDEX idx_keyword_created_at (keyword, created_at)
+);
+
+CREATE TABLE TWEETS_BY_USERID_SENTIMENT (
+    ID INT NOT NULL,              /* ID of the scored tweet in TWEETS_BY_USERID */
+    created_at DATETIME,          /* UTC */
+    keyword VARCHAR(255),         /* Nullable, first keyword found in the tweet */
+    clean_tweet TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+    sentiment TINYINT NOT NULL,   /* -1, 0 or 1 */
+    PRIMARY KEY (ID),
+    INDEX idx_created_at_sentiment (created_at, sentiment),
+    INDEX idx_keyword_created_at (keyword, created_at)
+);
@@ -0,0 +1,27 @@
+/* Converts created_at of tables created with the VARCHAR(50) schemas to DATETIME
+   and adds the indexes and the keyword column used by the aggregation queries.
+   Stored values look like 2020-03-10 17:06:42+00:00 and are all UTC.
+   Run the statements of the tables that exist. */
+
+ALTER TABLE TWEETS_BY_KEYWORD ADD COLUMN created_at_dt DATETIME AFTER created_at;
+UPDATE TWEETS_BY_KEYWORD SET created_at_dt = STR_TO_DATE(LEFT(created_at, 19), '%Y-%m-%d %H:%i:%s');
+ALTER TABLE TWEETS_BY_KEYWORD
+    DROP COLUMN created_at,
+    RENAME COLUMN created_at_dt TO created_at,
+    ADD INDEX idx_created_at (created_at);
+
+ALTER TABLE TWEETS_BY_USERID ADD COLUMN created_at_dt DATETIME AFTER created_at;
+UPDATE TWEETS_BY_USERID SET created_at_dt = STR_TO_DATE(LEFT(created_at, 19), '%Y-%m-%d %H:%i:%s');
+ALTER TABLE TWEETS_BY_USERID
+    DROP COLUMN created_at,
+    RENAME COLUMN created_at_dt TO created_at,
+    ADD INDEX idx_created_at (created_at);
+
+ALTER TABLE TWEETS_BY_KEYWORD_SENTIMENT ADD COLUMN created_at_dt DATETIME AFTER created_at;
+UPDATE TWEETS_BY_KEYWORD_SENTIMENT SET created_at_dt = STR_TO_DATE(LEFT(created_at, 19), '%Y-%m-%d %H:%i:%s');
+ALTER TABLE TWEETS_BY_KEYWORD_SENTIMENT
+    DROP COLUMN created_at,
+    RENAME COLUMN created_at_dt TO created_at,
+    ADD COLUMN keyword VARCHAR(255) AFTER created_at,
+    ADD INDEX idx_created_at_sentiment (created_at, sentiment),
+    ADD INDEX idx_keyword_created_at (keyword, created_at);
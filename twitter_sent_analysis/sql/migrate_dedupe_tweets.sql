@@ -0,0 +1,18 @@
+/* Adds the seen_retweets column and the unique tweet_id index used by
+   download_tweets_data_to_mysql.py --dedupe to tables created with earlier schemas.
+   Rows with a tweet_id stored more than once are deleted first, keeping the lowest ID.
+   Run the statements of the tables that exist. */
+
+DELETE duplicate FROM TWEETS_BY_KEYWORD duplicate
+    JOIN TWEETS_BY_KEYWORD original
+    ON duplicate.tweet_id = original.tweet_id AND duplicate.ID > original.ID;
+ALTER TABLE TWEETS_BY_KEYWORD
+    ADD COLUMN seen_retweets INT(11) NOT NULL DEFAULT 0,
+    ADD UNIQUE INDEX uniq_tweet_id (tweet_id);
+
+DELETE duplicate FROM TWEETS_BY_USERID duplicate
+    JOIN TWEETS_BY_USERID original
+    ON duplicate.tweet_id = original.tweet_id AND duplicate.ID > original.ID;
+ALTER TABLE TWEETS_BY_USERID
+    ADD COLUMN seen_retweets INT(11) NOT NULL DEFAULT 0,
+    ADD UNIQUE INDEX uniq_tweet_id (tweet_id);
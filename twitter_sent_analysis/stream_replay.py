@@ -0,0 +1,206 @@
+"""
+Utility file containing a local stand-in for the Twitter stream. ReplayStreamSource
+feeds archived or synthetic payloads into a tweepy StreamListener at a set rate
+with bursts, disconnects and 420 responses, and LoadTestProbe measures the latency
+until the pipeline behind the listener handles or commits a tweet and its loss
+"""
+import gzip
+import time
+import threading
+from typing import Callable, Iterable, Iterator, List
+
+import numpy as np
+
+
+def read_jsonl_payloads(json_paths: List[str]) -> Iterator[str]:
+    ''' Yield the tweet payloads of .jsonl.gz files saved by RotatingJsonlSink '''
+    for json_path in json_paths:
+        with gzip.open(json_path, "rb") as json_file:
+            try:
+                for line in json_file:
+                    if b'"created_at"' in line:
+                        yield line.decode("utf8")
+            except EOFError:
+                # segment of an interrupted download
+                pass
+
+
+class ReplayStreamSource:
+    ''' Stream source that calls listener.on_connect, on_data and on_error like
+    tweepy.Stream does. Payloads are sent at rate per second, at rate * burst_multiplier
+    during the first burst_secs of every burst_every seconds. Every disconnect_every
+    payloads the connection drops for disconnect_secs, and the payloads the stream
+    would have sent meanwhile are lost as they are on the real stream. Every
+    rate_limit_every payloads the listener gets a 420 and the stream stops if
+    on_error returns False, else it waits rate_limit_secs. A rate of 0 sends as fast
+    as the listener accepts '''
+
+    def __init__(self,
+                 payloads: Iterable[str],
+                 rate: float = 1000.0,
+                 burst_every: float = None,
+                 burst_secs: float = 1.0,
+                 burst_multiplier: float = 10.0,
+                 disconnect_every: int = None,
+                 disconnect_secs: float = 1.0,
+                 rate_limit_every: int = None,
+                 rate_limit_secs: float = 5.0,
+                 on_send: Callable[[str], None] = None) -> None:
+        self.payloads = payloads
+        self.rate = rate
+        self.burst_every = burst_every
+        self.burst_secs = burst_secs
+        self.burst_multiplier = burst_multiplier
+        self.disconnect_every = disconnect_every
+        self.disconnect_secs = disconnect_secs
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_secs = rate_limit_secs
+        self.on_send = on_send
+
+        self.sent = 0
+        self.lost_in_disconnects = 0
+        self.disconnects = 0
+        self.rate_limits = 0
+        self.unsent = 0
+        self.max_lag_secs = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def _current_rate(self, elapsed: float) -> float:
+        if self.burst_every and elapsed % self.burst_every < self.burst_secs:
+            return self.rate * self.burst_multiplier
+        return self.rate
+
+    def _wait_offline(self, offline_secs: float, payload_iter: Iterator[str]) -> None:
+        ''' Sleep offline_secs and skip the payloads sent in the meantime '''
+        time.sleep(offline_secs)
+        n_skipped = int(offline_secs * self.rate) if self.rate else 0
+        for _ in range(n_skipped):
+            if next(payload_iter, None) is None:
+                break
+            self.lost_in_disconnects += 1
+
+    def run(self, listener) -> None:
+        ''' Stream all payloads into listener '''
+        payload_iter = iter(self.payloads)
+        self.start_time = time.perf_counter()
+        next_send_time = self.start_time
+        listener.on_connect()
+
+        for payload in payload_iter:
+            if self.disconnect_every and self.sent and self.sent % self.disconnect_every == 0:
+                self.disconnects += 1
+                self._wait_offline(self.disconnect_secs, payload_iter)
+                next_send_time = time.perf_counter()
+                listener.on_connect()
+            if self.rate_limit_every and self.sent and self.sent % self.rate_limit_every == 0:
+                self.rate_limits += 1
+                if listener.on_error(420) is False:
+                    self.unsent += 1 + sum(1 for _ in payload_iter)
+                    break
+                self._wait_offline(self.rate_limit_secs, payload_iter)
+                next_send_time = time.perf_counter()
+                listener.on_connect()
+
+            if self.rate:
+                now = time.perf_counter()
+                if next_send_time > now:
+                    time.sleep(next_send_time - now)
+                else:
+                    # the listener is slower than the stream
+                    self.max_lag_secs = max(self.max_lag_secs, now - next_send_time)
+                next_send_time += 1.0 / self._current_rate(next_send_time - self.start_time)
+
+            if self.on_send is not None:
+                self.on_send(payload)
+            self.sent += 1
+            if listener.on_data(payload) is False:
+                self.unsent += sum(1 for _ in payload_iter)
+                break
+        self.end_time = time.perf_counter()
+
+    def stats(self) -> dict:
+        elapsed = (self.end_time or time.perf_counter()) - (self.start_time or time.perf_counter())
+        return {"sent": self.sent,
+                "lost_in_disconnects": self.lost_in_disconnects,
+                "unsent": self.unsent,
+                "disconnects": self.disconnects,
+                "rate_limits": self.rate_limits,
+                "stream_secs": elapsed,
+                "send_rate": self.sent / elapsed if elapsed > 0 else 0.0,
+                "max_lag_secs": self.max_lag_secs}
+
+
+class LoadTestProbe:
+    ''' Records when the source sends each payload and when the pipeline handler
+    finishes with it. Pass record_send as the on_send of the source and wrap the
+    pipeline handler with wrap_handler. With commit_key, the key of every payload
+    (i.e. its tweet id) is also timed until record_commit is called with it,
+    i.e. from the on_commit of the MySQL writer '''
+
+    def __init__(self, commit_key: Callable[[str], object] = None) -> None:
+        # payloads are kept alive until handled, so their id() is not reused
+        self._send_times = {}
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.first_send_time = None
+        self.last_done_time = None
+        self.commit_key = commit_key
+        self._commit_send_times = {}
+        self.commit_latencies = []
+
+    def record_send(self, payload) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self._send_times[id(payload)] = (payload, now)
+            if self.first_send_time is None:
+                self.first_send_time = now
+
+    def wrap_handler(self, handler: Callable[[str], None]) -> Callable[[str], None]:
+        def probed_handler(payload) -> None:
+            with self._lock:
+                _, send_time = self._send_times.pop(id(payload), (None, None))
+            # registered before the handler, whose row may be committed by another thread
+            key = self.commit_key(payload) if self.commit_key is not None else None
+            if key is not None and send_time is not None:
+                with self._lock:
+                    self._commit_send_times[str(key)] = send_time
+            handler(payload)
+            now = time.perf_counter()
+            with self._lock:
+                if send_time is not None:
+                    self.latencies.append(now - send_time)
+                self.last_done_time = now
+        return probed_handler
+
+    def record_commit(self, keys: Iterable) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            for key in keys:
+                send_time = self._commit_send_times.pop(str(key), None)
+                if send_time is not None:
+                    self.commit_latencies.append(now - send_time)
+
+    def stats(self) -> dict:
+        ''' Return the handled count, sustained throughput and latency percentiles '''
+        with self._lock:
+            latencies_ms = np.array(self.latencies) * 1000
+            handled = len(latencies_ms)
+            elapsed = (self.last_done_time - self.first_send_time) if handled else 0.0
+            stats = {"handled": handled,
+                     "not_handled": len(self._send_times),
+                     "throughput": handled / elapsed if elapsed > 0 else 0.0}
+        for percentile in (50, 95, 99):
+            stats[f"latency_p{percentile}_ms"] = \
+                float(np.percentile(latencies_ms, percentile)) if handled else None
+        stats["latency_max_ms"] = float(latencies_ms.max()) if handled else None
+        if self.commit_key is not None:
+            with self._lock:
+                commit_latencies_ms = np.array(self.commit_latencies) * 1000
+            committed = len(commit_latencies_ms)
+            stats["committed"] = committed
+            for percentile in (50, 95, 99):
+                stats[f"commit_latency_p{percentile}_ms"] = \
+                    float(np.percentile(commit_latencies_ms, percentile)) if committed else None
+            stats["commit_latency_max_ms"] = float(commit_latencies_ms.max()) if committed else None
+        return stats
@@ -0,0 +1,119 @@
+"""
+Utility file containing the SyntheticTweetGenerator class that generates tweet
+JSON payloads shaped like the ones TweetStreamListener.on_data receives, for
+benchmarks and load tests without the Twitter API
+"""
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+# used when no vocabulary csv is given, sentiment words included
+DEFAULT_VOCABULARY = (
+    "the a to of and in is for on that it with this be are at by from was have we not "
+    "people new virus coronavirus corona covid19 outbreak case cases china wuhan hubei "
+    "health world news government patient hospital test testing spread first death "
+    "deaths today week day city country school work home travel stock market price "
+    "good great best happy love safe better strong hope positive thank amazing nice "
+    "bad worst sad fear scary terrible dangerous negative sick crisis panic awful "
+    "really very so more most still just now only also even never no"
+).split()
+
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+
+def vocabulary_from_csv(csv_path: str, text_column: str = "tweet", max_words: int = 20000) -> List[str]:
+    ''' Return the max_words most frequent lowercase words of a text column of a csv file '''
+    texts = pd.read_csv(csv_path)[text_column].dropna().str.lower()
+    word_counts = texts.str.findall(r"[a-z][a-z0-9']+").explode().value_counts()
+    return word_counts.index[:max_words].tolist()
+
+
+class SyntheticTweetGenerator:
+    ''' Generates tweets whose words are drawn from vocabulary with Zipf
+    distributed ranks of exponent zipf_a, like natural text. A share of the
+    tweets mention a user, carry a URL or are retweets of one of the last
+    original tweets, so cleaning and deduplication see realistic input.
+    Tweets are created tweets_per_sec apart starting at start_time '''
+
+    def __init__(self,
+                 vocabulary: List[str] = None,
+                 zipf_a: float = 1.2,
+                 min_words: int = 5,
+                 max_words: int = 25,
+                 retweet_share: float = 0.3,
+                 mention_share: float = 0.3,
+                 url_share: float = 0.4,
+                 n_users: int = 5000,
+                 tweets_per_sec: float = 50.0,
+                 start_time: datetime = None,
+                 seed: int = 0) -> None:
+        self.vocabulary = list(vocabulary) if vocabulary else list(DEFAULT_VOCABULARY)
+        self.zipf_a = zipf_a
+        self.min_words = min_words
+        self.max_words = max_words
+        self.retweet_share = retweet_share
+        self.mention_share = mention_share
+        self.url_share = url_share
+        self.n_users = n_users
+        self.tweets_per_sec = tweets_per_sec
+        self.start_time = start_time or datetime(2020, 3, 10, 17, 0, tzinfo=timezone.utc)
+
+        self._random = random.Random(seed)
+        self._np_random = np.random.default_rng(seed)
+        self._next_id = 1238000000000000000
+        self._originals = []
+
+    def _text(self) -> str:
+        n_words = self._random.randint(self.min_words, self.max_words)
+        ranks = self._np_random.zipf(self.zipf_a, n_words)
+        words = [self.vocabulary[(rank - 1) % len(self.vocabulary)] for rank in ranks]
+        if self._random.random() < self.mention_share:
+            words.insert(0, f"@user{self._random.randrange(self.n_users)}")
+        if self._random.random() < self.url_share:
+            words.append(f"https://t.co/{self._random.getrandbits(40):x}")
+        return " ".join(words)
+
+    def _user(self) -> dict:
+        user_id = self._random.randrange(self.n_users)
+        return {"id": user_id,
+                "screen_name": f"user{user_id}",
+                "location": None if user_id % 3 == 0 else f"city{user_id % 50}",
+                "followers_count": self._random.randint(0, 100000),
+                "friends_count": self._random.randint(0, 5000)}
+
+    def tweet(self, index: int) -> dict:
+        ''' Return the index-th tweet as a decoded Twitter API v1.1 tweet '''
+        self._next_id += 1
+        created_at = self.start_time + timedelta(seconds=index / self.tweets_per_sec)
+        tweet = {"created_at": created_at.strftime(TWITTER_TIME_FORMAT),
+                 "id": self._next_id,
+                 "id_str": str(self._next_id),
+                 "timestamp_ms": str(int(created_at.timestamp() * 1000)),
+                 "user": self._user(),
+                 "place": None,
+                 "lang": "en",
+                 "reply_count": 0,
+                 "retweet_count": 0,
+                 "favorite_count": 0}
+
+        if self._originals and self._random.random() < self.retweet_share:
+            original = self._random.choice(self._originals)
+            original["retweet_count"] += 1
+            tweet["text"] = f"RT @{original['user']['screen_name']}: {original['text']}"[:140]
+            tweet["retweeted_status"] = dict(original)
+        else:
+            tweet["text"] = self._text()
+            self._originals.append(tweet)
+            # retweets pick from the latest originals
+            if len(self._originals) > 1000:
+                self._originals.pop(0)
+        return tweet
+
+    def payloads(self, n_tweets: int) -> Iterator[str]:
+        ''' Yield n_tweets JSON payloads '''
+        for index in range(n_tweets):
+            yield json.dumps(self.tweet(index))
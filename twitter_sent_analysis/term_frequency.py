@@ -0,0 +1,187 @@
+"""
+Utility file containing mergeable term-frequency aggregates for word clouds:
+exact counts, a count-min sketch with a top-K heavy hitter list for very large
+vocabularies, and a TermFrequencyStore keeping them per time window and keyword
+"""
+import os
+import pickle
+import hashlib
+import heapq
+from collections import Counter
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# pandas offset aliases of the supported time windows
+TIME_WINDOWS = {"minute": "min", "hour": "h", "day": "D"}
+# default count-min sketch width per time window, growing with the words a window
+# holds. Every (window, keyword) bucket has its own sketch of 4 x width int64 counts,
+# i.e. 32 KB per minute, 256 KB per hour, 2 MB per day and 8 MB without windows
+SKETCH_WIDTHS = {"minute": 2 ** 10, "hour": 2 ** 13, "day": 2 ** 16, None: 2 ** 18}
+
+
+def count_words(clean_texts: Iterable[str]) -> Counter:
+    ''' Return the word counts of space separated clean texts '''
+    word_counts = Counter()
+    for clean_text in clean_texts:
+        word_counts.update(clean_text.split())
+    return word_counts
+
+
+class ExactTermCounts:
+    ''' Exact word counts '''
+
+    def __init__(self) -> None:
+        self.counts = Counter()
+
+    def update(self, word_counts: Counter) -> None:
+        self.counts.update(word_counts)
+
+    def merge(self, other: 'ExactTermCounts') -> None:
+        self.counts.update(other.counts)
+
+    def frequencies(self) -> dict:
+        return dict(self.counts)
+
+
+class CountMinTopK:
+    ''' Approximate word counts in a depth x width count-min sketch that keeps
+    the top_k most frequent words and their estimated counts. Memory does not
+    grow with the vocabulary and estimates never undercount. Estimates overcount
+    by the counts of the words sharing a column, so width should be about the
+    number of distinct words counted '''
+
+    def __init__(self, top_k: int = 2000, width: int = 2 ** 12, depth: int = 4) -> None:
+        self.top_k = top_k
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.top = {}
+
+    def _columns(self, words: List[str]) -> np.ndarray:
+        # stable across processes unlike hash(), so saved sketches stay valid
+        digests = b"".join(hashlib.blake2b(word.encode("utf8"), digest_size=4 * self.depth).digest()
+                           for word in words)
+        return (np.frombuffer(digests, dtype=np.uint32)
+                .reshape(len(words), self.depth).T % self.width)
+
+    def estimate(self, words: List[str]) -> np.ndarray:
+        ''' Return the estimated count of every word '''
+        if not words:
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(words)
+        return np.min(self.table[np.arange(self.depth)[:, None], columns], axis=0)
+
+    def _refresh_top(self, words: Iterable[str]) -> None:
+        candidates = list(set(self.top).union(words))
+        estimates = self.estimate(candidates)
+        top = heapq.nlargest(self.top_k, zip(estimates.tolist(), candidates))
+        self.top = {word: count for count, word in top}
+
+    def update(self, word_counts: Counter) -> None:
+        if not word_counts:
+            return
+        words = list(word_counts)
+        counts = np.fromiter(word_counts.values(), dtype=np.int64, count=len(words))
+        columns = self._columns(words)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+        self._refresh_top(words)
+
+    def merge(self, other: 'CountMinTopK') -> None:
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Only sketches of the same width and depth can be merged")
+        self.table += other.table
+        self._refresh_top(other.top)
+
+    def frequencies(self) -> dict:
+        return dict(self.top)
+
+
+class TermFrequencyStore:
+    ''' Word counts of clean tweets kept per (time window, keyword) bucket so that
+    word clouds for any time range or keyword are built from the counts instead of
+    the texts. Bucket (window start, None) counts all tweets of a window and
+    (window start, keyword) only those whose raw text contains the keyword.
+    With window None all tweets share one window. With top_k each bucket is a
+    CountMinTopK sketch instead of exact counts, sketch_width wide or as wide as
+    SKETCH_WIDTHS[window] by default '''
+
+    def __init__(self, window: str = None, top_k: int = None, sketch_width: int = None) -> None:
+        if window is not None and window not in TIME_WINDOWS:
+            raise ValueError(f"window must be one of {tuple(TIME_WINDOWS)}, got {window}")
+        self.window = window
+        self.top_k = top_k
+        self.sketch_width = sketch_width or SKETCH_WIDTHS[window]
+        self.buckets = {}
+
+    def _bucket(self, window_start: str, keyword: str):
+        key = (window_start, keyword)
+        if key not in self.buckets:
+            self.buckets[key] = CountMinTopK(self.top_k, width=self.sketch_width) \
+                if self.top_k else ExactTermCounts()
+        return self.buckets[key]
+
+    def _window_starts(self, created_at: pd.Series, n_rows: int) -> pd.Series:
+        if self.window is None or created_at is None:
+            return pd.Series([None] * n_rows, dtype=object)
+        created_at = pd.to_datetime(pd.Series(created_at).reset_index(drop=True),
+                                    errors='coerce', utc=True)
+        return created_at.dt.floor(TIME_WINDOWS[self.window]).dt.strftime("%Y-%m-%d %H:%M")
+
+    def update(self,
+               clean_texts: pd.Series,
+               created_at: pd.Series = None,
+               raw_texts: pd.Series = None,
+               keywords: List[str] = None) -> None:
+        ''' Add the words of one chunk of clean texts '''
+        clean_texts = pd.Series(clean_texts).reset_index(drop=True)
+        window_starts = self._window_starts(created_at, len(clean_texts))
+        keyword_masks = {}
+        if keywords and raw_texts is not None:
+            raw_texts = pd.Series(raw_texts).reset_index(drop=True).fillna('').str.lower()
+            keyword_masks = {keyword: raw_texts.str.contains(keyword.lower(), regex=False)
+                             for keyword in keywords}
+
+        for window_start, window_texts in clean_texts.groupby(window_starts.fillna(''),
+                                                              sort=False):
+            window_start = window_start or None
+            self._bucket(window_start, None).update(count_words(window_texts))
+            for keyword, keyword_mask in keyword_masks.items():
+                keyword_texts = window_texts[keyword_mask[window_texts.index]]
+                if len(keyword_texts):
+                    self._bucket(window_start, keyword).update(count_words(keyword_texts))
+
+    def merge(self, other: 'TermFrequencyStore') -> None:
+        ''' Add the counts of another store, i.e. one built by another process '''
+        for (window_start, keyword), counts in other.buckets.items():
+            self._bucket(window_start, keyword).merge(counts)
+
+    def frequencies(self, since: str = None, until: str = None, keyword: str = None) -> dict:
+        ''' Return the word counts of the windows starting in [since, until)
+            for all tweets or for the tweets containing keyword '''
+        frequencies = Counter()
+        for (window_start, bucket_keyword), counts in self.buckets.items():
+            if bucket_keyword != keyword:
+                continue
+            if window_start is not None:
+                if since is not None and window_start < since:
+                    continue
+                if until is not None and window_start >= until:
+                    continue
+            frequencies.update(counts.frequencies())
+        if self.top_k:
+            frequencies = Counter(dict(frequencies.most_common(self.top_k)))
+        return dict(frequencies)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "wb") as store_file:
+            pickle.dump(self, store_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path: str) -> 'TermFrequencyStore':
+        with open(path, "rb") as store_file:
+            return pickle.load(store_file)
@@ -0,0 +1,98 @@
+"""
+Tests of the sink fan-out of async_ingest.py. Run from twitter_sent_analysis with
+python -m unittest test_async_ingest
+"""
+import asyncio
+import threading
+import unittest
+
+from async_ingest import AsyncSink
+from async_ingest import AsyncIngestRuntime
+from synthetic_tweets import SyntheticTweetGenerator
+
+
+class ListSource:
+    ''' Emits a list of payloads as fast as the runtime accepts them '''
+
+    def __init__(self, payloads) -> None:
+        self.payloads = payloads
+
+    async def produce(self, emit) -> None:
+        for payload in self.payloads:
+            await emit(payload)
+
+
+class CountingSink(AsyncSink):
+    ''' Counts the records it handles, after waiting for release if given '''
+
+    def __init__(self, name: str, release: threading.Event = None, **kwargs) -> None:
+        self.name = name
+        super().__init__(**kwargs)
+        self.release = release
+        self.records = 0
+
+    def handle_batch(self, records) -> None:
+        if self.release is not None:
+            self.release.wait()
+        self.records += len(records)
+
+
+class TestSinkFanOut(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.payloads = list(SyntheticTweetGenerator(seed=0).payloads(2000))
+
+    def run_with_stalled_sink(self, stalled_policy: str, max_backlog: int = 100, wait_secs: float = 10.0):
+        ''' Runs the payloads in batches of 50 through a sink that stalls until
+            the two other sinks handled every payload or wait_secs passed.
+            Returns the sinks and whether the others were done before the release '''
+        release = threading.Event()
+        stalled = CountingSink("stalled", release, max_batches=2, policy=stalled_policy,
+                               max_backlog=max_backlog)
+        blocking = CountingSink("blocking", max_batches=2, policy="block")
+        dropping = CountingSink("dropping", max_batches=100, policy="drop")
+        runtime = AsyncIngestRuntime(ListSource(self.payloads), [stalled, blocking, dropping],
+                                     batch_size=50, batch_secs=0.5, max_queue=100)
+
+        async def run():
+            run_task = asyncio.ensure_future(runtime.run())
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + wait_secs
+            while loop.time() < deadline and \
+                    (blocking.records, dropping.records) != (len(self.payloads), len(self.payloads)):
+                await asyncio.sleep(0.01)
+            others_done = (blocking.records, dropping.records) == (len(self.payloads), len(self.payloads))
+            stalled_records = stalled.records
+            release.set()
+            await run_task
+            return others_done, stalled_records
+
+        others_done, stalled_records = asyncio.run(run())
+        return stalled, blocking, dropping, others_done, stalled_records
+
+    def test_stalled_block_sink_does_not_delay_the_others(self):
+        stalled, blocking, dropping, others_done, stalled_records = self.run_with_stalled_sink("block")
+        self.assertTrue(others_done)
+        self.assertEqual(stalled_records, 0)
+        # the stalled sink gets every batch once it is released
+        self.assertEqual(stalled.records, len(self.payloads))
+        self.assertEqual(stalled.dropped, 0)
+        self.assertEqual((blocking.dropped, dropping.dropped), (0, 0))
+
+    def test_stalled_drop_sink_does_not_delay_the_others(self):
+        stalled, _, _, others_done, stalled_records = self.run_with_stalled_sink("drop")
+        self.assertTrue(others_done)
+        self.assertEqual(stalled_records, 0)
+        self.assertEqual(stalled.records + stalled.dropped, len(self.payloads))
+        self.assertGreater(stalled.dropped, 0)
+
+    def test_full_backlog_holds_up_the_source(self):
+        # 40 batches do not fit in the queue of 2 and the backlog of 5 batches
+        stalled, blocking, _, others_done, _ = self.run_with_stalled_sink("block", max_backlog=5, wait_secs=1.0)
+        self.assertFalse(others_done)
+        self.assertEqual(stalled.records, len(self.payloads))
+        self.assertEqual(blocking.records, len(self.payloads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Utility file containing the TextNormalizer class that cleans text in a single
+precompiled, token-aware regex pass. Shared by the Twitter and the Rotten
+Tomatoes pipelines
+"""
+import re
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from lemma_cache import LemmaCache
+from pipeline_metrics import METRICS
+
+URL_PATTERN = r"https?://\S+|www\.\S+"
+MENTION_PATTERN = r"@\w+"
+HTML_ENTITY_PATTERN = r"&[a-z]+;|&#\d+;"
+# matched after case folding
+RETWEET_MARKER_PATTERN = r"\brt\b"
+
+
+class TextNormalizer:
+    ''' Extracts word tokens from text in one regex pass that skips URLs, @mentions,
+    HTML entities and standalone retweet markers as whole tokens, so that letters
+    such as "co" or "rt" inside words are kept. The words are case folded, stopwords
+    and words shorter than min_token_len are dropped and the rest are lemmatized
+    through a LemmaCache '''
+
+    def __init__(self,
+                 stopwords_set: Iterable[str],
+                 lemma_cache: 'LemmaCache' = None,
+                 strip_urls: bool = True,
+                 strip_mentions: bool = True,
+                 strip_retweet_marker: bool = True,
+                 keep_digits: bool = False,
+                 min_token_len: int = 2) -> None:
+        self.stopwords_set = frozenset(stopwords_set)
+        self.lemma_cache = lemma_cache if lemma_cache is not None else LemmaCache()
+        self.min_token_len = min_token_len
+
+        skipped_patterns = [HTML_ENTITY_PATTERN]
+        if strip_urls:
+            skipped_patterns.append(URL_PATTERN)
+        if strip_mentions:
+            skipped_patterns.append(MENTION_PATTERN)
+        if strip_retweet_marker:
+            skipped_patterns.append(RETWEET_MARKER_PATTERN)
+        word_pattern = r"([a-z0-9]+)" if keep_digits else r"([a-z]+)"
+        # skipped tokens match an alternative without a group and come back as ''
+        self.token_re = re.compile("|".join(skipped_patterns + [word_pattern]))
+
+    def normalize(self, text: str) -> str:
+        ''' Return the clean space separated lemmas of text '''
+        stopwords_set = self.stopwords_set
+        min_token_len = self.min_token_len
+        lemmatize = self.lemma_cache.lemmatize
+        # case folding the whole text once is cheaper than per token
+        return ' '.join([lemmatize(word) for word in self.token_re.findall(text.lower())
+                         if word and word not in stopwords_set and len(word) >= min_token_len])
+
+    def normalize_column(self, texts: pd.Series) -> pd.Series:
+        ''' Normalize a column of texts. Identical texts are normalized once
+            and the result is copied to all of their rows '''
+        # codes maps every row to its text in unique_texts
+        codes, unique_texts = pd.factorize(texts.fillna(''))
+        with METRICS.stage("preprocess", len(texts)):
+            clean_texts = np.array([self.normalize(text) for text in unique_texts], dtype=object)
+        return pd.Series(clean_texts[codes], index=texts.index, dtype=object)
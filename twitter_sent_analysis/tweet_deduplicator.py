@@ -0,0 +1,160 @@
+"""
+Utility file containing the TweetDeduplicator class that drops tweets already
+seen at ingest time, with a bounded in-memory seen-set and an optional Bloom
+filter kept in a file so that it survives restarts
+"""
+import os
+import math
+import hashlib
+import threading
+from time import time
+from contextlib import nullcontext
+from collections import OrderedDict
+
+import numpy as np
+
+# int64 active generation, keys in it and its start time in epoch seconds
+BLOOM_HEADER_BYTES = 64
+
+
+class BloomFilter:
+    ''' Bloom filter over bit arrays memory mapped from path, so processes that
+    open the same file share it. Keys are added to the newer of two generations,
+    each sized for capacity keys at error_rate false positives, and looked up in
+    both. Once the newer generation holds capacity keys or is older than
+    window_secs the older one is cleared and takes its place, so the false
+    positive rate stays bounded and a key is remembered for one to two
+    generations. Callers serialize add across threads and processes '''
+
+    def __init__(self, path: str, capacity: int = 10000000, error_rate: float = 0.001,
+                 window_secs: float = None) -> None:
+        self.path = path
+        self.capacity = capacity
+        self.window_secs = window_secs
+        self.n_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        n_bytes = (self.n_bits + 7) // 8
+        file_bytes = BLOOM_HEADER_BYTES + 2 * n_bytes
+
+        if os.path.isfile(path):
+            if os.path.getsize(path) != file_bytes:
+                raise ValueError(f"{path} was created with another capacity or error rate")
+            mapped = np.memmap(path, dtype=np.uint8, mode="r+", shape=(file_bytes,))
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            mapped = np.memmap(path, dtype=np.uint8, mode="w+", shape=(file_bytes,))
+            mapped[:BLOOM_HEADER_BYTES].view(np.int64)[2] = int(time())
+        self._mapped = mapped
+        self._header = mapped[:BLOOM_HEADER_BYTES].view(np.int64)
+        self._bits = mapped[BLOOM_HEADER_BYTES:].reshape(2, n_bytes)
+        self.rotations = 0
+
+    def _bit_indices(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode("utf8"), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little")
+        # double hashing: h1 + i * h2
+        return np.array([(first_hash + i * second_hash) % self.n_bits
+                         for i in range(self.n_hashes)], dtype=np.int64)
+
+    def _rotate(self) -> None:
+        older = 1 - int(self._header[0])
+        self._bits[older] = 0
+        self._header[:3] = (older, 0, int(time()))
+        self.rotations += 1
+
+    def add(self, key: str) -> None:
+        if self._header[1] >= self.capacity or \
+                (self.window_secs and time() - self._header[2] >= self.window_secs):
+            self._rotate()
+        bit_indices = self._bit_indices(key)
+        np.bitwise_or.at(self._bits[int(self._header[0])], bit_indices >> 3,
+                         (1 << (bit_indices & 7)).astype(np.uint8))
+        self._header[1] += 1
+
+    def __contains__(self, key: str) -> bool:
+        bit_indices = self._bit_indices(key)
+        masks = (1 << (bit_indices & 7)).astype(np.uint8)
+        return any(bool(np.all(generation[bit_indices >> 3] & masks)) for generation in self._bits)
+
+    def flush(self) -> None:
+        self._mapped.flush()
+
+
+class TweetDeduplicator:
+    ''' Remembers the ids of the last max_seen tweets in an LRU seen-set. If
+    bloom_path is given every id is also added to a BloomFilter in that file,
+    which remembers ids evicted from the seen-set and ids of earlier runs at the
+    cost of rare false positives, for one to two generations of bloom_capacity
+    ids or bloom_window_secs. Safe to call from several pipeline workers.
+    Processes that open the same Bloom filter file and pass the same
+    multiprocessing bloom_lock drop the tweets already seen by each other '''
+
+    def __init__(self,
+                 max_seen: int = 1000000,
+                 bloom_path: str = None,
+                 bloom_capacity: int = 10000000,
+                 bloom_error_rate: float = 0.001,
+                 bloom_lock=None,
+                 bloom_window_secs: float = None) -> None:
+        self.max_seen = max_seen
+        self.bloom_filter = BloomFilter(bloom_path, bloom_capacity, bloom_error_rate,
+                                        window_secs=bloom_window_secs) \
+            if bloom_path is not None else None
+        self._bloom_lock = bloom_lock if bloom_lock is not None else nullcontext()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.checked = 0
+        self.seen_set_hits = 0
+        self.bloom_hits = 0
+
+    def is_duplicate(self, tweet_id, remember_shared: bool = True) -> bool:
+        ''' Return True if tweet_id was seen before, else remember it and return False.
+            With remember_shared False it is only added to the seen-set, and
+            mark_saved adds it to the Bloom filter once the tweet is saved, so
+            that other processes do not drop a tweet this one never saved '''
+        tweet_id = str(tweet_id)
+        with self._lock:
+            self.checked += 1
+            if tweet_id in self._seen:
+                self.seen_set_hits += 1
+                self._seen.move_to_end(tweet_id)
+                return True
+
+            self._seen[tweet_id] = None
+            if len(self._seen) > self.max_seen:
+                # evict the least recently seen id
+                self._seen.popitem(last=False)
+            if self.bloom_filter is not None:
+                with self._bloom_lock:
+                    if tweet_id in self.bloom_filter:
+                        self.bloom_hits += 1
+                        return True
+                    if remember_shared:
+                        self.bloom_filter.add(tweet_id)
+            return False
+
+    def mark_saved(self, tweet_ids) -> None:
+        ''' Add the ids of saved tweets checked with remember_shared False to the Bloom filter '''
+        if self.bloom_filter is None:
+            return
+        with self._lock, self._bloom_lock:
+            for tweet_id in tweet_ids:
+                self.bloom_filter.add(str(tweet_id))
+
+    def stats(self) -> dict:
+        return {"checked": self.checked,
+                "duplicates": self.seen_set_hits + self.bloom_hits,
+                "seen_set_hits": self.seen_set_hits,
+                "bloom_hits": self.bloom_hits,
+                "seen_set_size": len(self._seen)}
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(f"Deduplicator: {stats['checked']} ids checked, {stats['duplicates']} duplicates "
+              + f"({stats['seen_set_hits']} in the seen-set, {stats['bloom_hits']} in the Bloom filter)")
+
+    def close(self) -> None:
+        if self.bloom_filter is not None:
+            self.bloom_filter.flush()
@@ -0,0 +1,95 @@
+"""
+Utility file containing the extraction of MySQL rows from raw tweet payloads.
+Payloads are decoded with orjson when it is installed and with json otherwise,
+stream messages that are not tweets are skipped before decoding and created_at
+is parsed from Twitter's fixed format without dateutil. Tweets are decoded in
+full, a retweet repeats id, text and user in its retweeted_status so the fields
+cannot be picked out of the raw payload safely, and orjson decodes the whole
+payload faster than a partial scan written in Python
+"""
+import re
+import json
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple, Union
+
+from pipeline_metrics import METRICS
+from pipeline_metrics import DEBUG_LOG
+
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+    loads = orjson.loads
+except ImportError:
+    JSON_BACKEND = "json"
+    loads = json.loads
+
+# i.e. Wed Oct 10 20:19:24 +0000 2018
+CREATED_AT_RE = re.compile(
+    r"[A-Z][a-z]{2} ([A-Z][a-z]{2}) (\d{2}) (\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2}) (\d{4})")
+MONTHS = {month: index for index, month in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+# limit notices, deletions and other stream messages have no created_at
+TWEET_MARKER = '"created_at"'
+TWEET_MARKER_BYTES = b'"created_at"'
+
+
+@lru_cache(maxsize=8)
+def _timezone(sign: str, hours: str, minutes: str) -> timezone:
+    offset = timedelta(hours=int(hours), minutes=int(minutes))
+    if not offset:
+        return timezone.utc
+    return timezone(-offset if sign == "-" else offset)
+
+
+# the tweets of one second share their created_at
+@lru_cache(maxsize=4096)
+def parse_created_at(created_at: str) -> datetime:
+    ''' Parse a created_at of the Twitter API into an aware datetime.
+        Other formats are left to dateutil '''
+    match = CREATED_AT_RE.fullmatch(created_at)
+    if match is None or match.group(1) not in MONTHS:
+        from dateutil import parser
+        return parser.parse(created_at)
+    month, day, hour, minute, second, sign, tz_hours, tz_minutes, year = match.groups()
+    return datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second),
+                    tzinfo=_timezone(sign, tz_hours, tz_minutes))
+
+
+def extract_tweet_row(data: Union[str, bytes]) -> Optional[Tuple]:
+    ''' Decode a raw payload and extract a row ordered as TWEET_COLUMNS.
+        Returns None for payloads that are not tweets '''
+    if (TWEET_MARKER_BYTES if isinstance(data, bytes) else TWEET_MARKER) not in data:
+        METRICS.increment("tweets_unparsed_total")
+        return None
+    try:
+        json_data = loads(data)
+    except ValueError as e:
+        METRICS.increment("tweets_unparsed_total")
+        DEBUG_LOG.log("Error: %r", e)
+        return None
+    return tweet_row_from_json(json_data)
+
+
+def tweet_row_from_json(json_data: dict) -> Optional[Tuple]:
+    ''' Extract a row ordered as TWEET_COLUMNS from a decoded tweet.
+        Returns None for payloads that are not tweets '''
+    try:
+        tweet_id = json_data['id']
+        tweet = json_data['text']
+        created_at = parse_created_at(json_data['created_at'])
+        user = json_data['user']
+        user_name = user['screen_name']
+        user_friends_count = user['friends_count']
+        user_followers_count = user['followers_count']
+    except (KeyError, TypeError, ValueError) as e:
+        METRICS.increment("tweets_unparsed_total")
+        DEBUG_LOG.log("Error: %r", e)
+        return None
+
+    # optional fields, missing ones get their default
+    place = json_data.get('place')
+    tweet_place = place.get('country', 'NULL') if place is not None else 'NULL'
+    return (tweet_id, tweet, created_at, tweet_place, json_data.get('favorite_count', 0),
+            json_data.get('retweet_count', 0), json_data.get('reply_count', 0), user_name,
+            user.get('location', 'NULL'), user_followers_count, user_friends_count)
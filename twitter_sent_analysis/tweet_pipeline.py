@@ -0,0 +1,115 @@
+"""
+Utility file containing the TweetPipeline class that decouples stream reception
+from parsing and persistence with a bounded queue and background worker threads
+"""
+import queue
+import threading
+from typing import Callable
+from pipeline_metrics import METRICS
+from twitter_config_loader import print_error
+
+QUEUE_POLICIES = ("block", "drop")
+
+# put on the queue once per worker to stop it after the queued payloads are handled
+_STOP = object()
+
+
+class TweetPipeline:
+    ''' Producer/consumer pipeline where the stream listener only puts raw payloads
+    on a bounded queue and a pool of worker threads passes them to handler.
+    When the queue is full the "block" policy makes the listener wait up to
+    put_timeout seconds (forever if None) and the "drop" policy discards the payload '''
+
+    def __init__(self,
+                 handler: Callable[[str], None],
+                 n_workers: int = 2,
+                 max_queue_size: int = 10000,
+                 policy: str = "block",
+                 put_timeout: float = None) -> None:
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"policy must be one of {QUEUE_POLICIES}, got {policy}")
+        self.handler = handler
+        self.n_workers = n_workers
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        METRICS.register_gauge("pipeline_queue_depth", self.queue.qsize)
+
+        self._workers = [threading.Thread(target=self._work,
+                                          name=f"tweet_pipeline_worker_{i}",
+                                          daemon=True)
+                         for i in range(n_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, data) -> bool:
+        ''' Queue one raw payload. Returns False if it was dropped '''
+        try:
+            if self.policy == "block":
+                self.queue.put(data, timeout=self.put_timeout)
+            else:
+                self.queue.put_nowait(data)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            METRICS.increment("pipeline_dropped_total")
+            return False
+
+        with self._stats_lock:
+            self.enqueued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    def _work(self) -> None:
+        while True:
+            data = self.queue.get()
+            if data is _STOP:
+                break
+            try:
+                # per record latency of parsing and saving a tweet
+                with METRICS.stage("pipeline_handler"):
+                    self.handler(data)
+                with self._stats_lock:
+                    self.processed += 1
+            except Exception:
+                print_error()
+                with self._stats_lock:
+                    self.failed += 1
+                METRICS.increment("pipeline_failed_total")
+
+    def stats(self) -> dict:
+        ''' Return queue depth and message counters '''
+        with self._stats_lock:
+            return {"queue_depth": self.queue.qsize(),
+                    "max_queue_depth": self.max_queue_depth,
+                    "enqueued": self.enqueued,
+                    "processed": self.processed,
+                    "failed": self.failed,
+                    "dropped": self.dropped}
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(f"Pipeline queued {stats['enqueued']} tweets, processed {stats['processed']}, "
+              + f"failed {stats['failed']}, dropped {stats['dropped']}, "
+              + f"queue depth {stats['queue_depth']} (max {stats['max_queue_depth']})")
+
+    def close(self) -> None:
+        ''' Handle all queued payloads, then stop the workers '''
+        for _ in self._workers:
+            self.queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self.print_stats()
+
+    def __enter__(self) -> 'TweetPipeline':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,326 @@
+"""
+Utility file containing the TweetSpool class, an append-only write-ahead log of
+parsed tweet rows kept in segment files, and the SpooledTweetWriter class that
+logs every tweet in the spool before it is acknowledged and replays the spool
+into MySQL in batches from a drainer thread, so that tweets outlive MySQL outages
+"""
+import os
+import glob
+import json
+import zlib
+import struct
+import pickle
+import threading
+from time import time
+from typing import TYPE_CHECKING, Callable, List, Tuple
+
+from mysql.connector import Error
+from mysql.connector import IntegrityError
+from pipeline_metrics import METRICS
+from twitter_config_loader import print_error
+
+if TYPE_CHECKING:
+    from mysql_tweet_writer import MySQLTweetWriter
+
+# record kind, payload length and crc32 of the pickled payload
+FRAME_HEADER = struct.Struct("<cII")
+ROW_RECORD = b"R"
+RETWEET_RECORD = b"T"
+SEGMENT_SUFFIX = ".spool"
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def read_records(segment_path: str, offset: int, max_records: int) -> Tuple[List[Tuple[bytes, object]], int, bool]:
+    ''' Read up to max_records complete records of a segment from offset on.
+        Returns the records, the offset after them and whether a record with a
+        bad checksum was found, which ends the readable part of the segment '''
+    records = []
+    with open(segment_path, "rb") as segment_file:
+        segment_file.seek(offset)
+        while len(records) < max_records:
+            header = segment_file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            kind, length, crc = FRAME_HEADER.unpack(header)
+            payload = segment_file.read(length)
+            # a frame still being written, or cut off by a crash
+            if len(payload) < length:
+                break
+            if zlib.crc32(payload) != crc:
+                return records, offset, True
+            records.append((kind, pickle.loads(payload)))
+            offset += FRAME_HEADER.size + length
+    return records, offset, False
+
+
+class TweetSpool:
+    ''' Appends pickled records framed with their length and checksum to
+    numbered segment files in directory. Every record is written through to
+    the OS before append returns, so it survives a crash of the process, and
+    the segment is fsynced at most every fsync_secs seconds and on rotation.
+    A new segment is started when the segment reaches max_segment_bytes or is
+    older than max_segment_secs, and on every start '''
+
+    def __init__(self,
+                 directory: str = "spool",
+                 max_segment_bytes: int = 64 * 1024 * 1024,
+                 max_segment_secs: float = 60.0,
+                 fsync_secs: float = 1.0) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_secs = max_segment_secs
+        self.fsync_secs = fsync_secs
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        segment_indices = self.segment_indices()
+        self.segment_index = segment_indices[-1] + 1 if segment_indices else 0
+        self.records_appended = 0
+        self.closed = False
+        self._file = None
+        self._open_segment()
+
+    def segment_path(self, segment_index: int) -> str:
+        return os.path.join(self.directory, f"{segment_index:010d}{SEGMENT_SUFFIX}")
+
+    def segment_indices(self) -> List[int]:
+        return sorted(int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+                      for path in glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX)))
+
+    def is_segment_closed(self, segment_index: int) -> bool:
+        ''' Segments before the one being appended to get no more records '''
+        return self.closed or segment_index < self.segment_index
+
+    def _open_segment(self) -> None:
+        self._file = open(self.segment_path(self.segment_index), "ab")
+        self.segment_start = time()
+        self.segment_bytes = 0
+        self._last_fsync = self.segment_start
+
+    def _close_segment(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def append(self, kind: bytes, record) -> None:
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        frame = FRAME_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            now = time()
+            if self.segment_bytes >= self.max_segment_bytes or \
+                    (self.segment_bytes and now - self.segment_start >= self.max_segment_secs):
+                self._close_segment()
+                self.segment_index += 1
+                self._open_segment()
+            self._file.write(frame)
+            self._file.flush()
+            self.segment_bytes += len(frame)
+            self.records_appended += 1
+            if now - self._last_fsync >= self.fsync_secs:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+        METRICS.increment("spool_records_total")
+
+    def backlog_bytes(self, segment_index: int, offset: int) -> int:
+        ''' Bytes of the segments from (segment_index, offset) on '''
+        return sum(os.path.getsize(self.segment_path(index)) for index in self.segment_indices()
+                   if index >= segment_index) - offset
+
+    def close(self) -> None:
+        with self._lock:
+            if not self.closed:
+                self._close_segment()
+                self.closed = True
+
+
+class SpooledTweetWriter:
+    ''' Stands in for MySQLTweetWriter. add and add_retweet only append to the
+    spool, and a drainer thread replays the spool into the MySQLTweetWriter made
+    by writer_factory in transactions of batch_size records. Its position is saved
+    in the same transaction as the records, so a crash after a commit does not
+    insert them or add their retweet counts again, and in a checkpoint file.
+    Segments are deleted once all their records are committed. While MySQL is unreachable the drainer retries after 1, 2, 4 ...
+    seconds up to max_backoff and the tweets wait in the spool, which is replayed
+    first on the next start if it could not be drained on close '''
+
+    def __init__(self,
+                 spool: 'TweetSpool',
+                 writer_factory: Callable[[], 'MySQLTweetWriter'],
+                 batch_size: int = 500,
+                 poll_secs: float = 0.5,
+                 max_backoff: float = 30.0) -> None:
+        self.spool = spool
+        self.writer_factory = writer_factory
+        self.batch_size = batch_size
+        self.poll_secs = poll_secs
+        self.max_backoff = max_backoff
+        self.checkpoint_path = os.path.join(spool.directory, CHECKPOINT_FILE)
+        # key of the position saved with the records in MySQL
+        self.spool_id = os.path.abspath(spool.directory)
+        self.segment_index, self.offset = self._load_checkpoint()
+        self.tweet_writer = None
+
+        self.records_drained = 0
+        self.duplicates_skipped = 0
+        self.corrupt_segments = 0
+        self.outages = 0
+        self.backlog = self.spool.backlog_bytes(self.segment_index, self.offset)
+        METRICS.register_gauge("spool_backlog_bytes", lambda: self.backlog)
+
+        self._closed = threading.Event()
+        self._abort = threading.Event()
+        self._drainer = threading.Thread(target=self._drain, name="spool_drainer", daemon=True)
+        self._drainer.start()
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        segment_indices = self.spool.segment_indices()
+        position = (segment_indices[0], 0)
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if checkpoint["segment"] in segment_indices:
+                position = (checkpoint["segment"], checkpoint["offset"])
+        # segments before the checkpoint were committed before a crash
+        for segment_index in segment_indices:
+            if segment_index < position[0]:
+                os.remove(self.spool.segment_path(segment_index))
+        return position
+
+    def _save_checkpoint(self) -> None:
+        with open(self.checkpoint_path + ".tmp", "w") as checkpoint_file:
+            json.dump({"segment": self.segment_index, "offset": self.offset}, checkpoint_file)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def add(self, row: Tuple) -> None:
+        ''' Log one tweet row ordered as TWEET_COLUMNS '''
+        self.spool.append(ROW_RECORD, row)
+
+    def add_retweet(self, tweet_id) -> None:
+        ''' Log one retweet of a tweet already stored or logged '''
+        self.spool.append(RETWEET_RECORD, str(tweet_id))
+
+    def _next_segment(self) -> bool:
+        ''' Delete the drained segment and move to the next one once it is closed.
+            Returns True if there is more to read '''
+        segment_path = self.spool.segment_path(self.segment_index)
+        if not self.spool.is_segment_closed(self.segment_index):
+            return False
+        # records appended between the last read and the rotation
+        records, _, corrupt = read_records(segment_path, self.offset, 1)
+        if records or corrupt:
+            return True
+        later_indices = [index for index in self.spool.segment_indices() if index > self.segment_index]
+        if not later_indices and not self.spool.closed:
+            return False
+        if not later_indices:
+            # the segments of the next start are numbered from 0 again
+            self.tweet_writer.clear_spool_position(self.spool_id)
+        os.remove(segment_path)
+        if not later_indices:
+            # the spool is closed and fully drained
+            if os.path.isfile(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            return False
+        self.segment_index, self.offset = later_indices[0], 0
+        self._save_checkpoint()
+        return True
+
+    def _open_writer(self) -> None:
+        tweet_writer = self.writer_factory()
+        committed = tweet_writer.read_spool_position(self.spool_id)
+        # the checkpoint file is behind after a crash between a commit and its update
+        if committed is not None and committed > (self.segment_index, self.offset) and \
+                committed[0] in self.spool.segment_indices():
+            self.segment_index, self.offset = committed
+            self._save_checkpoint()
+        self.tweet_writer = tweet_writer
+
+    def _write_records(self, records: List[Tuple[bytes, object]], offset: int) -> None:
+        # spools of runs with and without --dedupe differ by the seen_retweets column
+        n_columns = len(self.tweet_writer.columns)
+        rows = [row[:n_columns] + (0,) * (n_columns - len(row))
+                for kind, row in records if kind == ROW_RECORD]
+        retweet_counts = {}
+        for kind, tweet_id in records:
+            if kind == RETWEET_RECORD:
+                retweet_counts[tweet_id] = retweet_counts.get(tweet_id, 0) + 1
+        spool_position = (self.spool_id, self.segment_index, offset)
+        try:
+            self.tweet_writer.write_rows(rows, retweet_counts=retweet_counts, spool_position=spool_position)
+        except IntegrityError:
+            # a row rejected by the table is skipped instead of the whole batch
+            for row in rows:
+                try:
+                    self.tweet_writer.write_rows([row])
+                except IntegrityError:
+                    self.duplicates_skipped += 1
+            self.tweet_writer.write_rows([], retweet_counts=retweet_counts, spool_position=spool_position)
+
+    def _drain(self) -> None:
+        backoff = 0.0
+        while not self._abort.is_set():
+            if backoff:
+                self._abort.wait(backoff)
+            try:
+                if self.tweet_writer is None:
+                    self._open_writer()
+                records, offset, corrupt = read_records(self.spool.segment_path(self.segment_index),
+                                                        self.offset, self.batch_size)
+                if records:
+                    self._write_records(records, offset)
+                    self.offset = offset
+                    self._save_checkpoint()
+                    self.records_drained += len(records)
+                elif corrupt:
+                    print(f"Skipping the corrupt end of {self.spool.segment_path(self.segment_index)}")
+                    self.corrupt_segments += 1
+                    self.offset = os.path.getsize(self.spool.segment_path(self.segment_index))
+                elif not self._next_segment():
+                    if self._closed.is_set() and self.spool.closed and \
+                            not os.path.isfile(self.spool.segment_path(self.segment_index)):
+                        break
+                    self._closed.wait(self.poll_secs)
+                if backoff:
+                    print("MySQL is reachable again, replaying the spool")
+                backoff = 0.0
+            except Error as e:
+                if not backoff:
+                    self.outages += 1
+                    print_error()
+                    print(f"{e}\nTweets are kept in {self.spool.directory} until MySQL is reachable")
+                METRICS.increment("spool_drain_errors_total")
+                backoff = min(self.max_backoff, backoff * 2 or 1.0)
+            self.backlog = self.spool.backlog_bytes(self.segment_index, self.offset)
+
+    def stats(self) -> dict:
+        return {"records_appended": self.spool.records_appended,
+                "records_drained": self.records_drained,
+                "duplicates_skipped": self.duplicates_skipped,
+                "corrupt_segments": self.corrupt_segments,
+                "outages": self.outages,
+                "backlog_bytes": self.backlog}
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print(f"Spool logged {stats['records_appended']} tweets and replayed {stats['records_drained']} "
+              + f"into MySQL ({stats['duplicates_skipped']} duplicates skipped) over "
+              + f"{stats['outages']} outages, {stats['backlog_bytes']} bytes left in {self.spool.directory}")
+
+    def close(self, drain_timeout: float = 60.0) -> None:
+        ''' Replay the rest of the spool for up to drain_timeout seconds.
+            What is left is replayed on the next start '''
+        self.spool.close()
+        self._closed.set()
+        self._drainer.join(drain_timeout)
+        if self._drainer.is_alive():
+            self._abort.set()
+            self._drainer.join()
+        if self.tweet_writer is not None:
+            self.tweet_writer.close()
+        self.print_stats()
+
+    def __enter__(self) -> 'SpooledTweetWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -3,6 +3,9 @@ Utility file containing TwitterConfig configuration data loading class
 """
 import sys
 import configparser
+from functools import lru_cache
+
+CONFIG_PATH = './twitter_configuration.ini'
 
 
 def print_error():
@@ -15,21 +18,33 @@ def print_warning():
           + f"line: {sys.exc_info()[2].tb_lineno}")
 
 
+@lru_cache(maxsize=None)
+def read_config(config_path: str = CONFIG_PATH) -> configparser.ConfigParser:
+    ''' Parse the ini file at config_path once per process '''
+    config = configparser.ConfigParser()
+    if not config.read(config_path):
+        raise FileNotFoundError(f"{config_path} not found. Generate it with setup_configuration.py")
+    return config
+
+
 class TwitterConfig:
     ''' Class that loads twitter CONSUMER_KEY and ACCESS_TOKEN from
-    configuration.ini '''
-
-    config = configparser.ConfigParser()
-    config.read('./twitter_configuration.ini')
-
-    # table where all tweet info is stored
-    MYSQL_HOST = config['MYSQL']['HOST']
-    MYSQL_TABLE = config['MYSQL']['TABLE']
-    MYSQL_DATABASE = config['MYSQL']['DATABASE']
-    MYSQL_USERNAME = config['MYSQL']['USERNAME']  # username is set to be root
-    MYSQL_PASSWORD = config['MYSQL']['PASSWORD']
-
-    CONSUMER_KEY = config['TWITTER']['CONSUMER_KEY']
-    CONSUMER_SECRET = config['TWITTER']['CONSUMER_SECRET']
-    ACCESS_TOKEN = config['TWITTER']['ACCESS_TOKEN']
-    ACCESS_TOKEN_SECRET = config['TWITTER']['ACCESS_TOKEN_SECRET']
+    configuration.ini when it is instantiated '''
+
+    def __init__(self, config_path: str = CONFIG_PATH) -> None:
+        config = read_config(config_path)
+
+        # table where all tweet info is stored
+        self.MYSQL_HOST = config['MYSQL']['HOST']
+        self.MYSQL_TABLE = config['MYSQL']['TABLE']
+        # table where the clean text and sentiment of every scored tweet is stored
+        self.MYSQL_SENTIMENT_TABLE = config['MYSQL'].get('SENTIMENT_TABLE',
+                                                         f"{self.MYSQL_TABLE}_SENTIMENT")
+        self.MYSQL_DATABASE = config['MYSQL']['DATABASE']
+        self.MYSQL_USERNAME = config['MYSQL']['USERNAME']  # username is set to be root
+        self.MYSQL_PASSWORD = config['MYSQL']['PASSWORD']
+
+        self.CONSUMER_KEY = config['TWITTER']['CONSUMER_KEY']
+        self.CONSUMER_SECRET = config['TWITTER']['CONSUMER_SECRET']
+        self.ACCESS_TOKEN = config['TWITTER']['ACCESS_TOKEN']
+        self.ACCESS_TOKEN_SECRET = config['TWITTER']['ACCESS_TOKEN_SECRET']